@@ -1,5 +1,6 @@
 from django.contrib import admin
-from club.models import Player, Game, Algorithm, Ladder, Ranking, Rating
+from club.models import Player, Game, Algorithm, Ladder, Ranking, Rating, \
+    Bye, GameJob, HeadToHead, OpeningStat, bump_version
                          
 
 class PlayerAdmin(admin.ModelAdmin):
@@ -15,7 +16,10 @@ class AlgorithmAdmin(admin.ModelAdmin):
 
 
 class LadderAdmin(admin.ModelAdmin):
-    pass
+
+    def save_model(self, request, obj, form, change):
+        super(LadderAdmin, self).save_model(request, obj, form, change)
+        bump_version(obj.id)
 
 
 class RankingAdmin(admin.ModelAdmin):
@@ -23,7 +27,38 @@ class RankingAdmin(admin.ModelAdmin):
 
 
 class RatingAdmin(admin.ModelAdmin):
-    pass
+    # Game and Ranking edits invalidate cached pages through their signals
+
+    def save_model(self, request, obj, form, change):
+        super(RatingAdmin, self).save_model(request, obj, form, change)
+        bump_version(obj.ladder_id)
+
+    def delete_model(self, request, obj):
+        super(RatingAdmin, self).delete_model(request, obj)
+        bump_version(obj.ladder_id)
+
+
+class GameJobAdmin(admin.ModelAdmin):
+    list_display = ('game', 'ladder', 'status', 'attempts', 'created',
+                    'finished')
+    list_filter = ('status',)
+
+
+class OpeningStatAdmin(admin.ModelAdmin):
+    list_display = ('ladder', 'eco', 'name', 'games', 'white_wins', 'draws',
+                    'black_wins')
+    list_filter = ('ladder',)
+
+
+class HeadToHeadAdmin(admin.ModelAdmin):
+    list_display = ('ladder', 'player', 'opponent', 'wins', 'draws',
+                    'losses', 'last_played')
+    list_filter = ('ladder',)
+
+
+class ByeAdmin(admin.ModelAdmin):
+    list_display = ('ladder', 'round', 'player')
+    list_filter = ('ladder',)
 
 
 admin.site.register(Player, PlayerAdmin)
@@ -32,3 +67,7 @@ admin.site.register(Algorithm, AlgorithmAdmin)
 admin.site.register(Ladder, LadderAdmin)
 admin.site.register(Ranking, RankingAdmin)
 admin.site.register(Rating, RatingAdmin)
+admin.site.register(GameJob, GameJobAdmin)
+admin.site.register(OpeningStat, OpeningStatAdmin)
+admin.site.register(HeadToHead, HeadToHeadAdmin)
+admin.site.register(Bye, ByeAdmin)
@@ -0,0 +1,103 @@
+"""
+Streaming export of a ladder's processed public games as PGN or CSV.
+
+Games are read in keyset chunks by id, so exporting a ladder of any size holds
+one chunk in memory at a time; every function here is a generator of text.
+"""
+import csv
+from django.utils import six
+from club.pgn import TAG
+
+CHUNK_SIZE = 1000
+
+CSV_COLUMNS = ('id', 'datetime', 'round', 'white', 'black', 'result',
+               'white_rating', 'black_rating', 'time_control', 'eco')
+
+
+def iter_games(ladder, chunk_size=CHUNK_SIZE):
+    # the export is anonymous: private games stay behind the login of the
+    # game pages
+    games = ladder.game_set.filter(status=4, visible=0).select_related(
+        'white__user', 'black__user').order_by('id')
+    last = 0
+    while True:
+        count = 0
+        for game in games.filter(id__gt=last)[:chunk_size].iterator():
+            count += 1
+            last = game.id
+            yield game
+        if count < chunk_size:
+            break
+
+
+def movetext(game):
+    """The moves of the game's stored PGN, without its tag pairs"""
+    if not game.pgn:
+        return game.get_result_display()
+    lines = [line.strip() for line in game.pgn.splitlines()]
+    return '\n'.join(line for line in lines
+                     if line and not TAG.match(line))
+
+
+def pgn_tag(name, value):
+    value = six.text_type('' if value is None else value)
+    return '[%s "%s"]' % (name, value.replace('\\', '\\\\')
+                          .replace('"', '\\"'))
+
+
+def game_pgn(game, ladder):
+    tags = [
+        ('Event', ladder.name),
+        ('Site', ladder.location or '?'),
+        ('Date', game.datetime.strftime('%Y.%m.%d') if game.datetime
+         else '????.??.??'),
+        ('Round', game.round if game.round is not None else '-'),
+        ('White', game.white.user.username),
+        ('Black', game.black.user.username),
+        ('Result', game.get_result_display()),
+    ]
+    for name, value in (('WhiteElo', game.white_rating),
+                        ('BlackElo', game.black_rating),
+                        ('TimeControl', game.time_control),
+                        ('ECO', game.eco)):
+        if value:
+            tags.append((name, value))
+    if game.datetime:
+        tags.append(('Time', game.datetime.strftime('%H:%M:%S')))
+    return '\n'.join(pgn_tag(name, value) for name, value in tags) + \
+        '\n\n' + movetext(game) + '\n\n'
+
+
+def export_pgn(ladder):
+    for game in iter_games(ladder):
+        yield game_pgn(game, ladder)
+
+
+class Echo(object):
+    """File-like object whose write() returns the value, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    value = six.text_type('' if value is None else value)
+    return value.encode('utf-8') if six.PY2 else value
+
+
+def export_csv(ladder):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for game in iter_games(ladder):
+        yield writer.writerow([_csv_value(value) for value in (
+            game.id,
+            game.datetime.isoformat() if game.datetime else None,
+            game.round, game.white.user.username, game.black.user.username,
+            game.get_result_display(), game.white_rating, game.black_rating,
+            game.time_control, game.eco)])
+
+
+FORMATS = {
+    'pgn': (export_pgn, 'application/x-chess-pgn'),
+    'csv': (export_csv, 'text/csv'),
+}
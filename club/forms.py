@@ -1,32 +1,95 @@
 from django import forms
-from club.models import Game, Ladder, Ranking
+from club.models import Game, Player, Ranking
 
 
 class PGNForm(forms.Form):
     pgn_string = forms.CharField(widget=forms.Textarea)
 
 
+class PlayerField(forms.ModelChoiceField):
+    """
+    A player entered by username in a text box, instead of a select listing
+    every player. The report page suggests usernames from the ladder's
+    players.json endpoint. Usernames match case-insensitively, like the
+    suggestions; an exact match wins over others differing only in case.
+    """
+    default_error_messages = {
+        'invalid_choice': 'There is no player named "%(value)s".',
+        'ambiguous': 'Several players are named "%(value)s" in different '
+                     'cases; enter the username exactly.',
+    }
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('widget', forms.TextInput(attrs={
+            'class': 'player-autocomplete', 'list': 'player-suggestions',
+            'autocomplete': 'off'}))
+        super(PlayerField, self).__init__(
+            queryset=Player.objects.all(), to_field_name='user__username',
+            **kwargs)
+
+    def prepare_value(self, value):
+        if isinstance(value, Player):
+            return value.user.username
+        return super(PlayerField, self).prepare_value(value)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        value = value.strip()
+        players = list(self.queryset.filter(
+            user__username__iexact=value).select_related('user'))
+        exact = [player for player in players if player.user.username == value]
+        if exact:
+            return exact[0]
+        if len(players) == 1:
+            return players[0]
+        code = 'ambiguous' if players else 'invalid_choice'
+        raise forms.ValidationError(self.error_messages[code], code=code,
+                                    params={'value': value})
+
+
 class GameForm(forms.ModelForm):
+    """
+    A game report on `ladder`, the ladder of the report page; the players
+    must both have joined it.
+    """
+    white = PlayerField()
+    black = PlayerField()
     datetime = forms.DateTimeField()
-    ladder = forms.ModelChoiceField(queryset=Ladder.objects.filter(ladder_type=0))
+
+    def __init__(self, *args, **kwargs):
+        self.ladder = kwargs.pop('ladder')
+        super(GameForm, self).__init__(*args, **kwargs)
+        # only paired tournament games are saved without a result
+        self.fields['result'].required = True
 
     def clean(self):
         cleaned_data = super(GameForm, self).clean()
-        white = cleaned_data['white']
-        black = cleaned_data['black']
-        ladder = cleaned_data['ladder']
-        players = [ranking.player for ranking in Ranking.objects.filter(ladder=ladder)]
+        if self.ladder.ladder_type == 1:
+            raise forms.ValidationError('Tournament results are entered on '
+                                        'the page of the paired game.')
+        white = cleaned_data.get('white')
+        black = cleaned_data.get('black')
+        if white is None or black is None:
+            return cleaned_data
         if white == black:
             raise forms.ValidationError('You cannot report a game against yourself!')
-        if white not in players or black not in players:
+        joined = Ranking.objects.filter(
+            ladder=self.ladder, player__in=[white, black]).count()
+        if joined != 2:
             raise forms.ValidationError('One or more of the players has not joined the ladder.')
         return cleaned_data
 
     class Meta:
         model = Game
         fields = ('white', 'black', 'time_control', 'result', 'datetime')
-        hidden_fields = ('ladder', 'status')
+        hidden_fields = ('status',)
   
 class ConfirmGameForm(forms.Form):
     response = forms.ChoiceField(choices=((0, 'Confirm'), (1, 'Dispute')), widget=forms.Select())
-    
+
+
+class ResultForm(forms.Form):
+    """The result of a paired tournament game"""
+    result = forms.TypedChoiceField(
+        choices=Game._meta.get_field('result').choices, coerce=int)
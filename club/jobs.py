@@ -0,0 +1,138 @@
+"""
+Worker side of the game processing queue.
+
+Confirming a game only records a GameJob (see models.set_rankings); the
+process_games management command runs the rating and ranking work here, one
+job at a time per ladder and in parallel across ladders.
+"""
+import datetime
+import logging
+import traceback
+from django.db import models, transaction
+from django.db.models import Q
+from django.utils import timezone
+from club.models import Game, GameJob, Ladder, process_game
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = 0, 1, 2, 3
+
+MAX_ATTEMPTS = 5
+
+# A running job whose worker has not finished it after this long is assumed
+# to belong to a dead worker and is handed out again.
+RUNNING_TIMEOUT = datetime.timedelta(minutes=10)
+
+
+def retry_delay(attempts):
+    """Backoff before the next attempt of a job that failed `attempts` times"""
+    return datetime.timedelta(seconds=min(2 ** attempts * 5, 600))
+
+
+def claim_job(now=None):
+    """
+    Mark the oldest available job as running and return it, skipping ladders
+    that already have a job running, or return None when there is nothing to
+    do. Safe to call from several workers at once.
+    """
+    now = now or timezone.now()
+    stale = now - RUNNING_TIMEOUT
+    skipped = set()
+    for attempt in range(10):
+        with transaction.atomic():
+            busy = GameJob.objects.filter(
+                status=RUNNING, started__gt=stale).values('ladder')
+            # the row lock makes concurrent workers wait for this claim and
+            # then skip the job
+            job = GameJob.objects.select_for_update().filter(
+                Q(status=QUEUED, available_at__lte=now) |
+                Q(status=RUNNING, started__lte=stale)).exclude(
+                ladder__in=busy).exclude(ladder__in=skipped).order_by(
+                'created', 'id').first()
+            if job is None:
+                return None
+            # Claims on one ladder are serialized on its row. Once it is
+            # locked, a claim committed by another worker since the query
+            # above is visible: check again that the ladder is idle.
+            list(Ladder.objects.select_for_update().filter(
+                id=job.ladder_id).values_list('id'))
+            if GameJob.objects.filter(
+                    ladder=job.ladder_id, status=RUNNING,
+                    started__gt=stale).exclude(id=job.id).exists():
+                skipped.add(job.ladder_id)
+                continue
+            job.status, job.started, job.attempts = \
+                RUNNING, now, job.attempts + 1
+            GameJob.objects.filter(id=job.id).update(
+                status=RUNNING, started=now, attempts=job.attempts)
+            return job
+    return None
+
+
+def run_job(job):
+    """Process the job's game, recording success or scheduling a retry"""
+    try:
+        with transaction.atomic():
+            game = Game.objects.select_for_update().get(id=job.game_id)
+            if game.status == 3:
+                process_game(game)
+    except Exception:
+        error = traceback.format_exc()
+        logger.exception('Processing game %d failed (attempt %d)',
+                         job.game_id, job.attempts)
+        now = timezone.now()
+        if job.attempts >= MAX_ATTEMPTS:
+            GameJob.objects.filter(id=job.id).update(
+                status=FAILED, finished=now, last_error=error)
+        else:
+            GameJob.objects.filter(id=job.id).update(
+                status=QUEUED, available_at=now + retry_delay(job.attempts),
+                last_error=error)
+        return False
+    GameJob.objects.filter(id=job.id).update(
+        status=DONE, finished=timezone.now())
+    return True
+
+
+def work(stop=None):
+    """
+    Process jobs until the queue is empty (or `stop`, a threading.Event, is
+    set). Returns the number of jobs run.
+    """
+    count = 0
+    while stop is None or not stop.is_set():
+        job = claim_job()
+        if job is None:
+            break
+        run_job(job)
+        count += 1
+    return count
+
+
+def queue_report(since=None):
+    """Queue depth per status and processing latency of recent jobs"""
+    now = timezone.now()
+    since = since or now - datetime.timedelta(hours=1)
+    depth = dict(GameJob.objects.order_by().values_list('status').annotate(
+        models.Count('id')))
+    oldest = GameJob.objects.filter(status=QUEUED).aggregate(
+        models.Min('created'))['created__min']
+    latencies = sorted(
+        (finished - created).total_seconds()
+        for created, finished in GameJob.objects.filter(
+            status=DONE, finished__gte=since).values_list(
+            'created', 'finished'))
+    report = {
+        'queued': depth.get(QUEUED, 0),
+        'running': depth.get(RUNNING, 0),
+        'done': depth.get(DONE, 0),
+        'failed': depth.get(FAILED, 0),
+        'oldest_queued_age': (now - oldest).total_seconds()
+        if oldest else None,
+        'recent_jobs': len(latencies),
+    }
+    if latencies:
+        report['latency_p50'] = latencies[len(latencies) // 2]
+        report['latency_p95'] = latencies[int(len(latencies) * 0.95)]
+        report['latency_max'] = latencies[-1]
+    return report
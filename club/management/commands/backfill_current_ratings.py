@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from club.models import Ladder, Ranking, latest_ratings
+
+
+class Command(BaseCommand):
+    help = ('Fill Ranking.current_rating from the latest Rating of each '
+            'player on each ladder.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('ladder_ids', nargs='*', type=int,
+                            help='Only backfill these ladders (default: all)')
+
+    def handle(self, *args, **options):
+        ladders = Ladder.objects.all()
+        if options['ladder_ids']:
+            ladders = ladders.filter(id__in=options['ladder_ids'])
+
+        for ladder in ladders:
+            latest = latest_ratings(ladder)
+            with transaction.atomic():
+                updated = 0
+                for ranking in ladder.ranking_set.all():
+                    current = latest.get((ranking.player_id, ladder.id))
+                    if ranking.current_rating != current:
+                        Ranking.objects.filter(id=ranking.id).update(
+                            current_rating=current)
+                        updated += 1
+            self.stdout.write('%s: %d ranking(s) updated' % (ladder, updated))
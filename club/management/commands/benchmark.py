@@ -0,0 +1,126 @@
+import json
+import platform
+import time
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from club.models import Game, bump_version, crunch_ratings, insert, \
+    process_game
+from club.synthetic import generate_ladder
+from club.views import LadderDetailView
+
+
+class Rollback(Exception):
+    pass
+
+
+def measure(func):
+    """Wall time and number of SQL queries of func()"""
+    with CaptureQueriesContext(connection) as queries:
+        started = time.time()
+        func()
+        seconds = time.time() - started
+    return {'seconds': round(seconds, 4), 'queries': len(queries)}
+
+
+def ranked_players(ladder):
+    """Players of a ladder, top first"""
+    order = 'rank_key' if ladder.sparse_ranks else 'rank'
+    return [ranking.player for ranking in ladder.ranking_set.filter(
+        is_active=True).select_related('player').order_by(order)]
+
+
+class Command(BaseCommand):
+    help = ('Time the rating and rank hot paths on synthetic ladders of '
+            'several sizes and save wall times and SQL query counts as '
+            'JSON. The ladders are rolled back afterwards unless --keep.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int,
+                            default=[100, 1000, 10000],
+                            help='Numbers of players (default: 100 1000 '
+                                 '10000)')
+        parser.add_argument('--games-per-player', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--method', default='fide',
+                            help='Rating algorithm of the ladders')
+        parser.add_argument('--sparse', action='store_true',
+                            help='Use sparse rank mode')
+        parser.add_argument('--output',
+                            help='JSON file to write (default: stdout)')
+        parser.add_argument('--keep', action='store_true',
+                            help='Keep the generated ladders')
+
+    def handle(self, *args, **options):
+        if min(options['sizes']) < 2:
+            raise CommandError('Ladders need at least 2 players')
+        report = {
+            'started': timezone.now().isoformat(),
+            'seed': options['seed'],
+            'method': options['method'],
+            'rank_mode': 'sparse' if options['sparse'] else 'dense',
+            'database': connection.vendor,
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'runs': [],
+        }
+        for size in options['sizes']:
+            try:
+                with transaction.atomic():
+                    report['runs'].append(self.run(size, options))
+                    if not options['keep']:
+                        raise Rollback
+            except Rollback:
+                pass
+            self.stderr.write('%d players done' % size)
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def run(self, size, options):
+        games = size * options['games_per_player']
+        started = time.time()
+        ladder = generate_ladder(size, games, options['seed'],
+                                 options['method'],
+                                 rank_mode=1 if options['sparse'] else 0)
+        steps = {'generate': {'seconds': round(time.time() - started, 4)}}
+
+        steps['full replay'] = measure(lambda: crunch_ratings(ladder))
+
+        players = ranked_players(ladder)
+        with override_settings(CLUB_GAME_QUEUE=True):
+            # only queued here: processing is what is timed
+            game = Game.objects.create(white=players[-1], black=players[-2],
+                                       ladder=ladder, result=0, status=3)
+
+        def process():
+            with transaction.atomic():
+                process_game(game)
+        steps['process confirmed game'] = measure(process)
+
+        # each move: the player at position `mover` goes above `target`
+        for name, target, mover in (('rank shift at top', 0, 1),
+                                    ('rank shift at bottom', -2, -1),
+                                    ('rank shift bottom to top', 0, -1)):
+            players = ranked_players(ladder)
+            steps[name] = measure(lambda: insert(
+                players[target], players[mover], ladder, above=True))
+
+        request = RequestFactory().get('/ladders/%d' % ladder.id)
+        request.user = players[0].user
+
+        def render():
+            # a new version misses the cached fragment
+            bump_version(ladder.id)
+            LadderDetailView.as_view()(request, pk=ladder.id).render()
+        steps['standings page'] = measure(render)
+
+        return {'players': size, 'games': games, 'ladder': ladder.id,
+                'steps': steps}
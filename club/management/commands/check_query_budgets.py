@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.test import Client
+from django.test.utils import override_settings
+from club.models import Game, Ladder, Player
+
+
+def sample_paths():
+    """A page of each budgeted view, for the first ladder, game and player"""
+    paths = [reverse('ladder-list'), reverse('player-list'),
+             reverse('game-list'), reverse('profile')]
+    ladder = Ladder.objects.order_by('id').first()
+    if ladder is not None:
+        paths += [reverse(name, kwargs={'pk': ladder.id}) for name in (
+            'ladder-detail', 'tourney-detail', 'ladder-games',
+            'tourney-games', 'ladder-openings', 'ladder-ratings',
+            'ladder-players')]
+    game = Game.objects.order_by('id').first()
+    if game is not None:
+        paths.append(reverse('game-detail', kwargs={'pk': game.id}))
+    player = Player.objects.order_by('id').first()
+    if player is not None:
+        paths.append(reverse('player-detail', kwargs={'pk': player.id}))
+    return paths
+
+
+class Command(BaseCommand):
+    help = ('Request pages with the request timing middleware and fail if '
+            'any view runs more queries than its CLUB_QUERY_BUDGETS entry. '
+            'Meant for CI, against a database with some data (see the '
+            'benchmark command\'s --keep).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*',
+                            help='Paths to request (default: one page of '
+                                 'each view)')
+        parser.add_argument('--username',
+                            help='Request the pages logged in as this user')
+
+    def handle(self, *args, **options):
+        with override_settings(CLUB_REQUEST_TIMING=True,
+                               CLUB_QUERY_BUDGETS_STRICT=False):
+            client = Client()
+            if options['username']:
+                client.force_login(
+                    User.objects.get(username=options['username']))
+            over = 0
+            for path in options['paths'] or sample_paths():
+                response = client.get(path + '?q=a' if path.endswith(
+                    'players.json') else path)
+                timing = getattr(response, 'timing', None)
+                if timing is None:
+                    self.stdout.write('  ?  %s (%d)' % (
+                        path, response.status_code))
+                    continue
+                budget = settings.CLUB_QUERY_BUDGETS.get(timing['view'])
+                failed = budget is not None and timing['queries'] > budget
+                over += failed
+                self.stdout.write('%s %3d/%s  %s (%s, %d)' % (
+                    'FAIL' if failed else ' ok ', timing['queries'],
+                    budget if budget is not None else '-', path,
+                    timing['view'], response.status_code))
+        if over:
+            raise CommandError('%d page(s) over their query budget' % over)
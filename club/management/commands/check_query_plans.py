@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from club.queryplans import check_plans
+
+
+class Command(BaseCommand):
+    help = ('EXPLAIN the hot queries on the current database and fail if '
+            'any of them needs a full table scan or an avoidable sort. Run '
+            'after migrating, e.g. in CI.')
+
+    def handle(self, *args, **options):
+        failed = 0
+        for query, plan, problems in check_plans():
+            status = 'FAIL' if problems else 'ok'
+            self.stdout.write('%-4s %s' % (status, query.name))
+            if problems or options['verbosity'] > 1:
+                for line in plan:
+                    self.stdout.write('       %s' % line)
+            failed += bool(problems)
+        if failed:
+            raise CommandError('%d hot quer%s without a usable index' % (
+                failed, 'y' if failed == 1 else 'ies'))
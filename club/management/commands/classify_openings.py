@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import models
+from club.models import Game, Ladder, case_update, refresh_opening_stats
+from club.openings import classify
+
+CHUNK_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = ('Set the ECO code of games from their PGN using the opening '
+            'table, then rebuild the opening statistics of every ladder.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--overwrite', action='store_true',
+                            help='Also reclassify games that already have an '
+                                 'ECO code')
+
+    def handle(self, *args, **options):
+        games = Game.objects.exclude(pgn__isnull=True).exclude(pgn='')
+        if not options['overwrite']:
+            games = games.filter(models.Q(eco__isnull=True) | models.Q(eco=''))
+        games = games.order_by('id')
+
+        seen = classified = 0
+        last = 0
+        while True:
+            rows = list(games.filter(id__gt=last).values_list(
+                'id', 'pgn', 'eco')[:CHUNK_SIZE])
+            if not rows:
+                break
+            last = rows[-1][0]
+            seen += len(rows)
+            changes = []
+            for pk, pgn, eco in rows:
+                opening = classify(pgn)
+                if opening is not None and opening[0] != eco:
+                    changes.append((pk, opening[0]))
+            # a queryset update: the opening tables are rebuilt below
+            case_update(Game, changes, [('eco', models.CharField())])
+            classified += len(changes)
+
+        for ladder_id in Ladder.objects.values_list('id', flat=True):
+            refresh_opening_stats(ladder_id)
+        self.stdout.write('%d of %d games with moves classified' % (
+            classified, seen))
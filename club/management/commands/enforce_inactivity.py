@@ -0,0 +1,43 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+from club.models import Ladder, enforce_inactivity, inactivity_demotions, \
+    last_games
+
+
+class Command(BaseCommand):
+    help = ('Drop every ranking that has been inactive for its ladder\'s '
+            'inactivity_period by demotion_inc places. Meant to be run on a '
+            'schedule, e.g. daily.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report the planned moves without applying '
+                                 'them')
+
+    def handle(self, *args, **options):
+        started = time.time()
+        now = timezone.now()
+        ladders = list(Ladder.objects.filter(
+            Q(end_date=None) | Q(end_date__gte=now.date()),
+            inactivity_period__isnull=False, demotion_inc__gt=0))
+        last_played = last_games(ladders)
+
+        for ladder in ladders:
+            ladder_started = time.time()
+            if options['dry_run']:
+                dropped, before, order = inactivity_demotions(ladder, now, last_played)
+            else:
+                dropped, before, order = enforce_inactivity(ladder, now, last_played)
+            if dropped:
+                names = dict(ladder.ranking_set.filter(
+                    id__in=dropped).values_list('id', 'player__user__username'))
+                for pk in dropped:
+                    self.stdout.write('  %s: #%d -> #%d' % (
+                        names[pk], before.index(pk) + 1, order.index(pk) + 1))
+            self.stdout.write('%s: %d ranking(s) %s in %.3fs' % (
+                ladder, len(dropped),
+                'to demote' if options['dry_run'] else 'demoted',
+                time.time() - ladder_started))
+        self.stdout.write('Done in %.3fs' % (time.time() - started))
@@ -0,0 +1,33 @@
+import io
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import six
+from club.export import FORMATS
+from club.models import Ladder
+
+
+class Command(BaseCommand):
+    help = 'Write all processed games of a ladder as PGN or CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ladder_id', type=int)
+        parser.add_argument('--format', choices=sorted(FORMATS),
+                            default='pgn')
+        parser.add_argument('--output', help='File to write (default: stdout)')
+
+    def handle(self, *args, **options):
+        try:
+            ladder = Ladder.objects.get(id=options['ladder_id'])
+        except Ladder.DoesNotExist:
+            raise CommandError('No ladder with id %s' % options['ladder_id'])
+
+        generate = FORMATS[options['format']][0]
+        if options['output']:
+            # the Python 2 csv module produces encoded bytes
+            binary = six.PY2 and options['format'] == 'csv'
+            with io.open(options['output'], 'wb' if binary else 'w',
+                         **({} if binary else {'encoding': 'utf-8'})) as out:
+                for chunk in generate(ladder):
+                    out.write(chunk)
+        else:
+            for chunk in generate(ladder):
+                self.stdout.write(chunk, ending='')
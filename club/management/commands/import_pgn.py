@@ -0,0 +1,128 @@
+import datetime
+import io
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from club.models import Game, Ladder, Player, Ranking, bump_version, \
+    explicit_game_datetimes, rebuild_head_to_head, refresh_opening_stats
+from club.pgn import RESULTS, read_games
+from club.replay import replay_counters, replay_ladder, replay_ranks
+
+BATCH_SIZE = 1000
+
+
+def pgn_datetime(headers):
+    """
+    Game time from the Date and Time tags, or None without a valid date. An
+    unknown or invalid time defaults to noon.
+    """
+    # wrong part counts raise TypeError, impossible dates ValueError
+    try:
+        date = datetime.date(*[int(part) for part in
+                               headers.get('Date', '').split('.')])
+    except (TypeError, ValueError):
+        return None
+    try:
+        clock = datetime.time(*[int(part) for part in
+                                headers.get('Time', '').split(':')])
+    except (TypeError, ValueError):
+        clock = datetime.time(12)
+    return timezone.make_aware(datetime.datetime.combine(date, clock),
+                               timezone.utc)
+
+
+class Command(BaseCommand):
+    help = ('Import historical games from a PGN file into a ladder. Games are '
+            'stored as processed without going through the game signals; '
+            'ratings and ranks are replayed once at the end.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='PGN file')
+        parser.add_argument('--ladder', type=int, required=True,
+                            help='Ladder id to import the games into')
+        parser.add_argument('--no-replay', action='store_true',
+                            help='Skip the rating and rank replay')
+
+    def handle(self, *args, **options):
+        try:
+            ladder = Ladder.objects.get(id=options['ladder'])
+        except Ladder.DoesNotExist:
+            raise CommandError('No ladder with id %s' % options['ladder'])
+
+        players = dict(Player.objects.values_list('user__username', 'id'))
+        joined = set(ladder.ranking_set.values_list('player_id', flat=True))
+        started = time.time()
+        stats = {'read': 0, 'imported': 0, 'skipped': 0}
+        batch = []
+
+        with io.open(options['path'], encoding='utf-8',
+                     errors='replace') as lines, \
+                explicit_game_datetimes(), transaction.atomic():
+            for game in read_games(lines):
+                stats['read'] += 1
+                row = self.build_game(game, ladder, players, stats)
+                if row is None:
+                    continue
+                for player_id in (row.white_id, row.black_id):
+                    if player_id not in joined:
+                        Ranking.objects.create(player_id=player_id,
+                                               ladder=ladder)
+                        joined.add(player_id)
+                batch.append(row)
+                if len(batch) >= BATCH_SIZE:
+                    self.flush(batch, stats, started)
+            self.flush(batch, stats, started)
+            rebuild_head_to_head(ladder.id)
+            refresh_opening_stats(ladder.id)
+            # the replay rebuilds them too, but counters are cheap
+            replay_counters(ladder)
+            bump_version(ladder.id)
+
+        parsed = time.time()
+        self.stdout.write('Imported %(imported)d of %(read)d games '
+                          '(%(skipped)d skipped)' % stats)
+        self.stdout.write('Parse and insert: %.1fs, %.0f games/s' % (
+            parsed - started, stats['read'] / max(parsed - started, 1e-6)))
+
+        if not options['no_replay']:
+            replayed = replay_ladder(ladder)
+            moved = replay_ranks(ladder)
+            finished = time.time()
+            self.stdout.write(
+                'Replay: %d games, %d rankings moved in %.1fs, %.0f games/s'
+                % (replayed, moved, finished - parsed,
+                   replayed / max(finished - parsed, 1e-6)))
+
+    def build_game(self, game, ladder, players, stats):
+        headers = game.headers
+        result = RESULTS.get(headers.get('Result'))
+        white = players.get(headers.get('White'))
+        black = players.get(headers.get('Black'))
+        moment = pgn_datetime(headers)
+        if result is None or white is None or black is None or \
+                white == black or moment is None:
+            stats['skipped'] += 1
+            self.stderr.write('Skipping game %d: %s - %s %s (%s)' % (
+                stats['read'], headers.get('White'), headers.get('Black'),
+                headers.get('Result'), headers.get('Date')))
+            return None
+        try:
+            round_number = int(headers.get('Round', ''))
+        except ValueError:
+            round_number = None
+        pgn = game.text if len(game.text) <= 2500 else None
+        return Game(white_id=white, black_id=black, result=result,
+                    ladder=ladder, datetime=moment, round=round_number,
+                    time_control=headers.get('TimeControl', '')[:25] or None,
+                    eco=headers.get('ECO', '')[:50] or None, pgn=pgn,
+                    status=4)
+
+    def flush(self, batch, stats, started):
+        if batch:
+            Game.objects.bulk_create(batch)
+            stats['imported'] += len(batch)
+            del batch[:]
+            self.stdout.write('%d games, %.0f games/s' % (
+                stats['imported'],
+                stats['imported'] / max(time.time() - started, 1e-6)))
@@ -0,0 +1,48 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from club.models import Ladder, Player
+from club.swiss import PairingError, create_round, pair_round, \
+    tournament_snapshot
+
+
+class Command(BaseCommand):
+    help = ('Pair the next round of a tournament and create its games. '
+            'Refuses while games of the last round have no confirmed '
+            'result, unless --force.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('ladder_id', type=int)
+        parser.add_argument('--force', action='store_true',
+                            help='Pair even if the last round is unfinished')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Print the pairings without creating games')
+
+    def handle(self, *args, **options):
+        ladder = Ladder.objects.filter(id=options['ladder_id'],
+                                       ladder_type=1).first()
+        if ladder is None:
+            raise CommandError('No tournament with id %d'
+                               % options['ladder_id'])
+
+        started = time.time()
+        try:
+            if options['dry_run']:
+                snapshot = tournament_snapshot(ladder)
+                round, pairing = snapshot.next_round, pair_round(snapshot)
+            else:
+                round, pairing = create_round(ladder, force=options['force'])
+        except PairingError as e:
+            raise CommandError(str(e))
+        seconds = time.time() - started
+
+        names = dict(Player.objects.filter(
+            ranking__ladder=ladder).values_list('id', 'user__username'))
+        self.stdout.write('%s, round %d%s:' % (
+            ladder, round, ' (dry run)' if options['dry_run'] else ''))
+        for board, (white, black) in enumerate(pairing.boards):
+            self.stdout.write('%4d. %s - %s' % (board + 1, names[white],
+                                                names[black]))
+        if pairing.bye is not None:
+            self.stdout.write('Bye: %s' % names[pairing.bye])
+        self.stderr.write('Paired %d board(s) in %.3fs'
+                          % (len(pairing.boards), seconds))
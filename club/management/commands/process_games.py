@@ -0,0 +1,52 @@
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from club import jobs
+
+
+class Command(BaseCommand):
+    help = ('Rate and rank confirmed games from the game queue. Runs until '
+            'interrupted unless --once is given.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2,
+                            help='Parallel workers; each ladder is still '
+                                 'processed one game at a time')
+        parser.add_argument('--poll', type=float, default=2.0,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty')
+        parser.add_argument('--report', action='store_true',
+                            help='Print queue depth and latency, then exit')
+
+    def handle(self, *args, **options):
+        if options['report']:
+            for key, value in sorted(jobs.queue_report().items()):
+                self.stdout.write('%s: %s' % (key, value))
+            return
+
+        stop = threading.Event()
+
+        def worker():
+            try:
+                while not stop.is_set():
+                    jobs.work(stop)
+                    if options['once']:
+                        break
+                    stop.wait(options['poll'])
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker)
+                   for i in range(options['workers'])]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            stop.set()
+            for thread in threads:
+                thread.join()
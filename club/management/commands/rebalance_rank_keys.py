@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from club.models import Ladder, rebalance_rank_keys
+
+
+class Command(BaseCommand):
+    help = ('Respace the rank keys of ladders in sparse rank mode and '
+            'refresh their stored 1..N ranks. Run periodically, and once '
+            'after switching a ladder to sparse mode.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('ladder_ids', nargs='*', type=int,
+                            help='Only rebalance these ladders (default: all '
+                                 'sparse ladders)')
+
+    def handle(self, *args, **options):
+        ladders = Ladder.objects.filter(rank_mode=1)
+        if options['ladder_ids']:
+            ladders = ladders.filter(id__in=options['ladder_ids'])
+
+        for ladder in ladders:
+            count = rebalance_rank_keys(ladder)
+            self.stdout.write('%s: %d ranking(s) respaced' % (ladder, count))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from club.models import Ladder, rebuild_head_to_head
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the head-to-head records of ladders from their '
+            'processed games.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('ladder_ids', nargs='*', type=int,
+                            help='Only rebuild these ladders (default: all)')
+
+    def handle(self, *args, **options):
+        ladders = Ladder.objects.all()
+        if options['ladder_ids']:
+            ladders = ladders.filter(id__in=options['ladder_ids'])
+
+        for ladder in ladders:
+            count = rebuild_head_to_head(ladder.id)
+            self.stdout.write('%s: %d pair(s)' % (ladder, count))
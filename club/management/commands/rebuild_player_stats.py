@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from club.models import Ladder, lock_ladder
+from club.replay import replay_counters
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the game counters of every ranking (games played, '
+            'wins, draws, losses, streak and last game) from the processed '
+            'games.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('ladder_ids', nargs='*', type=int,
+                            help='Only rebuild these ladders (default: all)')
+
+    def handle(self, *args, **options):
+        ladders = Ladder.objects.all()
+        if options['ladder_ids']:
+            ladders = ladders.filter(id__in=options['ladder_ids'])
+
+        for ladder in ladders:
+            with transaction.atomic():
+                lock_ladder(ladder)
+                updated = replay_counters(ladder)
+            self.stdout.write('%s: %d ranking(s) updated' % (ladder, updated))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from club.models import Ladder, recompute_ratings, replay_ratings
+
+
+class Command(BaseCommand):
+    help = ('Incrementally recompute a ladder\'s ratings, replaying only the '
+            'games from the earliest stale one (or from --since).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('ladder_ids', nargs='*', type=int,
+                            help='Only replay these ladders (default: all)')
+        parser.add_argument('--since',
+                            help='Replay every game at or after this '
+                                 'datetime instead of detecting stale games')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError('Invalid datetime: %s' % options['since'])
+
+        ladders = Ladder.objects.all()
+        if options['ladder_ids']:
+            ladders = ladders.filter(id__in=options['ladder_ids'])
+
+        for ladder in ladders:
+            if since is None:
+                replayed = recompute_ratings(ladder)
+            else:
+                replayed = replay_ratings(ladder, since)
+            self.stdout.write('%s: %d game(s) replayed' % (ladder, replayed))
@@ -0,0 +1,234 @@
+"""
+Counters and latency histograms for the rating and ranking pipeline.
+
+Every process keeps its metrics in memory and writes them to its own file in
+settings.CLUB_METRICS_DIR at most every FLUSH_INTERVAL seconds (and at
+exit), so recording a value costs a clock read and a dict update. The
+staff-only /metrics view merges the files of all processes (web workers and
+the process_games worker) into the Prometheus text format. Files of
+processes that have exited keep counting towards the totals, like any
+Prometheus counter; clear the directory on deploy to reset them.
+"""
+import atexit
+import functools
+import glob
+import json
+import os
+import threading
+import time
+from django.conf import settings
+
+FLUSH_INTERVAL = 10
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60)
+
+REGISTRY = {}
+
+_values = {}
+_lock = threading.Lock()
+_last_flush = [time.time()]
+_algorithms = {}
+
+
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name, self.help = name, help
+        REGISTRY[name] = self
+
+    def inc(self, amount=1, **labels):
+        key = (self.name, tuple(sorted(labels.items())))
+        with _lock:
+            _values[key] = _values.get(key, 0) + amount
+        _maybe_flush()
+
+
+class Histogram(object):
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.buckets = name, help, buckets
+        REGISTRY[name] = self
+
+    def observe(self, value, **labels):
+        key = (self.name, tuple(sorted(labels.items())))
+        with _lock:
+            # per-bucket (not cumulative) counts, then sum and count
+            row = _values.get(key)
+            if row is None:
+                row = _values[key] = [0] * (len(self.buckets) + 3)
+            i = 0
+            while i < len(self.buckets) and value > self.buckets[i]:
+                i += 1
+            row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+        _maybe_flush()
+
+    def time(self, labels):
+        """
+        Decorator timing each call. `labels` is called with the function's
+        arguments and returns the labels of the observation.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.time()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(time.time() - started,
+                                 **labels(*args, **kwargs))
+            return wrapper
+        return decorator
+
+
+def algorithm_name(algorithm_id):
+    """Method of an Algorithm, cached per process"""
+    if algorithm_id not in _algorithms:
+        from club.models import Algorithm
+        _algorithms[algorithm_id] = Algorithm.objects.filter(
+            id=algorithm_id).values_list('method', flat=True).first()
+    return _algorithms[algorithm_id]
+
+
+def ladder_labels(ladder):
+    return {'ladder': str(ladder.id),
+            'algorithm': algorithm_name(ladder.algorithm_id) or ''}
+
+
+#####
+# Storage
+#####
+
+
+def metrics_dir():
+    return getattr(settings, 'CLUB_METRICS_DIR', None)
+
+
+def _process_file(directory):
+    # the start time keeps a recycled pid from overwriting an old file
+    if not hasattr(_process_file, 'name'):
+        _process_file.name = 'metrics-%d-%d.json' % (os.getpid(),
+                                                      int(time.time()))
+    return os.path.join(directory, _process_file.name)
+
+
+def flush():
+    """Write this process's metrics to its file"""
+    directory = metrics_dir()
+    if not directory:
+        return
+    with _lock:
+        rows = [[name, list(labels), value]
+                for (name, labels), value in _values.items()]
+        _last_flush[0] = time.time()
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = _process_file(directory)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(rows, f)
+    os.rename(path + '.tmp', path)
+
+
+def _maybe_flush():
+    if time.time() - _last_flush[0] > FLUSH_INTERVAL:
+        try:
+            flush()
+        except (IOError, OSError):
+            # metrics must never break the code they measure
+            pass
+
+
+atexit.register(_maybe_flush)
+
+
+def collect():
+    """Metrics of all processes, summed per (name, labels)"""
+    flush()
+    totals = {}
+    paths = glob.glob(os.path.join(metrics_dir(), 'metrics-*.json')) \
+        if metrics_dir() else []
+    for path in paths:
+        try:
+            with open(path) as f:
+                rows = json.load(f)
+        except (IOError, OSError, ValueError):
+            continue
+        for name, labels, value in rows:
+            key = (name, tuple(tuple(label) for label in labels))
+            if key not in totals:
+                totals[key] = value
+            elif isinstance(value, list):
+                totals[key] = [a + b for a, b in zip(totals[key], value)]
+            else:
+                totals[key] += value
+    return totals
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                     .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs)
+
+
+def exposition():
+    """All metrics in the Prometheus text format"""
+    totals = collect()
+    lines = []
+    for name in sorted(REGISTRY):
+        metric = REGISTRY[name]
+        lines.append('# HELP %s %s' % (name, metric.help))
+        lines.append('# TYPE %s %s' % (name, metric.kind))
+        for (key_name, labels), value in sorted(totals.items()):
+            if key_name != name:
+                continue
+            if metric.kind == 'counter':
+                lines.append('%s%s %s' % (name, _labels(labels), value))
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets, value):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    name, _labels(labels, [('le', repr(float(bound)))]),
+                    cumulative))
+            lines.append('%s_bucket%s %d' % (
+                name, _labels(labels, [('le', '+Inf')]), value[-1]))
+            lines.append('%s_sum%s %r' % (name, _labels(labels), value[-2]))
+            lines.append('%s_count%s %d' % (name, _labels(labels), value[-1]))
+    return '\n'.join(lines) + '\n'
+
+
+#####
+# Pipeline metrics
+#####
+
+
+CALCULATE_RATINGS = Histogram(
+    'club_calculate_ratings_seconds',
+    'Time to compute the new ratings of one game.')
+SET_RATINGS = Histogram(
+    'club_set_ratings_seconds',
+    'Time to compute and store the new ratings of one game.')
+PROCESS_GAME = Histogram(
+    'club_process_game_seconds',
+    'Time to rate and rank one confirmed game.')
+RANK_UPDATE = Histogram(
+    'club_rank_update_seconds',
+    'Time of one rank helper call (insert, demote, remove, rejoin).')
+REPLAY = Histogram(
+    'club_replay_seconds',
+    'Time to replay the ratings of a ladder (crunch_ratings and partial '
+    'replays).')
+GAMES_PROCESSED = Counter(
+    'club_games_processed_total',
+    'Confirmed games rated and ranked.')
+GAMES_REPLAYED = Counter(
+    'club_games_replayed_total',
+    'Games re-rated by replays.')
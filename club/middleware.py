@@ -0,0 +1,109 @@
+"""
+Per-request SQL and timing instrumentation.
+
+RequestTimingMiddleware records, for every request, the number of SQL
+queries and their total time, the time spent in the view and the time spent
+rendering its template. They are sent back in a Server-Timing header (shown
+by the browser's developer tools), logged to the club.requests logger, and
+checked against the per-view query budgets of settings.CLUB_QUERY_BUDGETS.
+
+The middleware is only active when settings.CLUB_REQUEST_TIMING is set:
+counting queries turns on the debug cursor, which keeps every query's SQL.
+"""
+import logging
+import time
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+logger = logging.getLogger('club.requests')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def view_name(view_func):
+    """Dotted path of a view function or class-based view"""
+    view = getattr(view_func, 'view_class', view_func)
+    return '%s.%s' % (view.__module__, view.__name__)
+
+
+def query_budget(name):
+    return getattr(settings, 'CLUB_QUERY_BUDGETS', {}).get(name)
+
+
+class RequestTimingMiddleware(object):
+
+    def __init__(self):
+        if not getattr(settings, 'CLUB_REQUEST_TIMING', False):
+            raise MiddlewareNotUsed
+
+    def process_request(self, request):
+        request._timing = {
+            'start': time.time(),
+            'debug_cursor': connection.force_debug_cursor,
+            'first_query': len(connection.queries_log),
+            'view': None,
+        }
+        connection.force_debug_cursor = True
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if hasattr(request, '_timing'):
+            request._timing['view'] = view_name(view_func)
+            request._timing['view_start'] = time.time()
+
+    def process_template_response(self, request, response):
+        timing = getattr(request, '_timing', None)
+        if timing is not None:
+            timing['view_end'] = time.time()
+
+            def rendered(response):
+                timing['render_end'] = time.time()
+            response.add_post_render_callback(rendered)
+        return response
+
+    def process_response(self, request, response):
+        timing = getattr(request, '_timing', None)
+        if timing is None:
+            return response
+        now = time.time()
+        connection.force_debug_cursor = timing['debug_cursor']
+        queries = list(connection.queries_log)[timing['first_query']:]
+
+        view_start = timing.get('view_start', now)
+        view_end = timing.get('view_end', now)
+        metrics = {
+            'view': timing['view'],
+            'queries': len(queries),
+            'sql_ms': 1000 * sum(float(query['time']) for query in queries),
+            'view_ms': 1000 * (view_end - view_start),
+            'template_ms': 1000 * (timing.get('render_end', view_end) -
+                                   view_end),
+            'total_ms': 1000 * (now - timing['start']),
+        }
+        response.timing = metrics
+
+        response['Server-Timing'] = ', '.join([
+            'sql;dur=%.1f;desc="%d queries"' % (metrics['sql_ms'],
+                                               metrics['queries']),
+            'view;dur=%.1f' % metrics['view_ms'],
+            'template;dur=%.1f' % metrics['template_ms'],
+            'total;dur=%.1f' % metrics['total_ms'],
+        ])
+        logger.info(
+            'method=%s path=%s status=%d view=%s queries=%d sql_ms=%.1f '
+            'view_ms=%.1f template_ms=%.1f total_ms=%.1f',
+            request.method, request.path, response.status_code,
+            metrics['view'], metrics['queries'], metrics['sql_ms'],
+            metrics['view_ms'], metrics['template_ms'], metrics['total_ms'],
+            extra={'timing': metrics})
+
+        budget = query_budget(metrics['view'])
+        if budget is not None and metrics['queries'] > budget:
+            message = '%s ran %d queries, over its budget of %d' % (
+                metrics['view'], metrics['queries'], budget)
+            if getattr(settings, 'CLUB_QUERY_BUDGETS_STRICT', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message, extra={'timing': metrics})
+        return response
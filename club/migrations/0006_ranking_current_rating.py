@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def backfill_current_ratings(apps, schema_editor):
+    """
+    Fill current_rating from the latest Rating of each player on each ladder
+    (as latest_ratings() does), so games rated between the deploy and a run
+    of backfill_current_ratings don't start from initial_rating.
+    """
+    Rating = apps.get_model('club', 'Rating')
+    Ranking = apps.get_model('club', 'Ranking')
+    latest = {}
+    # ascending order, so the last row seen for each pair is the newest
+    for player_id, ladder_id, rating in Rating.objects.order_by(
+            'ladder', 'player', 'timestamp', 'id').values_list(
+            'player_id', 'ladder_id', 'rating').iterator():
+        latest[(player_id, ladder_id)] = rating
+    for (player_id, ladder_id), rating in latest.items():
+        Ranking.objects.filter(player_id=player_id,
+                               ladder_id=ladder_id).update(
+            current_rating=rating)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('club', '0005_auto_20160330_1705'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ranking',
+            name='current_rating',
+            field=models.DecimalField(blank=True, decimal_places=3, help_text='Latest Rating for this player on this ladder, maintained by set_ratings. Empty until the first game is rated.', max_digits=7, null=True),
+        ),
+        migrations.RunPython(backfill_current_ratings,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('club', '0006_ranking_current_rating'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ladder',
+            name='rank_mode',
+            field=models.SmallIntegerField(choices=[(0, 'dense'), (1, 'sparse')], default=0, help_text="dense: Ranking.rank holds 1..N and moves shift every ranking in between. sparse: moves only rewrite the moving ranking's rank_key and ranks are numbered when read. Run rebalance_rank_keys after switching to sparse."),
+        ),
+        migrations.AddField(
+            model_name='ranking',
+            name='rank_key',
+            field=models.BigIntegerField(blank=True, help_text='Sparse ordering key used instead of rank on ladders in sparse rank mode. Lower keys rank higher.', null=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='ranking',
+            index_together=set([('ladder', 'rank_key')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('club', '0007_sparse_rank_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ranking',
+            name='inactivity_demoted_at',
+            field=models.DateTimeField(blank=True, help_text='When the inactivity penalty was last applied.', null=True),
+        ),
+    ]
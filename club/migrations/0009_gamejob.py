@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('club', '0008_ranking_inactivity_demoted_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.SmallIntegerField(choices=[(0, 'queued'), (1, 'running'), (2, 'done'), (3, 'failed')], default=0)),
+                ('attempts', models.SmallIntegerField(default=0)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, help_text='The job is not picked up before this time (retry backoff).')),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='club.Game')),
+                ('ladder', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='club.Ladder')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='gamejob',
+            index_together=set([('status', 'available_at')]),
+        ),
+    ]
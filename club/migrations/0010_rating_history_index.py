@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('club', '0009_gamejob'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='rating',
+            index_together=set([('ladder', 'player', 'timestamp')]),
+        ),
+    ]
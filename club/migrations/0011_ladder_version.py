@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('club', '0010_rating_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ladder',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Bumped whenever games, ratings or ranks of the ladder change; cached pages are keyed on it.'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('club', '0011_ladder_version'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='game',
+            index_together=set([('ladder', 'status', 'datetime', 'id'), ('ladder', 'datetime', 'id'), ('datetime', 'id')]),
+        ),
+    ]
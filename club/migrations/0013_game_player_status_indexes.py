@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('club', '0012_game_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='game',
+            index_together=set([('ladder', 'status', 'datetime', 'id'), ('ladder', 'datetime', 'id'), ('datetime', 'id'), ('white', 'status'), ('black', 'status')]),
+        ),
+    ]
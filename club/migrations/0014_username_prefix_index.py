@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Case-insensitive prefix index for username__istartswith lookups. PostgreSQL
+# matches UPPER(username) LIKE UPPER('prefix%'); SQLite's LIKE is already
+# case-insensitive and can use a NOCASE index.
+INDEX = 'club_auth_user_username_prefix'
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX %s ON auth_user '
+            '(UPPER(username) varchar_pattern_ops)' % INDEX)
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE INDEX %s ON auth_user (username COLLATE NOCASE)' % INDEX)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('postgresql', 'sqlite'):
+        schema_editor.execute('DROP INDEX IF EXISTS %s' % INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0007_alter_validators_add_error_messages'),
+        ('club', '0013_game_player_status_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
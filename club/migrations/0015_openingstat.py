@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('club', '0014_username_prefix_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpeningStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('eco', models.CharField(max_length=50)),
+                ('name', models.CharField(blank=True, max_length=100)),
+                ('games', models.IntegerField(default=0)),
+                ('white_wins', models.IntegerField(default=0)),
+                ('draws', models.IntegerField(default=0)),
+                ('black_wins', models.IntegerField(default=0)),
+                ('ladder', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='club.Ladder')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='openingstat',
+            unique_together=set([('ladder', 'eco')]),
+        ),
+    ]
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def populate_counters(apps, schema_editor):
+    """
+    Count the processed games of every ranking (as
+    club.replay.game_counters does), so ratings computed after the deploy
+    see the games already played.
+    """
+    Game = apps.get_model('club', 'Game')
+    Ranking = apps.get_model('club', 'Ranking')
+    counters = {}
+    for ladder_id, white_id, black_id, result, played in Game.objects.filter(
+            status=4).order_by('ladder', 'datetime', 'id').values_list(
+            'ladder_id', 'white_id', 'black_id', 'result',
+            'datetime').iterator():
+        for player_id, score in ((white_id, (1, 0, 0.5)[result]),
+                                 (black_id, (0, 1, 0.5)[result])):
+            row = counters.setdefault((ladder_id, player_id),
+                                      [0, 0, 0, 0, 0, None])
+            row[0] += 1
+            if score == 1:
+                row[1] += 1
+                row[4] = row[4] + 1 if row[4] > 0 else 1
+            elif score == 0:
+                row[3] += 1
+                row[4] = row[4] - 1 if row[4] < 0 else -1
+            else:
+                row[2] += 1
+                row[4] = 0
+            if played is not None:
+                row[5] = played
+    for (ladder_id, player_id), row in counters.items():
+        Ranking.objects.filter(ladder_id=ladder_id,
+                               player_id=player_id).update(
+            games_played=row[0], wins=row[1], draws=row[2], losses=row[3],
+            streak=row[4], last_played=row[5])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('club', '0016_headtohead'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ranking',
+            name='games_played',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ranking',
+            name='wins',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ranking',
+            name='draws',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ranking',
+            name='losses',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ranking',
+            name='streak',
+            field=models.IntegerField(default=0, help_text='Wins (positive) or losses (negative) in a row; 0 after a draw.'),
+        ),
+        migrations.AddField(
+            model_name='ranking',
+            name='last_played',
+            field=models.DateTimeField(blank=True, help_text='Datetime of the last processed game on this ladder.', null=True),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('club', '0017_ranking_counters'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='rating',
+            index_together=set([('ladder', 'player', 'timestamp', 'id'), ('ladder', 'timestamp')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='ranking',
+            index_together=set([('ladder', 'rank'), ('ladder', 'rank_key')]),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('club', '0019_rating_glicko_state'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='game',
+            name='result',
+            field=models.SmallIntegerField(blank=True, choices=[(0, '1-0'), (1, '0-1'), (2, '1/2-1/2')], null=True),
+        ),
+        migrations.AlterField(
+            model_name='game',
+            name='status',
+            field=models.SmallIntegerField(choices=[(-2, 'black disputes'), (-1, 'white disputes'), (0, 'withdrawn'), (1, 'white affirms'), (2, 'black affirms'), (3, 'confirmed'), (4, 'processed'), (5, 'paired')]),
+        ),
+        migrations.CreateModel(
+            name='Bye',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('round', models.SmallIntegerField()),
+                ('ladder', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='club.Ladder')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='club.Player')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='bye',
+            unique_together=set([('ladder', 'round', 'player')]),
+        ),
+    ]
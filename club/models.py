@@ -1,10 +1,19 @@
 from __future__ import unicode_literals
-from django.db import models
+import datetime
+from collections import namedtuple
+from contextlib import contextmanager
+from django.db import connection, models, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
 from model_utils import Choices
 from django_pgjson.fields import JsonBField
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.core.exceptions import ValidationError
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
+from club import metrics, rating_algs
 
 #####
 # Models
@@ -21,11 +30,7 @@ class Player(models.Model):
     visible = models.NullBooleanField(default=True)
 
     def rating(self, ladder):
-        ratings = ladder.rating_set.filter(player=self).order_by('-timestamp')
-        if ratings:
-            return ratings[0].rating
-        else:
-            return ladder.ranking_set.get(player=self).initial_rating
+        return ladder.ranking_set.get(player=self).rating
 
     def int_rating(self, ladder):
         return int(self.rating(ladder))
@@ -41,6 +46,12 @@ class Algorithm(models.Model):
         help_text="The name of the method used in rating_algs.py", null=True)
     params = JsonBField(default={}, blank=True)
 
+    def clean(self):
+        try:
+            rating_algs.check_params(self.method, self.params)
+        except ValueError as e:
+            raise ValidationError(str(e))
+
     def __unicode__(self):
         return self.name
 
@@ -63,6 +74,31 @@ class Ladder(models.Model):
         null=True, blank=True,
         help_text="When the inactivity penalty is enforced, the player's "
                   "ranking falls this many places")
+    rank_mode = models.SmallIntegerField(
+        choices=Choices((0, 'dense'), (1, 'sparse')), default=0,
+        help_text="dense: Ranking.rank holds 1..N and moves shift every "
+                  "ranking in between. sparse: moves only rewrite the moving "
+                  "ranking's rank_key and ranks are numbered when read. Run "
+                  "rebalance_rank_keys after switching to sparse.")
+    version = models.PositiveIntegerField(
+        default=0, editable=False,
+        help_text='Bumped whenever games, ratings or ranks of the ladder '
+                  'change; cached pages are keyed on it.')
+
+    @property
+    def sparse_ranks(self):
+        return self.rank_mode == 1
+
+    def save(self, *args, **kwargs):
+        # version only moves through bump_version's UPDATE: saving an
+        # instance loaded before a bump must not write the old version back
+        # (and bring back the fragments cached under it)
+        if not self._state.adding and not kwargs.get('force_insert') and \
+                kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'version']
+        super(Ladder, self).save(*args, **kwargs)
 
     def __unicode__(self):
         return '%s' % (self.name,)
@@ -74,8 +110,10 @@ class Game(models.Model):
     white_rating = models.IntegerField(null=True, blank=True)
     black_rating = models.IntegerField(null=True, blank=True)
     time_control = models.CharField(max_length=25, null=True, blank=True)
+    # empty while a paired tournament game is unplayed (status 5), see clean
     result = models.SmallIntegerField(choices=Choices((0, '1-0'), (1, '0-1'),
-                                                      (2, '1/2-1/2')))
+                                                      (2, '1/2-1/2')),
+                                      null=True, blank=True)
     ladder = models.ForeignKey(Ladder)
     datetime = models.DateTimeField(
         null=True, blank=True, auto_now_add=True,
@@ -93,19 +131,48 @@ class Game(models.Model):
                                                       (1, 'white affirms'),
                                                       (2, 'black affirms'),
                                                       (3, 'confirmed'),
-                                                      (4, 'processed')))
+                                                      (4, 'processed'),
+                                                      (5, 'paired')))
+
+    def clean(self):
+        if self.result is None and self.status not in (0, 5):
+            raise ValidationError({'result': 'Only paired and withdrawn games '
+                                             'can be without a result.'})
 
     def __unicode__(self):
         return '%s (%r) - %s (%r): %s' % (
             self.white.user.username, self.white_rating,
             self.black.user.username, self.black_rating,
-            self.get_result_display())
+            self.get_result_display() or self.get_status_display())
+
+    class Meta:
+        # keyset pagination of the game lists, see club.pagination
+        index_together = [('ladder', 'status', 'datetime', 'id'),
+                          ('ladder', 'datetime', 'id'),
+                          ('datetime', 'id'),
+                          # a player's games by status (profile page)
+                          ('white', 'status'),
+                          ('black', 'status')]
+
+
+@contextmanager
+def explicit_game_datetimes():
+    """Let bulk_create keep given game datetimes instead of auto_now_add's"""
+    field = Game._meta.get_field('datetime')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
 
 
 class Rating(models.Model):
     player = models.ForeignKey(Player)
     ladder = models.ForeignKey(Ladder)
     rating = models.DecimalField(decimal_places=3, max_digits=7)
+    # state of period algorithms (Glicko-2) after the game's rating period
+    deviation = models.FloatField(null=True, blank=True)
+    volatility = models.FloatField(null=True, blank=True)
     timestamp = models.DateTimeField(blank=True)
     game = models.ForeignKey(
         Game, null=True, blank=True,
@@ -118,7 +185,13 @@ class Rating(models.Model):
     @property
     def int_rating(self):
         return int(self.rating)
-        
+
+    class Meta:
+        # a player's history in order (id breaks timestamp ties), and a
+        # ladder's ratings from a point in time (replays)
+        index_together = [('ladder', 'player', 'timestamp', 'id'),
+                          ('ladder', 'timestamp')]
+
 
 class Ranking(models.Model):
     player = models.ForeignKey(Player)
@@ -127,14 +200,34 @@ class Ranking(models.Model):
     initial_rating = models.IntegerField(default=1200)
     initial_rank = models.IntegerField(null=True, blank=True)
     is_active = models.BooleanField(default=True)
-    
+    rank_key = models.BigIntegerField(
+        null=True, blank=True,
+        help_text='Sparse ordering key used instead of rank on ladders in '
+                  'sparse rank mode. Lower keys rank higher.')
+    current_rating = models.DecimalField(
+        decimal_places=3, max_digits=7, null=True, blank=True,
+        help_text='Latest Rating for this player on this ladder, maintained '
+                  'by set_ratings. Empty until the first game is rated.')
+    inactivity_demoted_at = models.DateTimeField(
+        null=True, blank=True,
+        help_text='When the inactivity penalty was last applied.')
+    # Game counters, maintained by count_game and club.replay.replay_counters
+    games_played = models.IntegerField(default=0)
+    wins = models.IntegerField(default=0)
+    draws = models.IntegerField(default=0)
+    losses = models.IntegerField(default=0)
+    streak = models.IntegerField(
+        default=0,
+        help_text='Wins (positive) or losses (negative) in a row; 0 after a '
+                  'draw.')
+    last_played = models.DateTimeField(
+        null=True, blank=True,
+        help_text='Datetime of the last processed game on this ladder.')
+
     @property
     def rating(self):
-        query = Rating.objects.filter(
-            player=self.player, ladder=self.ladder).order_by('-timestamp')
-        if query.exists():
-            # latest rating for this player on this ladder
-            return query[0].rating
+        if self.current_rating is not None:
+            return self.current_rating
         else:
             return self.initial_rating
 
@@ -142,6 +235,20 @@ class Ranking(models.Model):
     def int_rating(self):
         return int(self.rating)
 
+    @property
+    def current_rank(self):
+        """
+        1..N rank, numbered at read time on sparse ladders: from the count
+        annotated by with_current_ranks, or one query of its own.
+        """
+        if not self.ladder.sparse_ranks or self.rank_key is None:
+            return self.rank
+        above = getattr(self, 'rankings_above', None)
+        if above is None:
+            above = self.ladder.ranking_set.filter(
+                rank_key__lt=self.rank_key).count()
+        return above + 1
+
     def __unicode__(self):
         return '#%d %s (%d) [%s]' \
                % (self.rank, self.player.user.username, self.rating,
@@ -149,110 +256,772 @@ class Ranking(models.Model):
 
     class Meta:
         unique_together = ('player', 'ladder')
-   
+        # standings and rank shifts, in dense and sparse rank mode
+        index_together = [('ladder', 'rank'), ('ladder', 'rank_key')]
+
+
+class GameJob(models.Model):
+    """A confirmed game waiting for the worker to rate and rank it"""
+    game = models.ForeignKey(Game)
+    ladder = models.ForeignKey(Ladder)
+    status = models.SmallIntegerField(choices=Choices((0, 'queued'),
+                                                      (1, 'running'),
+                                                      (2, 'done'),
+                                                      (3, 'failed')),
+                                      default=0)
+    attempts = models.SmallIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(
+        default=timezone.now,
+        help_text='The job is not picked up before this time (retry backoff).')
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+
+    def __unicode__(self):
+        return 'Game %d (%s)' % (self.game_id, self.get_status_display())
+
+    class Meta:
+        index_together = [('status', 'available_at')]
+
+
+class OpeningStat(models.Model):
+    """
+    Processed games of a ladder played in one ECO opening and their results,
+    counted in by process_game (record_opening) and rebuilt by
+    refresh_opening_stats.
+    """
+    ladder = models.ForeignKey(Ladder)
+    eco = models.CharField(max_length=50)
+    name = models.CharField(max_length=100, blank=True)
+    games = models.IntegerField(default=0)
+    white_wins = models.IntegerField(default=0)
+    draws = models.IntegerField(default=0)
+    black_wins = models.IntegerField(default=0)
+
+    @property
+    def white_score(self):
+        """White's score in percent"""
+        if not self.games:
+            return None
+        return 100.0 * (self.white_wins + 0.5 * self.draws) / self.games
+
+    def __unicode__(self):
+        return '%s %s: %d games [%s]' % (self.eco, self.name, self.games,
+                                         self.ladder)
+
+    class Meta:
+        unique_together = ('ladder', 'eco')
+
+
+class HeadToHead(models.Model):
+    """
+    Record between two players on a ladder, from the point of view of
+    `player`, the one with the lower id. Maintained by process_game.
+    """
+    ladder = models.ForeignKey(Ladder)
+    player = models.ForeignKey(Player, related_name='+')
+    opponent = models.ForeignKey(Player, related_name='+')
+    wins = models.IntegerField(default=0)
+    draws = models.IntegerField(default=0)
+    losses = models.IntegerField(default=0)
+    last_played = models.DateTimeField(null=True, blank=True)
+
+    def __unicode__(self):
+        return '%s - %s: +%d =%d -%d [%s]' % (
+            self.player, self.opponent, self.wins, self.draws, self.losses,
+            self.ladder)
+
+    class Meta:
+        unique_together = ('ladder', 'player', 'opponent')
+
+
+class Bye(models.Model):
+    """A player sitting out a tournament round, scored as a win"""
+    ladder = models.ForeignKey(Ladder)
+    player = models.ForeignKey(Player)
+    round = models.SmallIntegerField()
+
+    def __unicode__(self):
+        return '%s: bye in round %d [%s]' % (self.player, self.round,
+                                             self.ladder)
+
+    class Meta:
+        unique_together = ('ladder', 'round', 'player')
+
+
+#####
+# Standings
+#####
+
+
+Standing = namedtuple('Standing', ['rank', 'player_id', 'username',
+                                   'is_active', 'rating', 'games_played'])
+
+
+def ladder_standings(ladder):
+    """
+    Rank, username, active flag, current (integer) rating and games played of
+    every player on the ladder, ordered by rank, from a single query.
+    """
+    order = ('-is_active', 'rank_key') if ladder.sparse_ranks else ('rank',)
+    rows = Ranking.objects.filter(ladder=ladder).annotate(
+        username=models.F('player__user__username')).order_by(
+        *order).values_list('rank', 'player_id', 'username', 'is_active',
+                            'current_rating', 'initial_rating', 'games_played')
+    standings = [Standing(rank, player_id, username, is_active,
+                          int(current if current is not None else initial),
+                          played)
+                 for rank, player_id, username, is_active, current, initial,
+                 played in rows]
+    if ladder.sparse_ranks:
+        # rank keys are sparse: number the active rankings in key order
+        standings = [standing._replace(rank=i + 1 if standing.is_active
+                                       else None)
+                     for i, standing in enumerate(standings)]
+    return standings
+
+
+def with_current_ranks(rankings):
+    """
+    Annotate a Ranking queryset with the number of rankings above each one
+    in rank key order, a correlated count served by the (ladder, rank_key)
+    index, so current_rank runs no query per ranking on sparse ladders.
+    """
+    table = connection.ops.quote_name(Ranking._meta.db_table)
+    return rankings.annotate(rankings_above=RawSQL(
+        'SELECT COUNT(*) FROM %s above WHERE above.ladder_id = %s.ladder_id '
+        'AND above.rank_key < %s.rank_key' % (table, table, table), ()))
+
 
 #####
 # Rating computation methods
 #####
 
 
-def calculate_ratings(ladder, white, black, result):
-    exec('from rating_algs import %s as func' % ladder.algorithm.method)
-    kwargs = ladder.algorithm.params
-    return func(white, black, result, ladder, **kwargs)
+def load_algorithm(ladder):
+    """The ladder's rating function, with the algorithm's params bound"""
+    return rating_algs.get_algorithm(ladder.algorithm.method,
+                                     ladder.algorithm.params)
+
 
+@metrics.CALCULATE_RATINGS.time(lambda game: metrics.ladder_labels(
+    game.ladder))
+def calculate_ratings(game):
+    """
+    New ratings of the game's players. The games played counts passed to the
+    algorithm include this game, which is rated after all the ladder's other
+    processed games (see process_game).
+    """
+    func = load_algorithm(game.ladder)
+    rankings = dict((ranking.player_id, ranking) for ranking in
+                    game.ladder.ranking_set.filter(
+                        player__in=[game.white_id, game.black_id]))
+    white, black = rankings[game.white_id], rankings[game.black_id]
+    return func(white.rating, black.rating, game.result,
+                white.games_played + 1, black.games_played + 1)
 
+
+@metrics.SET_RATINGS.time(lambda game: metrics.ladder_labels(game.ladder))
 def set_ratings(game):
     """
     Historical record of rating changes.
     It is important for players to provide good datetimes for their game reports
     """
-    new_white_rating, new_black_rating = calculate_ratings(
-        game.ladder, game.white, game.black, game.result)
-    Rating.objects.create(
-        ladder=game.ladder, player=game.white, rating=new_white_rating,
-        timestamp=game.datetime, game=game)
-    Rating.objects.create(
-        ladder=game.ladder, player=game.black, rating=new_black_rating,
-        timestamp=game.datetime, game=game)
+    new_white_rating, new_black_rating = calculate_ratings(game)
+    with transaction.atomic():
+        Rating.objects.create(
+            ladder=game.ladder, player=game.white, rating=new_white_rating,
+            timestamp=game.datetime, game=game)
+        Rating.objects.create(
+            ladder=game.ladder, player=game.black, rating=new_black_rating,
+            timestamp=game.datetime, game=game)
+        Ranking.objects.filter(ladder=game.ladder, player=game.white).update(
+            current_rating=new_white_rating)
+        Ranking.objects.filter(ladder=game.ladder, player=game.black).update(
+            current_rating=new_black_rating)
+        bump_version(game.ladder_id)
     return new_white_rating, new_black_rating
 
 
+def rated_games(ladder):
+    """Processed games of a ladder in the order their ratings are applied."""
+    return ladder.game_set.filter(status=4).order_by('datetime', 'id')
+
+
 def crunch_ratings(ladder):
     """
     Nuclear option to recompute all ratings on a ladder from scratch based on
     game history
     """
-    # blow away old ratings
-    old_ratings = Rating.objects.filter(ladder=ladder.id)
-    old_ratings.delete()
+    from club.replay import replay_ladder
+    return replay_ladder(ladder)
+
+
+def replay_ratings(ladder, since, players=()):
+    """
+    Recompute the ratings of every processed game played at or after `since`.
+
+    Rating rows from `since` onwards are discarded, the current ratings of the
+    players involved are rolled back to the ones in effect at `since`, and only
+    that suffix of the game history is replayed. `players` have their current
+    rating recomputed too, even without Rating rows from `since` (the players
+    of a deleted game). Returns the number of games replayed.
+    """
+    from club.replay import replay_ladder
+    return replay_ladder(ladder, since, players)
+
+
+def earliest_stale_game(ladder):
+    """
+    Datetime of the earliest point in the ladder's history where the stored
+    ratings no longer match the processed games, or None if they all agree.
+
+    Catches games processed without ratings (late confirmations), ratings whose
+    timestamp differs from their game (backdated or edited games) and ratings
+    left behind by games that are no longer processed.
+    """
+    games = dict(rated_games(ladder).values_list('id', 'datetime'))
+    counts = dict.fromkeys(games, 0)
+    candidates = []
+    for game_id, timestamp in Rating.objects.filter(
+            ladder=ladder).values_list('game_id', 'timestamp').iterator():
+        if game_id is None:
+            continue
+        if game_id not in games:
+            candidates.append(timestamp)
+            continue
+        counts[game_id] += 1
+        if timestamp != games[game_id]:
+            candidates.extend((timestamp, games[game_id]))
+    candidates.extend(games[game_id] for game_id, count in counts.items()
+                      if count != 2)
+    candidates = [c for c in candidates if c is not None]
+    return min(candidates) if candidates else None
+
+
+def recompute_ratings(ladder):
+    """
+    Incremental alternative to crunch_ratings: replay only from the earliest
+    stale game. Returns the number of games replayed.
+    """
+    since = earliest_stale_game(ladder)
+    if since is None:
+        return 0
+    return replay_ratings(ladder, since)
+
+
+def latest_ratings(ladder=None):
+    """
+    Map (player_id, ladder_id) to the most recent Rating.rating, read from the
+    full Rating history. Used to (re)build Ranking.current_rating.
+    """
+    query = Rating.objects.all()
+    if ladder is not None:
+        query = query.filter(ladder=ladder)
+    latest = {}
+    # ascending order, so the last row seen for each pair is the newest
+    for player_id, ladder_id, rating in query.order_by(
+            'ladder', 'player', 'timestamp', 'id').values_list(
+            'player_id', 'ladder_id', 'rating').iterator():
+        latest[(player_id, ladder_id)] = rating
+    return latest
+
+#####
+# Opening statistics
+#####
+
+
+def refresh_opening_stats(ladder_id):
+    """
+    Rebuild a ladder's OpeningStat rows from one aggregate over the eco
+    column of its processed games (no PGN is parsed).
+    """
+    from club.openings import opening_names
+    names = opening_names()
+    counts = {}
+    for eco, result, count in Game.objects.filter(
+            ladder=ladder_id, status=4).exclude(eco__isnull=True).exclude(
+            eco='').values_list('eco', 'result').annotate(
+            models.Count('id')).order_by():
+        row = counts.setdefault(eco, [0, 0, 0])
+        row[result] += count
+    with transaction.atomic():
+        OpeningStat.objects.filter(ladder=ladder_id).delete()
+        OpeningStat.objects.bulk_create([
+            OpeningStat(ladder_id=ladder_id, eco=eco,
+                        name=names.get(eco, '')[:100], games=sum(row),
+                        white_wins=row[0], black_wins=row[1], draws=row[2])
+            for eco, row in counts.items()])
+    return len(counts)
+
+
+def record_opening(game):
+    """Add a processed game to its ladder's row for the game's opening"""
+    column = ('white_wins', 'black_wins', 'draws')[game.result]
+    rows = OpeningStat.objects.filter(ladder=game.ladder_id, eco=game.eco)
+    if not rows.update(games=models.F('games') + 1,
+                       **{column: models.F(column) + 1}):
+        # process_game holds the ladder lock, so no other game creates it
+        from club.openings import opening_names
+        OpeningStat.objects.create(
+            ladder_id=game.ladder_id, eco=game.eco,
+            name=opening_names().get(game.eco, '')[:100], games=1,
+            **{column: 1})
+
+
+#####
+# Game counters
+#####
+
+
+def count_game(game):
+    """
+    Add a processed game to the counters of its players' rankings. Only for
+    games rated after all other processed games of the ladder; replays
+    rebuild the counters instead.
+    """
+    def after(name):
+        if game.datetime is None:
+            return models.F(name)
+        return models.Case(
+            models.When(Q(**{name + '__isnull': True}) |
+                        Q(**{name + '__lt': game.datetime}),
+                        then=models.Value(game.datetime)),
+            default=models.F(name), output_field=models.DateTimeField())
+
+    if game.result == 2:
+        outcomes = ((game.white_id, 'draws'), (game.black_id, 'draws'))
+    elif game.result == 0:
+        outcomes = ((game.white_id, 'wins'), (game.black_id, 'losses'))
+    else:
+        outcomes = ((game.white_id, 'losses'), (game.black_id, 'wins'))
+    for player_id, outcome in outcomes:
+        if outcome == 'wins':
+            streak = models.Case(
+                models.When(streak__gt=0, then=models.F('streak') + 1),
+                default=models.Value(1), output_field=models.IntegerField())
+        elif outcome == 'losses':
+            streak = models.Case(
+                models.When(streak__lt=0, then=models.F('streak') - 1),
+                default=models.Value(-1), output_field=models.IntegerField())
+        else:
+            streak = models.Value(0)
+        Ranking.objects.filter(ladder=game.ladder_id, player=player_id).update(
+            games_played=models.F('games_played') + 1,
+            streak=streak, last_played=after('last_played'),
+            **{outcome: models.F(outcome) + 1})
+
+
+#####
+# Head-to-head records
+#####
+
+
+Record = namedtuple('Record', ['ladder', 'wins', 'draws', 'losses',
+                               'last_played'])
+
+
+def head_to_head(player_id, opponent_id, ladder_id=None):
+    """
+    Records of player against opponent, one per ladder they met on, from the
+    player's side. Reads the HeadToHead rows of the pair only.
+    """
+    low, high = sorted((player_id, opponent_id))
+    rows = HeadToHead.objects.filter(
+        player=low, opponent=high).select_related('ladder')
+    if ladder_id is not None:
+        rows = rows.filter(ladder=ladder_id)
+    records = []
+    for row in rows.order_by('ladder__name'):
+        wins, losses = (row.wins, row.losses) if player_id == low \
+            else (row.losses, row.wins)
+        records.append(Record(row.ladder, wins, row.draws, losses,
+                              row.last_played))
+    return records
+
+
+def record_head_to_head(game):
+    """Add a processed game to the record of its two players"""
+    low, high = sorted((game.white_id, game.black_id))
+    outcome = {'wins': 0, 'draws': 0, 'losses': 0}
+    if game.result == 2:
+        outcome['draws'] = 1
+    elif (game.result == 0) == (game.white_id == low):
+        outcome['wins'] = 1
+    else:
+        outcome['losses'] = 1
+    updates = dict((name, models.F(name) + count)
+                   for name, count in outcome.items())
+    rows = HeadToHead.objects.filter(ladder=game.ladder_id, player=low,
+                                     opponent=high)
+    if game.datetime is not None:
+        # games may be processed out of order
+        rows.filter(Q(last_played__isnull=True) |
+                    Q(last_played__lt=game.datetime)).update(
+            last_played=game.datetime)
+    if not rows.update(**updates):
+        HeadToHead.objects.create(ladder_id=game.ladder_id, player_id=low,
+                                  opponent_id=high, last_played=game.datetime,
+                                  **outcome)
+
+
+def rebuild_head_to_head(ladder_id=None, pair=None):
+    """
+    Recompute HeadToHead rows from the processed games, for all ladders or
+    one, and all pairs or one (player ids in any order), with one aggregate
+    query.
+    """
+    games = Game.objects.filter(status=4)
+    rows = HeadToHead.objects.all()
+    if ladder_id is not None:
+        games = games.filter(ladder=ladder_id)
+        rows = rows.filter(ladder=ladder_id)
+    if pair is not None:
+        low, high = sorted(pair)
+        games = games.filter(Q(white=low, black=high) |
+                             Q(white=high, black=low))
+        rows = rows.filter(player=low, opponent=high)
+
+    records = {}
+    for ladder, white, black, result, count, last in games.values_list(
+            'ladder', 'white', 'black', 'result').annotate(
+            models.Count('id'), models.Max('datetime')).order_by():
+        low, high = sorted((white, black))
+        record = records.setdefault((ladder, low, high), [0, 0, 0, None])
+        if result == 2:
+            record[1] += count
+        elif (result == 0) == (white == low):
+            record[0] += count
+        else:
+            record[2] += count
+        if last is not None and (record[3] is None or record[3] < last):
+            record[3] = last
+
+    with transaction.atomic():
+        rows.delete()
+        HeadToHead.objects.bulk_create(
+            [HeadToHead(ladder_id=ladder, player_id=low, opponent_id=high,
+                        wins=wins, draws=draws, losses=losses,
+                        last_played=last)
+             for (ladder, low, high), (wins, draws, losses, last)
+             in records.items()], batch_size=1000)
+    return len(records)
 
-    games = ladder.game_set.order_by('datetime')
-    for game in games:
-        game.white_rating = game.white.rating(ladder)
-        game.black_rating = game.black.rating(ladder)
-        game.save()
-        set_ratings(game)
 
 #####
 # Rank manipulation helper methods
 #####
 
 
+def bump_version(ladder_id):
+    """Invalidate the cached page fragments of a ladder, keyed on its version"""
+    Ladder.objects.filter(id=ladder_id).update(
+        version=models.F('version') + 1)
+
+
+def lock_ladder(ladder):
+    """
+    Serialize rank changes on a ladder: lock its row until the surrounding
+    transaction ends. Must be called inside transaction.atomic().
+
+    The row lock is taken by bumping the ladder's version, which every caller
+    is about to make stale anyway.
+    """
+    bump_version(ladder.id)
+
+
+def case_update(model, rows, fields, chunk_size=500):
+    """
+    Set per-row values with one UPDATE ... CASE statement per chunk. `rows`
+    are (pk, value, ...) tuples with one value for each (name, output_field)
+    pair in `fields`.
+    """
+    for i in range(0, len(rows), chunk_size):
+        chunk = rows[i:i + chunk_size]
+        values = {}
+        for j, (name, output_field) in enumerate(fields):
+            if all(row[j + 1] is None for row in chunk):
+                # PostgreSQL types a CASE of NULLs only as text
+                values[name] = None
+                continue
+            values[name] = models.Case(
+                *[models.When(id=row[0], then=models.Value(row[j + 1]))
+                  for row in chunk],
+                output_field=output_field)
+        model.objects.filter(id__in=[row[0] for row in chunk]).update(
+            **values)
+
+
+def rank_labels(operation):
+    """Labels of a rank helper call, for metrics.RANK_UPDATE"""
+    def labels(target, ladder, *args, **kwargs):
+        return dict(metrics.ladder_labels(ladder), operation=operation)
+    return labels
+
+
+def insert_labels(player1, player2, ladder, above=False):
+    return dict(metrics.ladder_labels(ladder), operation='insert')
+
+
+# Spacing between consecutive rank keys after a rebalance
+RANK_KEY_GAP = 1 << 20
+
+
+def rank_order(ranking):
+    """Value ordering a ranking on its ladder (lower is better)"""
+    return ranking.rank_key if ranking.ladder.sparse_ranks else ranking.rank
+
+
+def rebalance_rank_keys(ladder):
+    """
+    Respace the rank keys of a sparse ladder evenly, RANK_KEY_GAP apart, and
+    store the dense 1..N rank numbered by a window function over the keys.
+    Rankings without a key yet are placed by their stored rank.
+    """
+    with transaction.atomic():
+        lock_ladder(ladder)
+        table = Ranking._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT id, ROW_NUMBER() OVER (ORDER BY '
+                'CASE WHEN rank_key IS NULL THEN 1 ELSE 0 END, rank_key, '
+                'rank, id) FROM %s WHERE ladder_id = %%s AND is_active'
+                % connection.ops.quote_name(table), [ladder.id])
+            rows = cursor.fetchall()
+        case_update(Ranking, [(pk, rank, rank * RANK_KEY_GAP)
+                              for pk, rank in rows],
+                    [('rank', models.IntegerField()),
+                     ('rank_key', models.BigIntegerField())])
+        ladder.ranking_set.filter(is_active=False).update(
+            rank=None, rank_key=None)
+    return len(rows)
+
+
+def _key_between(lower, upper):
+    """
+    A rank key strictly between two keys, either of which may be None for the
+    top or bottom of the ladder. Returns None when there is no room left.
+    """
+    if lower is None and upper is None:
+        return RANK_KEY_GAP
+    if lower is None:
+        return upper - RANK_KEY_GAP
+    if upper is None:
+        return lower + RANK_KEY_GAP
+    if upper - lower < 2:
+        return None
+    return (lower + upper) // 2
+
+
+def _sparse_insert(player1, player2, ladder, above):
+    for attempt in range(2):
+        p1_ranking = Ranking.objects.get(player=player1, ladder=ladder)
+        p2_ranking = Ranking.objects.get(player=player2, ladder=ladder)
+        others = ladder.ranking_set.filter(rank_key__isnull=False).exclude(
+            id=p2_ranking.id)
+        if above:
+            neighbour = others.filter(rank_key__lt=p1_ranking.rank_key)
+            neighbour = neighbour.aggregate(key=models.Max('rank_key'))['key']
+            lower, upper = neighbour, p1_ranking.rank_key
+        else:
+            neighbour = others.filter(rank_key__gt=p1_ranking.rank_key)
+            neighbour = neighbour.aggregate(key=models.Min('rank_key'))['key']
+            lower, upper = p1_ranking.rank_key, neighbour
+        key = p2_ranking.rank_key
+        if key is not None and (lower is None or lower < key) and \
+                (upper is None or key < upper):
+            # already in place
+            return
+        key = _key_between(lower, upper)
+        if key is not None:
+            Ranking.objects.filter(id=p2_ranking.id).update(rank_key=key)
+            return
+        rebalance_rank_keys(ladder)
+    raise RuntimeError('No room for rank key on %s after rebalancing' % ladder)
+
+
+@metrics.RANK_UPDATE.time(insert_labels)
 def insert(player1, player2, ladder, above=False):
-    """If above is True, insert player1 immediately above player2 in the ranking
-    and adjust all other ranks. If above is False, insert player1 immediately
-    below player2."""
-    p1_ranking = Ranking.objects.get(player=player1, ladder=ladder)
-    p2_ranking = Ranking.objects.get(player=player2, ladder=ladder)
-    if above:
-        new_rank = p1_ranking.rank
-    else:
-        new_rank = p1_ranking.rank + 1
-    move = Ranking.objects.filter(ladder=ladder, rank__gte=new_rank)
-    for ranking in move:
-        ranking.rank += 1
-        ranking.save()
-    p2_ranking.rank = new_rank
-    p2_ranking.save()
+    """If above is True, move player2 immediately above player1 in the ranking
+    and adjust all other ranks. If above is False, move player2 immediately
+    below player1."""
+    with transaction.atomic():
+        lock_ladder(ladder)
+        if ladder.sparse_ranks:
+            return _sparse_insert(player1, player2, ladder, above)
+        p1_ranking = Ranking.objects.get(player=player1, ladder=ladder)
+        p2_ranking = Ranking.objects.get(player=player2, ladder=ladder)
+        old_rank = p2_ranking.rank
+        if above:
+            new_rank = p1_ranking.rank
+        else:
+            new_rank = p1_ranking.rank + 1
+        if old_rank > new_rank:
+            # moving up: everyone in between drops one place
+            ladder.ranking_set.filter(
+                rank__gte=new_rank, rank__lt=old_rank).update(
+                rank=models.F('rank') + 1)
+        elif old_rank < new_rank - 1:
+            # moving down: everyone in between rises one place
+            new_rank -= 1
+            ladder.ranking_set.filter(
+                rank__gt=old_rank, rank__lte=new_rank).update(
+                rank=models.F('rank') - 1)
+        else:
+            return
+        Ranking.objects.filter(id=p2_ranking.id).update(rank=new_rank)
 
 
+@metrics.RANK_UPDATE.time(rank_labels('demote'))
 def demote(target, ladder):
     """Penalize player by dropping 1 rank on given ladder"""
-    target_ranking = Ranking.objects.get(player=target, ladder=ladder)
-    other = ladder.ranking_set.filter(rank=target_ranking.rank + 1)
-    if other.exists():
-        other = other[0]
-        target.rank, other.rank = (other.rank, target.rank)
-        target.save()
-        other.save()
+    with transaction.atomic():
+        lock_ladder(ladder)
+        if ladder.sparse_ranks:
+            key = Ranking.objects.get(player=target, ladder=ladder).rank_key
+            if key is None:
+                return
+            below = ladder.ranking_set.filter(rank_key__gt=key).order_by(
+                'rank_key').values_list('player', flat=True).first()
+            if below is not None:
+                _sparse_insert(below, target, ladder, above=False)
+            return
+        rank = Ranking.objects.get(player=target, ladder=ladder).rank
+        if rank is None:
+            return
+        if ladder.ranking_set.filter(rank=rank + 1).exists():
+            # swap with the player below in one statement
+            ladder.ranking_set.filter(rank__in=[rank, rank + 1]).update(
+                rank=models.Case(
+                    models.When(rank=rank, then=models.Value(rank + 1)),
+                    default=models.Value(rank)))
 
 
+@metrics.RANK_UPDATE.time(rank_labels('remove'))
 def remove(target, ladder):
     """
     Strip player of rank, mark as inactive, adjust all other ranks accordingly.
     """
-    target_ranking = Ranking.objects.get(player=target, ladder=ladder)
-    lower = ladder.ranking_set.filter(rank__lt=target_ranking.rank)
-    for ranking in lower:
-        ranking.rank += 1
-        ranking.save()
-    target_ranking.rank = None
-    target_ranking.is_active = False
-    target_ranking.save()
+    with transaction.atomic():
+        lock_ladder(ladder)
+        target_ranking = Ranking.objects.get(player=target, ladder=ladder)
+        if target_ranking.rank is not None and not ladder.sparse_ranks:
+            ladder.ranking_set.filter(rank__gt=target_ranking.rank).update(
+                rank=models.F('rank') - 1)
+        Ranking.objects.filter(id=target_ranking.id).update(
+            rank=None, rank_key=None, is_active=False)
 
 
+@metrics.RANK_UPDATE.time(rank_labels('rejoin'))
 def rejoin(target, ladder):
     """
     Mark the player as active again and put them at the bottom of the ladder.
     """
-    target_ranking = Ranking.objects.get(player=target, ladder=ladder)
-    target_ranking.is_active = True
-    max_rank = ladder.ranking_set.aggregate(models.Max('ranking'))
-    max_rank = max_rank['ranking__max']
-    target_ranking.rank = max_rank + 1
-    target_ranking.save()
-        
+    with transaction.atomic():
+        lock_ladder(ladder)
+        target_ranking = Ranking.objects.get(player=target, ladder=ladder)
+        if ladder.sparse_ranks:
+            if target_ranking.rank_key is None:
+                bottom = ladder.ranking_set.aggregate(models.Max('rank_key'))
+                Ranking.objects.filter(id=target_ranking.id).update(
+                    rank_key=_key_between(bottom['rank_key__max'], None))
+            Ranking.objects.filter(id=target_ranking.id).update(is_active=True)
+            return
+        if target_ranking.rank is not None:
+            rank = target_ranking.rank
+        else:
+            max_rank = ladder.ranking_set.aggregate(models.Max('rank'))
+            rank = (max_rank['rank__max'] or 0) + 1
+        Ranking.objects.filter(id=target_ranking.id).update(
+            rank=rank, is_active=True)
+
+
+def set_rank_order(ladder, ranking_ids):
+    """
+    Rewrite the ranks of a ladder's active rankings so they follow
+    `ranking_ids`, top first, in one set-based update of the rankings that
+    move. The caller must hold the ladder lock.
+    """
+    current = dict((pk, (rank, key)) for pk, rank, key in
+                   ladder.ranking_set.filter(id__in=ranking_ids).values_list(
+                       'id', 'rank', 'rank_key'))
+    rows = []
+    for i, pk in enumerate(ranking_ids):
+        key = (i + 1) * RANK_KEY_GAP if ladder.sparse_ranks else current[pk][1]
+        if current[pk] != (i + 1, key):
+            rows.append((pk, i + 1, key))
+    case_update(Ranking, rows, [('rank', models.IntegerField()),
+                                ('rank_key', models.BigIntegerField())])
+    return len(rows)
+
+
+def last_games(ladders):
+    """
+    Datetime of each player's last processed game, keyed by
+    (ladder_id, player_id), from the rankings' counters.
+    """
+    return dict(((ladder_id, player_id), played)
+                for ladder_id, player_id, played in Ranking.objects.filter(
+                    ladder__in=ladders, last_played__isnull=False).values_list(
+                    'ladder_id', 'player_id', 'last_played'))
+
+
+def inactivity_demotions(ladder, now, last_played):
+    """
+    Plan the inactivity penalty of one ladder. A ranking is overdue when
+    neither a game nor a previous penalty happened in the last
+    ladder.inactivity_period days. Overdue rankings drop demotion_inc places,
+    or as far as the bottom of the ladder and the overdue rankings below them
+    allow; none ever rises. Returns the ids of the rankings that dropped and
+    the current and new order of the ladder's active ranking ids, top first.
+    """
+    cutoff = now - datetime.timedelta(days=ladder.inactivity_period)
+    order_by = 'rank_key' if ladder.sparse_ranks else 'rank'
+    rankings = list(ladder.ranking_set.filter(is_active=True).order_by(
+        order_by, 'id').values_list('id', 'player_id', 'inactivity_demoted_at'))
+    start = None
+    if ladder.start_date is not None:
+        start = timezone.make_aware(datetime.datetime.combine(
+            ladder.start_date, datetime.time()), timezone.utc)
+
+    overdue = []
+    for pk, player_id, demoted_at in rankings:
+        active_since = [dt for dt in (last_played.get((ladder.id, player_id)),
+                                      demoted_at, start) if dt is not None]
+        if active_since and max(active_since) < cutoff:
+            overdue.append(pk)
+
+    before = [row[0] for row in rankings]
+    start = dict((pk, i) for i, pk in enumerate(before))
+    # place overdue rankings bottom first, each above the one placed before
+    slot, floor = {}, len(before)
+    for pk in reversed(overdue):
+        floor = min(start[pk] + ladder.demotion_inc, floor - 1)
+        slot[pk] = floor
+    taken = dict((i, pk) for pk, i in slot.items())
+    rest = iter([pk for pk in before if pk not in slot])
+    order = [taken[i] if i in taken else next(rest)
+             for i in range(len(before))]
+    dropped = [pk for pk in overdue if slot[pk] > start[pk]]
+    return dropped, before, order
+
+
+def enforce_inactivity(ladder, now, last_played):
+    """
+    Apply the inactivity penalty to a ladder in one transaction. Returns the
+    same plan as inactivity_demotions.
+    """
+    with transaction.atomic():
+        lock_ladder(ladder)
+        dropped, before, order = inactivity_demotions(ladder, now, last_played)
+        if dropped:
+            set_rank_order(ladder, order)
+            Ranking.objects.filter(id__in=dropped).update(
+                inactivity_demoted_at=now)
+    return dropped, before, order
+
+
 #####
 # Signals
 #####
@@ -269,52 +1038,219 @@ def add_player(sender, instance, created, **kwargs):
 @receiver(post_save, sender=Game)
 def set_rankings(sender, instance, created, **kwargs):
     if instance.status == 3:
-        white = instance.white
-        black = instance.black
-        ladder = instance.ladder
-        white_ranking = instance.ladder.ranking_set.get(player=white)
-        black_ranking = instance.ladder.ranking_set.get(player=black)
+        if getattr(settings, 'CLUB_GAME_QUEUE', True):
+            # processed by the process_games worker, see club.jobs
+            if not GameJob.objects.filter(
+                    game=instance, status__in=[0, 1]).exists():
+                GameJob.objects.create(game=instance, ladder=instance.ladder)
+        else:
+            with transaction.atomic():
+                process_game(instance)
+
 
-        # compute new ratings
+@metrics.PROCESS_GAME.time(lambda instance: metrics.ladder_labels(
+    instance.ladder))
+def process_game(instance):
+    if instance.result not in (0, 1, 2):
+        raise ValidationError('Game %s has no result to process'
+                              % instance.id)
+    white = instance.white
+    black = instance.black
+    ladder = instance.ladder
+    lock_ladder(ladder)
+
+    # A confirmation submitted twice must not rate, rank or count the game
+    # twice
+    if Rating.objects.filter(game=instance).exists():
+        Game.objects.filter(id=instance.id).update(status=4)
+        instance.status = 4
+        return
+
+    # Ratings are stamped with the game's datetime: an undated game (cleared
+    # in the admin) is dated when it is processed
+    if instance.datetime is None:
+        instance.datetime = timezone.now()
+        Game.objects.filter(id=instance.id).update(datetime=instance.datetime)
+
+    # compute new ratings
+    later = ladder.game_set.filter(
+        status=4, datetime__gt=instance.datetime).exclude(id=instance.id)
+    if rating_algs.rates_periods(ladder.algorithm.method) or later.exists():
+        # rated a period at a time, or reported out of order: replay the
+        # history from this game (or its rating period) on
+        Game.objects.filter(id=instance.id).update(status=4)
+        replay_ratings(ladder, instance.datetime)
+        instance.white_rating, instance.black_rating = \
+            Game.objects.filter(id=instance.id).values_list(
+                'white_rating', 'black_rating')[0]
+    else:
         instance.white_rating = white.rating(ladder)
         instance.black_rating = black.rating(ladder)
-        # instance.save()
         set_ratings(instance)
+        # replays rebuild the counters of the whole ladder
+        count_game(instance)
+    record_head_to_head(instance)
 
-        # compute new ranks  
-        # Creation of a game will "reawaken" an inactive ranking 
-        # (no good way to automatically reverse this if the Game is retracted.)
-        white_ranking.is_active = black_ranking.is_active = True
-        if instance.result == 0:
-            if white_ranking.rank < black_ranking.rank:
-                pass
-            else:
-                insert(black, white, ladder, above=True)
-        elif instance.result == 1:
-            if white_ranking.rank < black_ranking.rank:
-                insert(black, white, ladder, above=True)
-            else:
-                pass
-        elif instance.result == 2:
-            if white_ranking.rank < black_ranking.rank:
-                pass
-            else:
-                insert(black, white, ladder, above=False)
+    # compute new ranks
+    # Creation of a game will "reawaken" an inactive ranking
+    # (no good way to automatically reverse this if the Game is retracted.)
+    for player in (white, black):
+        if not ladder.ranking_set.get(player=player).is_active:
+            rejoin(player, ladder)
+    white_rank = rank_order(ladder.ranking_set.get(player=white))
+    black_rank = rank_order(ladder.ranking_set.get(player=black))
+    if instance.result == 0:
+        if white_rank < black_rank:
+            pass
         else:
-            raise Exception('What game result code is this? %d'
-                            % instance.result)
-        instance.status = 4
-        instance.save()
+            insert(black, white, ladder, above=True)
+    elif instance.result == 1:
+        if white_rank < black_rank:
+            insert(white, black, ladder, above=True)
+        else:
+            pass
+    elif instance.result == 2:
+        if white_rank < black_rank:
+            pass
+        else:
+            insert(black, white, ladder, above=False)
+    else:
+        raise Exception('What game result code is this? %r'
+                        % instance.result)
+    instance.status = 4
+    instance.save()
+    if instance.eco:
+        record_opening(instance)
+    metrics.GAMES_PROCESSED.inc(**metrics.ladder_labels(ladder))
+
+
+# Fields whose change invalidates the ratings of a processed game
+RATING_INPUTS = ('white_id', 'black_id', 'result', 'datetime', 'ladder_id',
+                 'status')
+
+
+@receiver(pre_save, sender=Game)
+def remember_rating_inputs(sender, instance, **kwargs):
+    instance._rating_inputs = None
+    instance._saved_eco = None
+    if instance.pk is not None:
+        old = Game.objects.filter(id=instance.pk).values_list(
+            *(RATING_INPUTS + ('eco',))).first()
+        if old is not None:
+            instance._rating_inputs = dict(zip(RATING_INPUTS, old))
+            instance._saved_eco = old[-1]
+
+
+# Editing a processed game replays its ladder(s) from the earliest change
+@receiver(post_save, sender=Game)
+def replay_edited_game(sender, instance, created, **kwargs):
+    old = getattr(instance, '_rating_inputs', None)
+    if old is None or old['status'] != 4:
+        return
+    new = dict((field, getattr(instance, field)) for field in RATING_INPUTS)
+    if new == old:
+        return
+    if old['ladder_id'] != new['ladder_id']:
+        replay = [(old['ladder_id'], old['datetime']),
+                  (new['ladder_id'], new['datetime'])]
+    else:
+        times = [dt for dt in (old['datetime'], new['datetime'])
+                 if dt is not None]
+        replay = [(new['ladder_id'], min(times) if times else None)]
+    for ladder_id, since in replay:
+        ladder = Ladder.objects.get(id=ladder_id)
+        if since is None:
+            crunch_ratings(ladder)
+        else:
+            replay_ratings(ladder, since)
+
+
+# Games enter the opening tables in process_game; edits and deletions of
+# processed games refresh them here
+@receiver(post_save, sender=Game)
+def update_opening_stats(sender, instance, created, **kwargs):
+    old = getattr(instance, '_rating_inputs', None)
+    if old is None or old['status'] != 4:
+        return
+    if (instance.status, instance.result, instance.ladder_id, instance.eco) \
+            == (4, old['result'], old['ladder_id'], instance._saved_eco):
+        return
+    refresh_opening_stats(old['ladder_id'])
+    if instance.ladder_id != old['ladder_id']:
+        refresh_opening_stats(instance.ladder_id)
+
+
+@receiver(post_delete, sender=Game)
+def remove_opening_stats(sender, instance, **kwargs):
+    if instance.status == 4 and instance.eco:
+        refresh_opening_stats(instance.ladder_id)
+
+
+# Same for the head-to-head records of the game's players
+@receiver(post_save, sender=Game)
+def update_head_to_head(sender, instance, created, **kwargs):
+    old = getattr(instance, '_rating_inputs', None)
+    if old is None or old['status'] != 4:
+        return
+    new = dict((field, getattr(instance, field)) for field in RATING_INPUTS)
+    if new == old:
+        return
+    rebuild_head_to_head(old['ladder_id'], (old['white_id'], old['black_id']))
+    if (new['ladder_id'], set((new['white_id'], new['black_id']))) != \
+            (old['ladder_id'], set((old['white_id'], old['black_id']))):
+        rebuild_head_to_head(new['ladder_id'],
+                             (new['white_id'], new['black_id']))
+
+
+@receiver(post_delete, sender=Game)
+def remove_head_to_head(sender, instance, **kwargs):
+    if instance.status == 4:
+        rebuild_head_to_head(instance.ladder_id,
+                             (instance.white_id, instance.black_id))
+
+
+# Deleting a processed game cascades to its Rating rows; replay the ratings
+# and counters of the games after it
+@receiver(post_delete, sender=Game)
+def replay_deleted_game(sender, instance, **kwargs):
+    if instance.status != 4:
+        return
+    ladder = Ladder.objects.filter(id=instance.ladder_id).first()
+    if ladder is None:
+        return
+    if instance.datetime is None:
+        crunch_ratings(ladder)
+    else:
+        replay_ratings(ladder, instance.datetime,
+                       players=(instance.white_id, instance.black_id))
+
+
+# Any change to a game or ranking may show on the ladder's cached pages
+@receiver(post_save, sender=Game)
+@receiver(post_delete, sender=Game)
+@receiver(post_save, sender=Ranking)
+@receiver(post_delete, sender=Ranking)
+def invalidate_ladder_pages(sender, instance, **kwargs):
+    bump_version(instance.ladder_id)
 
 
 # People join ladders at the bottom
 @receiver(post_save, sender=Ranking)
 def set_rank(sender, instance, created, **kwargs):
     if created:
-        max_rank = instance.ladder.ranking_set.aggregate(models.Max('rank'))
-        max_rank = max_rank['rank__max']
-        if max_rank is None:
-            max_rank = 0
-        instance.rank = max_rank + 1
-        instance.initial_rank = max_rank + 1
-        instance.save()
+        with transaction.atomic():
+            lock_ladder(instance.ladder)
+            max_rank = instance.ladder.ranking_set.exclude(
+                id=instance.id).aggregate(models.Max('rank'))
+            max_rank = max_rank['rank__max']
+            if max_rank is None:
+                max_rank = 0
+            instance.rank = max_rank + 1
+            instance.initial_rank = max_rank + 1
+            if instance.ladder.sparse_ranks:
+                bottom = instance.ladder.ranking_set.aggregate(
+                    models.Max('rank_key'))['rank_key__max']
+                instance.rank_key = _key_between(bottom, None)
+            Ranking.objects.filter(id=instance.id).update(
+                rank=instance.rank, initial_rank=instance.initial_rank,
+                rank_key=instance.rank_key)
@@ -0,0 +1,123 @@
+"""
+ECO classification of games from their PGN.
+
+The opening table (club/data/eco.tsv, or the file named by the ECO_TABLE
+setting; columns eco, name, pgn as in the lichess chess-openings tables) is
+loaded once per process into a trie keyed by SAN moves. A game is classified
+by walking its moves down the trie and keeping the deepest line that has an
+entry, so each game costs one dictionary lookup per move.
+"""
+import io
+import os
+import re
+from django.conf import settings
+from club.pgn import TAG
+
+DEFAULT_TABLE = os.path.join(os.path.dirname(__file__), 'data', 'eco.tsv')
+
+# Openings are decided in the first moves; longer games are not walked further
+MAX_PLIES = 40
+
+COMMENT = re.compile(r'\{[^}]*\}|;[^\n]*')
+MOVE_NUMBER = re.compile(r'^\d+\.+')
+NOT_MOVES = re.compile(r'^(\$\d+|1-0|0-1|1/2-1/2|\*)$')
+
+
+def strip_variations(text):
+    """Drop (recursive) parenthesised variations from movetext"""
+    kept, depth = [], 0
+    for char in text:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth = max(depth - 1, 0)
+        elif not depth:
+            kept.append(char)
+    return ''.join(kept)
+
+
+def normalize_san(move):
+    """SAN without check, mate and annotation marks; 0-0 spelled O-O"""
+    move = move.rstrip('+#!?')
+    if move.endswith('e.p.'):
+        move = move[:-4]
+    return move.replace('0', 'O')
+
+
+def san_moves(pgn):
+    """The main line of a PGN game (with or without tag pairs) as SAN moves"""
+    lines = [line for line in pgn.splitlines() if not TAG.match(line.strip())]
+    text = strip_variations(COMMENT.sub(' ', '\n'.join(lines)))
+    moves = []
+    for token in text.split():
+        token = MOVE_NUMBER.sub('', token)
+        if token and not NOT_MOVES.match(token):
+            moves.append(normalize_san(token))
+    return moves
+
+
+class OpeningTrie(object):
+    """Move-prefix trie of opening lines. Each node is [children, entry]."""
+
+    def __init__(self):
+        self.root = [{}, None]
+
+    def add(self, moves, eco, name):
+        node = self.root
+        for move in moves:
+            node = node[0].setdefault(move, [{}, None])
+        if node[1] is None:
+            node[1] = (eco, name)
+
+    def classify(self, moves):
+        """(eco, name) of the longest known line the moves start with"""
+        node, found = self.root, None
+        for move in moves[:MAX_PLIES]:
+            node = node[0].get(move)
+            if node is None:
+                break
+            if node[1] is not None:
+                found = node[1]
+        return found
+
+
+def load_table(path):
+    trie = OpeningTrie()
+    with io.open(path, encoding='utf-8') as table:
+        for line in table:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 3 or fields[0] == 'eco':
+                continue
+            trie.add(san_moves(fields[2]), fields[0], fields[1])
+    return trie
+
+
+_trie = None
+
+
+def opening_trie():
+    global _trie
+    if _trie is None:
+        _trie = load_table(getattr(settings, 'ECO_TABLE', DEFAULT_TABLE))
+    return _trie
+
+
+def classify(pgn):
+    """(eco, name) of a game's opening, or None if it is not in the table"""
+    if not pgn:
+        return None
+    return opening_trie().classify(san_moves(pgn))
+
+
+def opening_names():
+    """Name of the shortest line of each ECO code in the table"""
+    names = {}
+    stack = [opening_trie().root]
+    # breadth-first, so the first entry seen for a code is its shortest line
+    while stack:
+        level, stack = stack, []
+        for children, entry in level:
+            if entry is not None:
+                names.setdefault(entry[0], entry[1])
+            stack.extend(children.values())
+    return names
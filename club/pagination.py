@@ -0,0 +1,99 @@
+"""
+Keyset pagination for game lists.
+
+Pages are addressed by the (datetime, id) of the game at their boundary
+(?after=<cursor> for the next page, ?before=<cursor> for the previous one)
+instead of an offset, so every page is a single range query on an index
+ending in (datetime, id), however deep it is.
+"""
+import calendar
+import datetime
+from collections import namedtuple
+from django.db.models import Q
+from django.http import Http404
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+
+Page = namedtuple('Page', ['object_list', 'next_cursor', 'prev_cursor'])
+
+
+def encode_cursor(game):
+    """'<microseconds since the epoch>.<id>' of a game"""
+    stamp = calendar.timegm(game.datetime.utctimetuple()) * 1000000 + \
+        game.datetime.microsecond
+    return '%d.%d' % (stamp, game.id)
+
+
+def decode_cursor(cursor):
+    """(datetime, id) of a cursor; a malformed or forged one is a 404"""
+    try:
+        stamp, pk = [int(part) for part in cursor.split('.')]
+        # stamps outside the datetime range overflow
+        moment = datetime.datetime(1970, 1, 1) + \
+            datetime.timedelta(microseconds=stamp)
+    except (ValueError, OverflowError, TypeError):
+        raise Http404('Invalid page')
+    return timezone.make_aware(moment, timezone.utc), pk
+
+
+def beyond(cursor, descending):
+    """Games after the cursor position in the given direction"""
+    moment, pk = cursor
+    if descending:
+        return Q(datetime__lt=moment) | Q(datetime=moment, id__lt=pk)
+    return Q(datetime__gt=moment) | Q(datetime=moment, id__gt=pk)
+
+
+def keyset_page(queryset, size, newest_first=True, after=None, before=None):
+    """One page of `queryset` after or before a decoded cursor"""
+    queryset = queryset.filter(datetime__isnull=False)
+    if newest_first:
+        forward, backward = ('-datetime', '-id'), ('datetime', 'id')
+    else:
+        forward, backward = ('datetime', 'id'), ('-datetime', '-id')
+
+    if before is not None:
+        games = list(queryset.filter(beyond(before, not newest_first))
+                     .order_by(*backward)[:size + 1])
+        has_prev = len(games) > size
+        games = games[:size]
+        games.reverse()
+        has_next = True
+    else:
+        if after is not None:
+            queryset = queryset.filter(beyond(after, newest_first))
+        games = list(queryset.order_by(*forward)[:size + 1])
+        has_next = len(games) > size
+        games = games[:size]
+        has_prev = after is not None
+
+    return Page(games,
+                encode_cursor(games[-1]) if games and has_next else None,
+                encode_cursor(games[0]) if games and has_prev else None)
+
+
+class KeysetPaginationMixin(object):
+    """
+    For ListViews of games. Adds a lazily evaluated `page` (object_list,
+    next_cursor, prev_cursor) to the context, and `page_key`, which
+    identifies the page for fragment caching. Without a cursor the first page
+    is shown, so unpaginated links keep working.
+    """
+    page_size = 50
+    newest_first = True
+
+    def get_context_data(self, **kwargs):
+        context = super(KeysetPaginationMixin, self).get_context_data(**kwargs)
+        after = self.request.GET.get('after')
+        before = self.request.GET.get('before')
+        cursors = {
+            'after': decode_cursor(after) if after else None,
+            'before': decode_cursor(before) if before else None,
+        }
+        queryset = self.get_queryset().select_related(
+            'white__user', 'black__user')
+        context['page'] = SimpleLazyObject(lambda: keyset_page(
+            queryset, self.page_size, self.newest_first, **cursors))
+        context['page_key'] = 'after.%s' % after if after else \
+            'before.%s' % before if before else 'first'
+        return context
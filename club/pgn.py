@@ -0,0 +1,44 @@
+"""
+Incremental PGN reading.
+
+read_games() walks a PGN stream line by line and yields one game at a time,
+so files of any size are parsed in constant memory.
+"""
+import re
+from collections import namedtuple
+
+PGNGame = namedtuple('PGNGame', ['headers', 'movetext', 'text'])
+
+TAG = re.compile(r'^\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]\s*$')
+
+RESULTS = {'1-0': 0, '0-1': 1, '1/2-1/2': 2}
+
+
+def read_games(lines):
+    """Yield a PGNGame for every game in an iterable of lines"""
+    headers, tag_lines, moves = {}, [], []
+
+    def game():
+        return PGNGame(headers, ' '.join(moves),
+                       '\n'.join(tag_lines) + '\n\n' + '\n'.join(moves) + '\n')
+
+    for line in lines:
+        line = line.strip()
+        if line.startswith('%'):
+            # escape mechanism: the line is not PGN data
+            continue
+        match = TAG.match(line)
+        if match:
+            if moves:
+                # a new game starts without a blank line after the last one
+                yield game()
+                headers, tag_lines, moves = {}, [], []
+            headers[match.group(1)] = match.group(2).replace('\\"', '"')
+            tag_lines.append(line)
+        elif line:
+            moves.append(line)
+        elif moves:
+            yield game()
+            headers, tag_lines, moves = {}, [], []
+    if headers or moves:
+        yield game()
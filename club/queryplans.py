@@ -0,0 +1,132 @@
+"""
+Query-plan checks for the hot queries.
+
+Each query in HOT_QUERIES is built exactly as the code that runs it builds
+it, EXPLAINed on the current database, and reported if its plan falls back
+to a full table scan or to a sort the indexes should have made unnecessary.
+The check_query_plans management command runs them (e.g. in CI) against
+SQLite or PostgreSQL.
+
+PostgreSQL prefers sequential scans and sorts on small tables whatever the
+indexes, so both are disabled for the check: a Seq Scan or Sort left in a
+plan then means no index can serve the query or its order.
+"""
+import re
+from collections import namedtuple
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from club.models import Game, GameJob, HeadToHead, Ladder, OpeningStat, \
+    Player, Ranking, Rating
+
+HotQuery = namedtuple('HotQuery', ['name', 'build', 'allow_sort'])
+
+FULL_SCAN = {
+    # SQLite < 3.36 says "SCAN TABLE t", later "SCAN t"; index scans name the
+    # index after USING
+    'sqlite': re.compile(r'^SCAN (TABLE )?\w+( AS \w+)?$'),
+    'postgresql': re.compile(r'\bSeq Scan on\b'),
+}
+
+SORT = {
+    'sqlite': re.compile(r'USE TEMP B-TREE FOR (ORDER BY|RIGHT PART OF)'),
+    'postgresql': re.compile(r'(^|->)\s*(Incremental )?Sort\b'),
+}
+
+
+HOT_QUERIES = [
+    HotQuery('player rating history',
+             lambda l, p, o: Rating.objects.filter(
+                 ladder=l, player=p).order_by('-timestamp'), False),
+    HotQuery('ladder rating history',
+             lambda l, p, o: Rating.objects.filter(ladder=l).order_by(
+                 'player', 'timestamp', 'id'), False),
+    HotQuery('ratings from a point in time (replay)',
+             lambda l, p, o: Rating.objects.filter(
+                 ladder=l, timestamp__gte=timezone.now()), False),
+    HotQuery('ladder games page',
+             lambda l, p, o: Game.objects.filter(
+                 ladder=l, status=4).order_by('-datetime', '-id')[:51], False),
+    HotQuery('rated games (replay order)',
+             lambda l, p, o: Game.objects.filter(
+                 ladder=l, status=4).order_by('datetime', 'id'), False),
+    HotQuery('all games page',
+             lambda l, p, o: Game.objects.order_by(
+                 '-datetime', '-id')[:51], False),
+    # the OR of the two colours is merged from two index searches; its few
+    # rows are sorted
+    HotQuery('games needing attention (profile)',
+             lambda l, p, o: Game.objects.filter(
+                 Q(white=p) | Q(black=p), status__in=[-2, -1, 1, 2, 5]).order_by(
+                 '-datetime', '-id'), True),
+    HotQuery('dense standings',
+             lambda l, p, o: Ranking.objects.filter(ladder=l).order_by(
+                 'rank'), False),
+    HotQuery('rank shift range',
+             lambda l, p, o: Ranking.objects.filter(
+                 ladder=l, rank__gte=10, rank__lt=20), False),
+    HotQuery('sparse rank count',
+             lambda l, p, o: Ranking.objects.filter(
+                 ladder=l, rank_key__lt=1 << 20), False),
+    HotQuery('ranking of a player',
+             lambda l, p, o: Ranking.objects.filter(ladder=l, player=p),
+             False),
+    HotQuery('head to head of a pair',
+             lambda l, p, o: HeadToHead.objects.filter(
+                 player=min(p, o), opponent=max(p, o), ladder=l), False),
+    HotQuery('opening table',
+             lambda l, p, o: OpeningStat.objects.filter(ladder=l), False),
+    # claim_job: the OR of two statuses over a short queue is sorted
+    HotQuery('available jobs',
+             lambda l, p, o: GameJob.objects.filter(
+                 Q(status=0, available_at__lte=timezone.now()) |
+                 Q(status=1, started__lte=timezone.now())).order_by(
+                 'created', 'id')[:10], True),
+]
+
+
+def explain(queryset):
+    """Plan lines of a queryset on its database"""
+    connection = connections[queryset.db]
+    sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    with transaction.atomic(using=queryset.db):
+        cursor = connection.cursor()
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+        if connection.vendor == 'postgresql':
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_sort = off')
+        cursor.execute('EXPLAIN ' + sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def problems(plan, vendor, allow_sort=False):
+    """Plan lines showing a full scan, or a sort unless allowed"""
+    if vendor not in FULL_SCAN:
+        raise ValueError('Query plans of %s are not supported' % vendor)
+    found = [line for line in plan if FULL_SCAN[vendor].search(line.strip())]
+    if not allow_sort:
+        found.extend(line for line in plan if SORT[vendor].search(line))
+    return found
+
+
+def sample_ids():
+    """A ladder and two player ids to build the queries with"""
+    ladder_id = Ladder.objects.values_list('id', flat=True).first() or 1
+    players = list(Player.objects.values_list('id', flat=True)[:2])
+    players += [1, 2][len(players):]
+    return ladder_id, players[0], players[1]
+
+
+def check_plans(queries=HOT_QUERIES):
+    """(query, plan, problem lines) for every hot query"""
+    ids = sample_ids()
+    results = []
+    for query in queries:
+        queryset = query.build(*ids)
+        vendor = connections[queryset.db].vendor
+        plan = explain(queryset)
+        results.append((query, plan, problems(plan, vendor,
+                                              query.allow_sort)))
+    return results
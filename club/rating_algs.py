@@ -1,10 +1,100 @@
+from bisect import bisect_right
 from decimal import Decimal
-from django.db.models import Q
+from functools import partial
+import inspect
+import json
+import math
 
+# Every algorithm takes the players' ratings going into the game, the result
+# code (0: 1-0, 1: 0-1, 2: 1/2-1/2) and the number of games each player has
+# played on the ladder including this one, followed by Algorithm.params.
+# Algorithms are pure functions of these numbers and never touch the ORM.
 
-def bogus2(white, black, result, ladder):
-    white = white.rating(ladder)
-    black = black.rating(ladder)
+ALGORITHMS = {}
+
+
+def algorithm(func):
+    """
+    Register a rating function under its name, as used in Algorithm.method.
+    Whole histories are rated by club.replay.run, which carries each player's
+    rating from one game to the next.
+    """
+    ALGORITHMS[func.__name__] = func
+    return func
+
+
+def period_algorithm(func):
+    """
+    Register a rating function that rates a whole rating period at once.
+    It takes the state of the period's players going into it, as a list of
+    (rating, deviation, volatility, idle periods) with deviation None in a
+    player's first period, and the period's games as three columns: white
+    and black (indices into that list) and result; followed by
+    Algorithm.params. It returns the players' new (rating, deviation,
+    volatility), in the same order.
+    """
+    func.rates_periods = True
+    ALGORITHMS[func.__name__] = func
+    return func
+
+
+def rates_periods(method):
+    return getattr(ALGORITHMS.get(method), 'rates_periods', False)
+
+
+# Rating periods of period algorithms (the `period` param) and the key of
+# the period a game falls in; consecutive periods have consecutive keys.
+PERIODS = ('day', 'week', 'month', 'round')
+
+
+def period_key(period, datetime, round):
+    if period == 'round':
+        return round if round is not None else 0
+    date = datetime.date()
+    if period == 'day':
+        return date.toordinal()
+    if period == 'week':
+        # weeks start on Monday
+        return (date.toordinal() - 1) // 7
+    if period == 'month':
+        return date.year * 12 + date.month - 1
+    raise ValueError('Unknown rating period: %r' % (period,))
+
+
+def check_params(method, params):
+    """Raise ValueError unless `method` is registered and accepts `params`"""
+    if method not in ALGORITHMS:
+        raise ValueError('Unknown rating algorithm: %r' % (method,))
+    if not isinstance(params, dict):
+        raise ValueError('Algorithm params must be a JSON object')
+    if rates_periods(method) and params.get('period', 'week') not in PERIODS:
+        raise ValueError('period must be one of %s' % ', '.join(PERIODS))
+    argspec = inspect.getargspec(ALGORITHMS[method])
+    accepted = argspec.args[4 if rates_periods(method) else 5:]
+    unknown = sorted(set(params) - set(accepted))
+    if unknown:
+        raise ValueError('%s does not accept params %s; accepted: %s'
+                         % (method, ', '.join(unknown), ', '.join(accepted)))
+
+
+_bound = {}
+
+
+def get_algorithm(method, params):
+    """
+    The rating function for `method` with `params` bound, checked and built
+    once per process. Per-game algorithms are called with the five per-game
+    numbers, period algorithms with a period's players and games.
+    """
+    key = (method, json.dumps(params, sort_keys=True))
+    if key not in _bound:
+        check_params(method, params)
+        _bound[key] = partial(ALGORITHMS[method], **params)
+    return _bound[key]
+
+
+@algorithm
+def bogus2(white, black, result, white_games, black_games):
     if result == 0:
         white += 2
         black -= 2
@@ -21,25 +111,27 @@ def bogus2(white, black, result, ladder):
     return white, black
 
 
-def fide(white, black, result, ladder, provisional_k=32, standard_k=24,
-         provisional_limit=30):
-    diff = abs(white.rating(ladder)-black.rating(ladder))
-    pre_d = [4, 11, 18, 26, 33, 40, 47, 54, 62, 69, 77, 84, 92, 99, 107, 
-             114, 122, 130, 138, 146, 154, 163, 171, 180, 189, 198, 207,
-             216, 226, 236, 246, 257, 268, 279, 291, 303, 316, 329, 345,
-             358, 375, 392, 412, 433, 457, 485, 518, 560, 620, 736, 10000]
-    d = [(0, 4)]
-    for i in range(1, len(pre_d)):
-        d.append((pre_d[i-1], pre_d[i]))
-
-    p = [Decimal('0.%d' % i) for i in range(50, 100)]
-    p.append(Decimal('1.0'))
-    pd = dict(zip(d, p))
-    
-    w_games = ladder.game_set.filter(Q(white=white) | Q(black=white)).count()
-    b_games = ladder.game_set.filter(Q(white=black) | Q(black=black)).count()
-    w_k = standard_k if w_games > provisional_limit else provisional_k
-    b_k = standard_k if b_games > provisional_limit else provisional_k
+# FIDE table 8.1b: upper bounds of the rating difference buckets and the
+# expected score of the higher rated player in each of them
+FIDE_DIFFS = (4, 11, 18, 26, 33, 40, 47, 54, 62, 69, 77, 84, 92, 99, 107,
+              114, 122, 130, 138, 146, 154, 163, 171, 180, 189, 198, 207,
+              216, 226, 236, 246, 257, 268, 279, 291, 303, 316, 329, 345,
+              358, 375, 392, 412, 433, 457, 485, 518, 560, 620, 736, 10000)
+FIDE_EXPECTED = tuple(Decimal('0.%d' % i) for i in range(50, 100)) + \
+    (Decimal('1.0'),)
+
+
+def fide_expected_score(diff):
+    """Expected score of the higher rated player for a rating difference"""
+    return FIDE_EXPECTED[min(bisect_right(FIDE_DIFFS, abs(diff)),
+                             len(FIDE_EXPECTED) - 1)]
+
+
+@algorithm
+def fide(white, black, result, white_games, black_games, provisional_k=32,
+         standard_k=24, provisional_limit=30):
+    w_k = standard_k if white_games > provisional_limit else provisional_k
+    b_k = standard_k if black_games > provisional_limit else provisional_k
 
     if result == 0:
         w_score = 1
@@ -50,12 +142,7 @@ def fide(white, black, result, ladder, provisional_k=32, standard_k=24,
     else:
         w_score = b_score = Decimal('0.5')
 
-    pd_value = None
-    for pair in pd.keys():
-        if pair[0] <= diff < pair[1]:
-            pd_value = pd[pair]
-            break
-    
+    pd_value = fide_expected_score(white - black)
     if white >= black:
         w_expected_score = pd_value
         b_expected_score = 1 - pd_value
@@ -63,6 +150,93 @@ def fide(white, black, result, ladder, provisional_k=32, standard_k=24,
         b_expected_score = pd_value
         w_expected_score = 1 - pd_value
 
-    new_w_rating = white.rating(ladder) + (w_score - w_expected_score) * w_k
-    new_b_rating = black.rating(ladder) + (b_score - b_expected_score) * b_k
+    new_w_rating = white + (w_score - w_expected_score) * w_k
+    new_b_rating = black + (b_score - b_expected_score) * b_k
     return new_w_rating, new_b_rating
+
+
+# Glicko-2 (Glickman, "Example of the Glicko-2 system"): ratings on the
+# Glicko scale are divided by GLICKO2_SCALE around 1500 for the computation
+GLICKO2_SCALE = 173.7178
+GLICKO2_EPSILON = 0.000001
+
+
+def glicko2_volatility(sigma, phi, v, delta, tau):
+    """New volatility, by the Illinois algorithm of step 5"""
+    a = math.log(sigma ** 2)
+
+    def f(x):
+        ex = math.exp(x)
+        return (ex * (delta ** 2 - phi ** 2 - v - ex) /
+                (2 * (phi ** 2 + v + ex) ** 2)) - (x - a) / tau ** 2
+
+    A = a
+    if delta ** 2 > phi ** 2 + v:
+        B = math.log(delta ** 2 - phi ** 2 - v)
+    else:
+        k = 1
+        while f(a - k * tau) < 0:
+            k += 1
+        B = a - k * tau
+    fA, fB = f(A), f(B)
+    while abs(B - A) > GLICKO2_EPSILON:
+        C = A + (A - B) * fA / (fB - fA)
+        fC = f(C)
+        if fC * fB <= 0:
+            A, fA = B, fB
+        else:
+            fA /= 2
+        B, fB = C, fC
+    return math.exp(A / 2)
+
+
+@period_algorithm
+def glicko2(players, white, black, result, tau=0.5, period='week',
+            initial_deviation=350, initial_volatility=0.06):
+    """
+    One Glicko-2 rating period. A player's deviation grows by one
+    period's volatility for each idle period since their last game, and is
+    capped at initial_deviation. The games are reduced to per-player sums in
+    one pass over the columns; each player is then updated once.
+    """
+    max_phi = initial_deviation / GLICKO2_SCALE
+    mu, phi, sigma = [], [], []
+    for rating, deviation, volatility, idle in players:
+        mu.append((float(rating) - 1500) / GLICKO2_SCALE)
+        if deviation is None:
+            phi.append(max_phi)
+            sigma.append(float(initial_volatility))
+        else:
+            volatility = float(volatility)
+            phi.append(min(math.sqrt((float(deviation) / GLICKO2_SCALE) ** 2 +
+                                     idle * volatility ** 2), max_phi))
+            sigma.append(volatility)
+    g = [1 / math.sqrt(1 + 3 * p ** 2 / math.pi ** 2) for p in phi]
+
+    # step 3 and 4 sums: sum of g^2 E (1 - E) and of g (s - E) per player
+    info = [0.0] * len(players)
+    improvement = [0.0] * len(players)
+    for w, b, r in zip(white, black, result):
+        score = (1.0, 0.0, 0.5)[r]
+        expected_w = 1 / (1 + math.exp(-g[b] * (mu[w] - mu[b])))
+        expected_b = 1 / (1 + math.exp(-g[w] * (mu[b] - mu[w])))
+        info[w] += g[b] ** 2 * expected_w * (1 - expected_w)
+        info[b] += g[w] ** 2 * expected_b * (1 - expected_b)
+        improvement[w] += g[b] * (score - expected_w)
+        improvement[b] += g[w] * (1 - score - expected_b)
+
+    rated = []
+    for i in range(len(players)):
+        if not info[i]:
+            rated.append((1500 + GLICKO2_SCALE * mu[i],
+                          GLICKO2_SCALE * phi[i], sigma[i]))
+            continue
+        v = 1 / info[i]
+        new_sigma = glicko2_volatility(sigma[i], phi[i], v,
+                                       v * improvement[i], tau)
+        phi_star = math.sqrt(phi[i] ** 2 + new_sigma ** 2)
+        new_phi = 1 / math.sqrt(1 / phi_star ** 2 + 1 / v)
+        new_mu = mu[i] + new_phi ** 2 * improvement[i]
+        rated.append((1500 + GLICKO2_SCALE * new_mu,
+                      GLICKO2_SCALE * new_phi, new_sigma))
+    return rated
@@ -0,0 +1,420 @@
+"""
+In-memory replay of a ladder's rating history.
+
+The processed games of a ladder are loaded once into compact columns, the
+ladder's algorithm is run over them in rating order against per-player state
+held in memory, and the results are written back in chunks inside a single
+transaction. This gives the same ratings as rating each game through
+set_ratings, without the per-game queries.
+"""
+from array import array
+from decimal import Decimal
+from django.db import models, transaction
+from club import metrics, rating_algs
+from club.models import Game, Rating, Ranking, load_algorithm, rated_games, \
+    case_update, lock_ladder, set_rank_order
+
+CHUNK_SIZE = 500
+
+# DecimalField(decimal_places=3) storage precision of Rating.rating
+RATING_PLACES = Decimal('0.001')
+
+
+class GameTable(object):
+    """Column store of a ladder's processed games, in rating order."""
+
+    def __init__(self, rows):
+        self.ids = array('l')
+        self.datetimes = []
+        self.white = array('l')
+        self.black = array('l')
+        self.result = array('b')
+        self.rounds = []
+        # players are referred to by their index in player_ids
+        self.player_ids = array('l')
+        self.player_index = {}
+        for game_id, datetime, white_id, black_id, result, round in rows:
+            self.ids.append(game_id)
+            self.datetimes.append(datetime)
+            self.white.append(self.index(white_id))
+            self.black.append(self.index(black_id))
+            self.result.append(result)
+            self.rounds.append(round)
+
+    def index(self, player_id):
+        if player_id not in self.player_index:
+            self.player_index[player_id] = len(self.player_ids)
+            self.player_ids.append(player_id)
+        return self.player_index[player_id]
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def load_games(ladder, since=None):
+    games = rated_games(ladder)
+    if since is not None:
+        games = games.filter(datetime__gte=since)
+    return GameTable(games.values_list(
+        'id', 'datetime', 'white_id', 'black_id', 'result',
+        'round').iterator())
+
+
+def starting_state(ladder, since=None):
+    """
+    Ratings and games played of every player on the ladder just before
+    `since` (or before the first game), keyed by player id, and the set of
+    players whose rating at that point comes from a Rating row.
+    """
+    ratings = dict(ladder.ranking_set.values_list(
+        'player_id', 'initial_rating'))
+    played = dict.fromkeys(ratings, 0)
+    rated = set()
+    if since is None:
+        return ratings, played, rated
+
+    for player_id, rating in Rating.objects.filter(
+            ladder=ladder, timestamp__lt=since).order_by(
+            'player', 'timestamp', 'id').values_list(
+            'player_id', 'rating').iterator():
+        ratings[player_id] = rating
+        rated.add(player_id)
+    earlier = rated_games(ladder).filter(datetime__lt=since).order_by()
+    for colour in ('white', 'black'):
+        for player_id, count in earlier.values_list(colour).annotate(
+                models.Count('id')):
+            played[player_id] = played.get(player_id, 0) + count
+    return ratings, played, rated
+
+
+def run(table, ratings, played, func):
+    """
+    Rate every game of the table. `ratings` and `played` are dicts keyed by
+    player id holding the state going into the first game; they are updated
+    in place. Returns the white and black ratings going into each game and
+    coming out of it, as four lists aligned with the table.
+    """
+    state = [ratings[player_id] for player_id in table.player_ids]
+    games = array('l', [played[player_id] for player_id in table.player_ids])
+    pre_white, pre_black, post_white, post_black = [], [], [], []
+    for i in range(len(table)):
+        w, b = table.white[i], table.black[i]
+        games[w] += 1
+        games[b] += 1
+        pre_white.append(state[w])
+        pre_black.append(state[b])
+        new_w, new_b = func(state[w], state[b], table.result[i],
+                            games[w], games[b])
+        state[w] = Decimal(new_w).quantize(RATING_PLACES)
+        state[b] = Decimal(new_b).quantize(RATING_PLACES)
+        post_white.append(state[w])
+        post_black.append(state[b])
+    for i, player_id in enumerate(table.player_ids):
+        ratings[player_id] = state[i]
+        played[player_id] = games[i]
+    return pre_white, pre_black, post_white, post_black
+
+
+def period_start(ladder, since, period):
+    """
+    Datetime of the first processed game of the rating period that contains
+    the games from `since` on: period algorithms are only replayed from the
+    start of a period.
+    """
+    first = rated_games(ladder).filter(datetime__gte=since).values_list(
+        'datetime', 'round').first()
+    if first is None:
+        return since
+    key = rating_algs.period_key(period, *first)
+    start = since
+    for moment, round in rated_games(ladder).filter(
+            datetime__lt=since).reverse().values_list(
+            'datetime', 'round').iterator():
+        if rating_algs.period_key(period, moment, round) != key:
+            break
+        start = moment
+    return start
+
+
+def period_starting_state(ladder, period, since=None):
+    """
+    (rating, deviation, volatility, key of the last rated period) of every
+    player on the ladder just before `since`, keyed by player id, and the set
+    of players whose state comes from a Rating row. Deviation and volatility
+    are None for players without one (and after ratings of per-game
+    algorithms).
+    """
+    states = dict((player_id, (rating, None, None, None))
+                  for player_id, rating in ladder.ranking_set.values_list(
+                      'player_id', 'initial_rating'))
+    rated = set()
+    if since is None:
+        return states, rated
+
+    for player_id, rating, deviation, volatility, timestamp, round in \
+            Rating.objects.filter(ladder=ladder, timestamp__lt=since).order_by(
+                'player', 'timestamp', 'id').values_list(
+                'player_id', 'rating', 'deviation', 'volatility', 'timestamp',
+                'game__round').iterator():
+        states[player_id] = (rating, deviation, volatility,
+                             rating_algs.period_key(period, timestamp, round))
+        rated.add(player_id)
+    return states, rated
+
+
+def run_periods(table, states, func, period):
+    """
+    Rate the games of the table a rating period at a time with a period
+    algorithm (see rating_algs.period_algorithm). `states` holds the state of
+    every player going into the first game, as from period_starting_state,
+    and is updated in place. Every game of a period gets its players' ratings
+    at the end of the period. Returns the four rating lists of run() and the
+    (deviation, volatility) of white and black after each game.
+    """
+    keys = [rating_algs.period_key(period, table.datetimes[i],
+                                   table.rounds[i])
+            for i in range(len(table))]
+    state = [list(states[player_id]) for player_id in table.player_ids]
+    pre_white, pre_black, post_white, post_black = [], [], [], []
+    white_state, black_state = [], []
+    start = 0
+    while start < len(table):
+        key = keys[start]
+        end = start
+        while end < len(table) and keys[end] == key:
+            end += 1
+
+        # the period's players, numbered in order of appearance
+        local, members = {}, []
+        white, black = array('l'), array('l')
+        for i in range(start, end):
+            for player, column in ((table.white[i], white),
+                                   (table.black[i], black)):
+                if player not in local:
+                    local[player] = len(members)
+                    members.append(player)
+                column.append(local[player])
+        players = []
+        for player in members:
+            rating, deviation, volatility, last = state[player]
+            idle = key - last - 1 if last is not None else 0
+            players.append((rating, deviation, volatility, max(idle, 0)))
+
+        rated = func(players, white, black, table.result[start:end])
+        for player, (rating, deviation, volatility) in zip(members, rated):
+            state[player] = [Decimal(rating).quantize(RATING_PLACES),
+                             deviation, volatility, key]
+        for i in range(start, end):
+            w, b = table.white[i], table.black[i]
+            pre_white.append(players[local[w]][0])
+            pre_black.append(players[local[b]][0])
+            post_white.append(state[w][0])
+            post_black.append(state[b][0])
+            white_state.append((state[w][1], state[w][2]))
+            black_state.append((state[b][1], state[b][2]))
+        start = end
+
+    for i, player_id in enumerate(table.player_ids):
+        states[player_id] = tuple(state[i])
+    return (pre_white, pre_black, post_white, post_black), \
+        (white_state, black_state)
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _case(pairs, output_field):
+    return models.Case(
+        *[models.When(id=pk, then=models.Value(value))
+          for pk, value in pairs],
+        output_field=output_field)
+
+
+def write_back(ladder, table, results, current, game_states=None):
+    pre_white, pre_black, post_white, post_black = results
+    if game_states is None:
+        game_states = ([(None, None)] * len(table),) * 2
+
+    ratings = []
+    for i in range(len(table)):
+        for player, rating, (deviation, volatility) in (
+                (table.white[i], post_white[i], game_states[0][i]),
+                (table.black[i], post_black[i], game_states[1][i])):
+            ratings.append(Rating(
+                ladder_id=ladder.id, player_id=table.player_ids[player],
+                rating=rating, deviation=deviation, volatility=volatility,
+                timestamp=table.datetimes[i], game_id=table.ids[i]))
+    Rating.objects.bulk_create(ratings, batch_size=CHUNK_SIZE)
+
+    # Game.white_rating/black_rating hold the integer rating going in
+    rows = list(zip(table.ids, pre_white, pre_black))
+    for chunk in _chunks(rows):
+        Game.objects.filter(id__in=[row[0] for row in chunk]).update(
+            white_rating=_case([(row[0], int(row[1])) for row in chunk],
+                               models.IntegerField()),
+            black_rating=_case([(row[0], int(row[2])) for row in chunk],
+                               models.IntegerField()))
+
+    rankings = dict(ladder.ranking_set.filter(
+        player__in=list(current)).values_list('player_id', 'id'))
+    rows = [(rankings[player_id], rating)
+            for player_id, rating in current.items() if player_id in rankings]
+    # current ratings may all be empty (a ladder's only game deleted)
+    case_update(Ranking, rows, [('current_rating', models.DecimalField(
+        decimal_places=3, max_digits=7))], CHUNK_SIZE)
+
+
+def game_counters(table):
+    """
+    Games played, wins, draws, losses, streak and last game datetime of every
+    player of a full game table, keyed by player id.
+    """
+    counters = [[0, 0, 0, 0, 0, None] for player_id in table.player_ids]
+    for i in range(len(table)):
+        result = table.result[i]
+        for player, score in ((table.white[i], (1, 0, 0.5)[result]),
+                              (table.black[i], (0, 1, 0.5)[result])):
+            row = counters[player]
+            row[0] += 1
+            if score == 1:
+                row[1] += 1
+                row[4] = row[4] + 1 if row[4] > 0 else 1
+            elif score == 0:
+                row[3] += 1
+                row[4] = row[4] - 1 if row[4] < 0 else -1
+            else:
+                row[2] += 1
+                row[4] = 0
+            if table.datetimes[i] is not None:
+                row[5] = table.datetimes[i]
+    return dict(zip(table.player_ids, counters))
+
+
+COUNTER_FIELDS = [('games_played', models.IntegerField()),
+                  ('wins', models.IntegerField()),
+                  ('draws', models.IntegerField()),
+                  ('losses', models.IntegerField()),
+                  ('streak', models.IntegerField()),
+                  ('last_played', models.DateTimeField())]
+
+
+def replay_counters(ladder, table=None):
+    """
+    Rebuild the game counters of a ladder's rankings from its processed
+    games (`table`, if already loaded, must hold all of them). Only rankings
+    whose counters change are written. Returns their number.
+    """
+    if table is None:
+        table = load_games(ladder)
+    counters = game_counters(table)
+    empty = [0, 0, 0, 0, 0, None]
+    rows = []
+    for row in ladder.ranking_set.values_list(
+            'id', 'player_id', *[name for name, field in COUNTER_FIELDS]):
+        values = counters.get(row[1], empty)
+        if list(row[2:]) != values:
+            rows.append([row[0]] + values)
+    case_update(Ranking, rows, COUNTER_FIELDS)
+    return len(rows)
+
+
+def replay_labels(ladder, since=None, players=()):
+    return dict(metrics.ladder_labels(ladder),
+                kind='full' if since is None else 'partial')
+
+
+@metrics.REPLAY.time(replay_labels)
+def replay_ladder(ladder, since=None, players=()):
+    """
+    Recompute the ratings of a ladder's processed games, all of them or only
+    those played at or after `since` (moved back to the start of its rating
+    period for period algorithms). The current ratings of `players` are
+    rewritten as well as those of the players of the replayed games. Returns
+    the number of games replayed.
+    """
+    func = load_algorithm(ladder)
+    period = None
+    if rating_algs.rates_periods(ladder.algorithm.method):
+        period = ladder.algorithm.params.get('period', 'week')
+    with transaction.atomic():
+        lock_ladder(ladder)
+        if period is not None and since is not None:
+            since = period_start(ladder, since, period)
+        stale = Rating.objects.filter(ladder=ladder)
+        if since is not None:
+            stale = stale.filter(timestamp__gte=since)
+        affected = set(stale.values_list('player_id', flat=True))
+        stale.delete()
+
+        table = load_games(ladder, since)
+        if period is None:
+            ratings, played, rated = starting_state(ladder, since)
+        else:
+            states, rated = period_starting_state(ladder, period, since)
+            ratings = states
+        missing = set(table.player_ids) - set(ratings)
+        if missing:
+            raise Ranking.DoesNotExist(
+                'Players %s have games but no ranking on %s'
+                % (sorted(missing), ladder))
+        if period is None:
+            results = run(table, ratings, played, func)
+            game_states = None
+        else:
+            results, game_states = run_periods(table, states, func, period)
+            ratings = dict((player_id, state[0])
+                           for player_id, state in states.items())
+
+        if since is None:
+            ladder.ranking_set.update(current_rating=None)
+        affected.update(table.player_ids)
+        affected.update(players)
+        rated.update(table.player_ids)
+        # players left without any Rating fall back to their initial_rating
+        current = dict((player_id, ratings[player_id]
+                        if player_id in rated else None)
+                       for player_id in affected if player_id in ratings)
+        write_back(ladder, table, results, current, game_states)
+        replay_counters(ladder, table if since is None else None)
+    metrics.GAMES_REPLAYED.inc(len(table), **metrics.ladder_labels(ladder))
+    return len(table)
+
+
+def replay_ranks(ladder):
+    """
+    Recompute the ranking order of a ladder from the initial ranks and the
+    results of its processed games, applying the same moves as
+    models.process_game, in memory, then write it with one set-based update.
+    Only active rankings take part; inactivity penalties and manual moves
+    are not part of the game history and are lost. Returns the number of
+    rankings that moved.
+    """
+    with transaction.atomic():
+        lock_ladder(ladder)
+        rankings = ladder.ranking_set.filter(is_active=True).order_by(
+            'initial_rank', 'id').values_list('id', 'player_id')
+        order = [pk for pk, player_id in rankings]
+        by_player = dict((player_id, pk) for pk, player_id in rankings)
+        table = load_games(ladder)
+        for i in range(len(table)):
+            white = by_player.get(table.player_ids[table.white[i]])
+            black = by_player.get(table.player_ids[table.black[i]])
+            if white is None or black is None:
+                continue
+            white_first = order.index(white) < order.index(black)
+            result = table.result[i]
+            if result == 0 and not white_first:
+                # white wins from below: white moves directly above black
+                order.remove(white)
+                order.insert(order.index(black), white)
+            elif result == 1 and white_first:
+                # black wins from below: black moves directly above white
+                order.remove(black)
+                order.insert(order.index(white), black)
+            elif result == 2 and not white_first:
+                # draw from below: white moves directly below black
+                order.remove(white)
+                order.insert(order.index(black) + 1, white)
+        return set_rank_order(ladder, order)
@@ -0,0 +1,106 @@
+"""
+Seeded synthetic ladders for benchmarks.
+
+generate_ladder() creates a ladder with N players and M processed games in
+bulk, then replays its ratings, ranks and head-to-head records so it is in
+the same state as a ladder whose games went through process_game. The same
+seed always gives the same players, pairings and results.
+
+Every player has a hidden strength. Games are mostly played between players
+of similar strength, as on a ladder where challenges go to nearby ranks, and
+results follow the Elo expectation of the strengths with more draws between
+close players.
+"""
+import datetime
+import random
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from club.models import Algorithm, Game, Ladder, Player, Ranking, \
+    RANK_KEY_GAP, explicit_game_datetimes, rebuild_head_to_head
+from club.replay import replay_ladder, replay_ranks
+
+BATCH_SIZE = 1000
+
+# Players seek opponents at most this many places away in strength order
+OPPONENT_REACH = 10
+
+# Draw rate between players of equal strength
+DRAW_RATE = 0.3
+
+
+def game_result(rng, white, black):
+    """0 (1-0), 1 (0-1) or 2 (draw) for hidden strengths white and black"""
+    expected = 1 / (1 + 10 ** ((black - white) / 400.0))
+    draw = DRAW_RATE * (1 - abs(2 * expected - 1))
+    roll = rng.random()
+    if roll < draw:
+        return 2
+    if roll < draw + (1 - draw) * expected:
+        return 0
+    return 1
+
+
+def generate_ladder(players, games, seed=0, method='fide', rank_mode=0):
+    """Create and replay a synthetic ladder; returns the Ladder"""
+    rng = random.Random(seed)
+    algorithm = Algorithm.objects.filter(method=method).first()
+    if algorithm is None:
+        algorithm = Algorithm.objects.create(name=method, method=method)
+
+    with transaction.atomic():
+        ladder = Ladder.objects.create(
+            name='Synthetic %d/%d (seed %d)' % (players, games, seed),
+            algorithm=algorithm, ladder_type=0, rank_mode=rank_mode,
+            description='Generated by club.synthetic')
+
+        # bulk_create skips the signals creating players and ranks
+        prefix = 'synthetic%d-' % ladder.id
+        User.objects.bulk_create(
+            [User(username='%s%d' % (prefix, i), password='!')
+             for i in range(players)], batch_size=BATCH_SIZE)
+        user_ids = User.objects.filter(username__startswith=prefix).order_by(
+            'id').values_list('id', flat=True)
+        Player.objects.bulk_create([Player(user_id=user_id, membership=1)
+                                    for user_id in user_ids],
+                                   batch_size=BATCH_SIZE)
+        player_ids = list(Player.objects.filter(
+            user__username__startswith=prefix).order_by('id').values_list(
+            'id', flat=True))
+
+        strength = dict((player_id, rng.gauss(1500, 250))
+                        for player_id in player_ids)
+        order = list(player_ids)
+        rng.shuffle(order)
+        Ranking.objects.bulk_create(
+            [Ranking(player_id=player_id, ladder=ladder, rank=i + 1,
+                     initial_rank=i + 1, rank_key=(i + 1) * RANK_KEY_GAP)
+             for i, player_id in enumerate(order)], batch_size=BATCH_SIZE)
+
+        by_strength = sorted(player_ids, key=strength.get)
+        start = timezone.now() - datetime.timedelta(days=365)
+        step = datetime.timedelta(days=365) / max(games, 1)
+        batch = []
+        with explicit_game_datetimes():
+            for n in range(games):
+                i = rng.randrange(players)
+                j = min(max(i + rng.choice([-1, 1]) *
+                            rng.randint(1, OPPONENT_REACH), 0), players - 1)
+                if i == j:
+                    j = i + 1 if i + 1 < players else i - 1
+                white, black = by_strength[i], by_strength[j]
+                if rng.random() < 0.5:
+                    white, black = black, white
+                batch.append(Game(
+                    white_id=white, black_id=black, ladder=ladder, status=4,
+                    result=game_result(rng, strength[white], strength[black]),
+                    datetime=start + step * n))
+                if len(batch) >= BATCH_SIZE:
+                    Game.objects.bulk_create(batch)
+                    batch = []
+            Game.objects.bulk_create(batch)
+
+        replay_ladder(ladder)
+        replay_ranks(ladder)
+        rebuild_head_to_head(ladder.id)
+    return Ladder.objects.get(id=ladder.id)
@@ -0,0 +1,1441 @@
+import datetime
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from django import forms
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, \
+    override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.six import StringIO
+from club import jobs, metrics, rating_algs
+from club.admin import LadderAdmin
+from club.forms import PlayerField
+from club.management.commands.import_pgn import pgn_datetime
+from club.management.commands.check_query_budgets import sample_paths
+from club.pagination import decode_cursor, encode_cursor, keyset_page
+from club.queryplans import check_plans
+from club.replay import replay_counters
+from club.synthetic import generate_ladder
+from club.swiss import PairingError, Snapshot, create_round, pair_round, \
+    tournament_snapshot
+from club.models import RANK_KEY_GAP, Algorithm, Bye, Game, HeadToHead, \
+    Ladder, OpeningStat, Ranking, bump_version, crunch_ratings, demote, \
+    enforce_inactivity, explicit_game_datetimes, head_to_head, \
+    inactivity_demotions, insert, ladder_standings, lock_ladder, \
+    process_game, rebalance_rank_keys, rebuild_head_to_head, \
+    refresh_opening_stats, rejoin, remove
+
+# Templates are rendered in full (no cached fragments, no static manifest)
+NO_CACHE = {'default': {
+    'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+STATIC_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+
+
+def make_ladder(players, ladder_type=0, method='fide', **kwargs):
+    """A ladder (or tournament) and its players, top ranked first"""
+    algorithm = Algorithm.objects.create(name=method, method=method)
+    ladder = Ladder.objects.create(name='Test', algorithm=algorithm,
+                                   ladder_type=ladder_type, **kwargs)
+    ranked = []
+    for i in range(players):
+        user = User.objects.create(username='l%d-player%d' % (ladder.id, i))
+        Ranking.objects.create(player=user.player, ladder=ladder)
+        ranked.append(user.player)
+    return ladder, ranked
+
+
+def play(ladder, white, black, result, **kwargs):
+    """A confirmed game, rated and ranked on save"""
+    return Game.objects.create(ladder=ladder, white=white, black=black,
+                               result=result, status=3, **kwargs)
+
+
+@override_settings(CLUB_GAME_QUEUE=False, CACHES=NO_CACHE,
+                   STATICFILES_STORAGE=STATIC_STORAGE)
+class StandingsQueryTests(TestCase):
+    """The standings are one query, whatever the size of the ladder"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ladder, players = make_ladder(8)
+        cls.tourney, entrants = make_ladder(6, ladder_type=1)
+        for i in range(0, 8, 2):
+            play(cls.ladder, players[i], players[i + 1], i % 3)
+        play(cls.tourney, entrants[0], entrants[1], 2)
+
+    def test_ladder_standings(self):
+        with self.assertNumQueries(1):
+            standings = ladder_standings(self.ladder)
+        self.assertEqual(len(standings), 8)
+        self.assertEqual([s.rank for s in standings], list(range(1, 9)))
+
+    def test_sparse_ladder_standings(self):
+        ladder, players = make_ladder(5, rank_mode=1)
+        with self.assertNumQueries(1):
+            standings = ladder_standings(ladder)
+        self.assertEqual([s.rank for s in standings], list(range(1, 6)))
+
+    def test_ladder_detail(self):
+        # the ladder, then its standings
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('ladder-detail',
+                                               args=[self.ladder.id]))
+        self.assertContains(response, 'l%d-player7' % self.ladder.id)
+
+    def test_tourney_detail(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('tourney-detail',
+                                               args=[self.tourney.id]))
+        self.assertContains(response, 'l%d-player5' % self.tourney.id)
+
+
+def ranking_state(ladder):
+    """Current rating and counters of every ranking of a ladder"""
+    return list(ladder.ranking_set.order_by('player').values_list(
+        'player_id', 'current_rating', 'games_played', 'wins', 'draws',
+        'losses', 'streak', 'last_played'))
+
+
+@override_settings(CLUB_GAME_QUEUE=False)
+class DeleteGameTests(TestCase):
+    """Deleting a processed game leaves the ladder as if it was never played"""
+
+    def setUp(self):
+        self.ladder, self.players = make_ladder(4)
+        a, b, c, d = self.players
+        self.games = [play(self.ladder, white, black, result)
+                      for white, black, result in ((a, b, 0), (c, d, 1),
+                                                   (a, c, 2), (b, d, 0),
+                                                   (a, d, 1), (b, c, 0))]
+
+    def test_delete_game_in_history(self):
+        self.games[1].delete()
+        deleted = ranking_state(self.ladder)
+        crunch_ratings(self.ladder)
+        self.assertEqual(deleted, ranking_state(self.ladder))
+
+    def test_delete_last_game(self):
+        # no later game is replayed, but its players lose its rating
+        b, c = self.players[1], self.players[2]
+        self.games[-1].delete()
+        deleted = ranking_state(self.ladder)
+        crunch_ratings(self.ladder)
+        self.assertEqual(deleted, ranking_state(self.ladder))
+        played = dict((row[0], row[2]) for row in deleted)
+        self.assertEqual((played[b.id], played[c.id]), (2, 2))
+
+    def test_delete_only_game(self):
+        ladder, (a, b) = make_ladder(2)
+        play(ladder, a, b, 0).delete()
+        self.assertEqual([row[1:] for row in ranking_state(ladder)],
+                         [(None, 0, 0, 0, 0, 0, None)] * 2)
+
+
+@override_settings(CLUB_GAME_QUEUE=False)
+class ProcessGameTests(TestCase):
+
+    def setUp(self):
+        self.ladder, self.players = make_ladder(3)
+        play(self.ladder, self.players[0], self.players[2], 0)
+
+    def test_confirm_undated_game(self):
+        a, b = self.players[:2]
+        game = Game.objects.create(ladder=self.ladder, white=a, black=b,
+                                   result=1, status=1)
+        Game.objects.filter(id=game.id).update(datetime=None)
+        game.refresh_from_db()
+        game.status = 3
+        game.save()
+        game.refresh_from_db()
+        self.assertEqual(game.status, 4)
+        self.assertIsNotNone(game.datetime)
+        self.assertEqual(game.rating_set.count(), 2)
+        processed = ranking_state(self.ladder)
+        crunch_ratings(self.ladder)
+        self.assertEqual(processed, ranking_state(self.ladder))
+
+
+class RatingAlgorithmTests(SimpleTestCase):
+
+    def test_fide_table_boundaries(self):
+        for diff, expected in ((0, '0.50'), (3, '0.50'), (4, '0.51'),
+                               (-4, '0.51'), (735, '0.99'), (736, '1.0'),
+                               (2000, '1.0')):
+            self.assertEqual(rating_algs.fide_expected_score(diff),
+                             Decimal(expected), diff)
+
+    def test_fide(self):
+        # equal ratings: half the K factor either way
+        self.assertEqual(rating_algs.fide(1500, 1500, 0, 1, 31),
+                         (Decimal('1516.00'), Decimal('1488.00')))
+        self.assertEqual(rating_algs.fide(1500, 1500, 2, 1, 1), (1500, 1500))
+
+    def test_registry(self):
+        func = rating_algs.get_algorithm('fide', {'provisional_k': 40})
+        self.assertEqual(func(1500, 1500, 1, 1, 1),
+                         (Decimal('1480.00'), Decimal('1520.00')))
+        self.assertIs(rating_algs.get_algorithm('fide', {'provisional_k': 40}),
+                      func)
+        self.assertTrue(rating_algs.rates_periods('glicko2'))
+        self.assertFalse(rating_algs.rates_periods('fide'))
+        with self.assertRaisesMessage(ValueError, 'Unknown rating algorithm'):
+            rating_algs.get_algorithm('elo', {})
+        with self.assertRaisesMessage(ValueError, 'does not accept params k'):
+            rating_algs.check_params('fide', {'k': 10})
+        with self.assertRaisesMessage(ValueError, 'period must be one of'):
+            rating_algs.check_params('glicko2', {'period': 'year'})
+
+    def test_glicko2_worked_example(self):
+        # Glickman, "Example of the Glicko-2 system"
+        rated = rating_algs.glicko2(
+            [(1500, 200, 0.06, 0), (1400, 30, 0.06, 0),
+             (1550, 100, 0.06, 0), (1700, 300, 0.06, 0)],
+            [0, 0, 0], [1, 2, 3], [0, 1, 1], tau=0.5)
+        rating, deviation, volatility = rated[0]
+        self.assertAlmostEqual(rating, 1464.05, places=2)
+        self.assertAlmostEqual(deviation, 151.52, places=2)
+        self.assertAlmostEqual(volatility, 0.059996, places=6)
+
+def standings_order(ladder):
+    """(rank, player id) of every ranking, in standings order"""
+    return [(standing.rank, standing.player_id)
+            for standing in ladder_standings(ladder)]
+
+
+@override_settings(CLUB_GAME_QUEUE=False)
+class RankShiftTests(TestCase):
+    """Every rank change leaves the ranks 1..N, and repeating it is a no-op"""
+
+    def setUp(self):
+        self.ladder, self.players = make_ladder(5)
+
+    def assert_order(self, *players, **kwargs):
+        inactive = kwargs.get('inactive', ())
+        self.assertEqual(standings_order(self.ladder),
+                         [(i + 1, player.id) for i, player in
+                          enumerate(players)] +
+                         [(None, player.id) for player in inactive])
+
+    def test_insert(self):
+        a, b, c, d, e = self.players
+        for repeat in range(2):
+            insert(b, e, self.ladder, above=True)
+            self.assert_order(a, e, b, c, d)
+        # already directly below
+        insert(e, b, self.ladder)
+        self.assert_order(a, e, b, c, d)
+        for repeat in range(2):
+            insert(d, a, self.ladder)
+            self.assert_order(e, b, c, d, a)
+
+    def test_demote(self):
+        a, b, c, d, e = self.players
+        demote(a, self.ladder)
+        self.assert_order(b, a, c, d, e)
+        demote(e, self.ladder)
+        self.assert_order(b, a, c, d, e)
+
+    def test_remove_and_rejoin(self):
+        a, b, c, d, e = self.players
+        for repeat in range(2):
+            remove(c, self.ladder)
+            self.assert_order(a, b, d, e, inactive=[c])
+        for repeat in range(2):
+            rejoin(c, self.ladder)
+            self.assert_order(a, b, d, e, c)
+
+    def test_game_processed_twice(self):
+        a, b, c, d, e = self.players
+        game = play(self.ladder, e, b, 0)
+        self.assert_order(a, e, b, c, d)
+        processed = ranking_state(self.ladder)
+        game.status = 3
+        with transaction.atomic():
+            process_game(game)
+        self.assert_order(a, e, b, c, d)
+        self.assertEqual(processed, ranking_state(self.ladder))
+        self.assertEqual(game.rating_set.count(), 2)
+
+
+class ConcurrentRankShiftTests(TransactionTestCase):
+
+    def test_shifts_wait_for_the_ladder_lock(self):
+        ladder, (a, b, c) = make_ladder(3)
+        holding, release, moved = threading.Event(), threading.Event(), []
+
+        def holder():
+            try:
+                with transaction.atomic():
+                    lock_ladder(ladder)
+                    holding.set()
+                    release.wait(5)
+                    # the move has not happened under the lock
+                    moved.append(standings_order(ladder))
+            finally:
+                connection.close()
+
+        def mover():
+            try:
+                insert(a, c, ladder, above=True)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=holder)]
+        threads[0].start()
+        holding.wait(5)
+        threads.append(threading.Thread(target=mover))
+        threads[1].start()
+        threads[1].join(0.5)
+        self.assertTrue(threads[1].is_alive())
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(moved, [[(1, a.id), (2, b.id), (3, c.id)]])
+        self.assertEqual(standings_order(ladder),
+                         [(1, c.id), (2, a.id), (3, b.id)])
+
+
+@override_settings(CLUB_GAME_QUEUE=False)
+class SparseRankTests(TestCase):
+    """Moves on a sparse ladder write only the moving ranking's key"""
+
+    def setUp(self):
+        self.ladder, self.players = make_ladder(5, rank_mode=1)
+
+    def keys(self):
+        return dict(self.ladder.ranking_set.values_list('player', 'rank_key'))
+
+    def assert_order(self, *players):
+        self.assertEqual(standings_order(self.ladder),
+                         [(i + 1, player.id)
+                          for i, player in enumerate(players)])
+
+    def test_insert_rewrites_one_key(self):
+        a, b, c, d, e = self.players
+        keys = self.keys()
+        insert(b, e, self.ladder, above=True)
+        self.assert_order(a, e, b, c, d)
+        moved = self.keys()
+        self.assertTrue(keys[a.id] < moved[e.id] < keys[b.id])
+        del keys[e.id], moved[e.id]
+        self.assertEqual(keys, moved)
+
+    def test_game_moves_winner(self):
+        a, b, c, d, e = self.players
+        play(self.ladder, d, b, 0)
+        self.assert_order(a, d, b, c, e)
+        self.assertEqual(self.ladder.ranking_set.get(player=d).current_rank,
+                         2)
+
+    def test_insert_without_room_rebalances(self):
+        a, b, c, d, e = self.players
+        Ranking.objects.filter(ladder=self.ladder, player=a).update(
+            rank_key=1)
+        Ranking.objects.filter(ladder=self.ladder, player=b).update(
+            rank_key=2)
+        insert(a, e, self.ladder)
+        self.assert_order(a, e, b, c, d)
+        # respaced, then e takes the midpoint below a
+        keys = self.keys()
+        self.assertEqual([keys[player.id] for player in (a, e, b, c, d)],
+                         [RANK_KEY_GAP, RANK_KEY_GAP * 3 // 2,
+                          2 * RANK_KEY_GAP, 3 * RANK_KEY_GAP,
+                          4 * RANK_KEY_GAP])
+
+    def test_rebalance(self):
+        a, b, c, d, e = self.players
+        insert(a, d, self.ladder, above=True)
+        remove(b, self.ladder)
+        self.assertEqual(rebalance_rank_keys(self.ladder), 4)
+        self.assertEqual(
+            list(self.ladder.ranking_set.order_by('rank_key').values_list(
+                'player', 'rank', 'rank_key')),
+            [(d.id, 1, RANK_KEY_GAP), (a.id, 2, 2 * RANK_KEY_GAP),
+             (c.id, 3, 3 * RANK_KEY_GAP), (e.id, 4, 4 * RANK_KEY_GAP),
+             (b.id, None, None)])
+        rejoin(b, self.ladder)
+        self.assert_order(d, a, c, e, b)
+
+
+class InactivityTests(TestCase):
+
+    def setUp(self):
+        self.ladder, self.players = make_ladder(6, inactivity_period=30,
+                                                demotion_inc=2)
+        self.ids = list(self.ladder.ranking_set.order_by('rank').values_list(
+            'id', flat=True))
+        self.now = timezone.now()
+
+    def last_played(self, *idle):
+        """Everyone played yesterday except the players at `idle` ranks"""
+        days = dict((player.id, 60 if i in idle else 1)
+                    for i, player in enumerate(self.players))
+        return dict(((self.ladder.id, player_id),
+                     self.now - datetime.timedelta(days=age))
+                    for player_id, age in days.items())
+
+    def test_overdue_rankings_drop(self):
+        dropped, before, order = inactivity_demotions(
+            self.ladder, self.now, self.last_played(0, 1))
+        ids = self.ids
+        self.assertEqual(dropped, ids[:2])
+        self.assertEqual(before, ids)
+        self.assertEqual(order, [ids[2], ids[3], ids[0], ids[1], ids[4],
+                                 ids[5]])
+
+    def test_no_ranking_rises_at_the_bottom(self):
+        # the last ranking can't drop; the one two above drops only as far
+        # as the overdue ranking below it allows
+        dropped, before, order = inactivity_demotions(
+            self.ladder, self.now, self.last_played(3, 5))
+        ids = self.ids
+        self.assertEqual(dropped, [ids[3]])
+        self.assertEqual(order, [ids[0], ids[1], ids[2], ids[4], ids[3],
+                                 ids[5]])
+
+    def test_enforce_records_dropped_rankings_only(self):
+        dropped, before, order = enforce_inactivity(
+            self.ladder, self.now, self.last_played(4, 5))
+        self.assertEqual(dropped, [])
+        self.assertEqual(order, self.ids)
+        self.assertFalse(self.ladder.ranking_set.filter(
+            inactivity_demoted_at__isnull=False).exists())
+
+        dropped, before, order = enforce_inactivity(
+            self.ladder, self.now, self.last_played(2, 5))
+        self.assertEqual(dropped, [self.ids[2]])
+        self.assertEqual(list(self.ladder.ranking_set.order_by(
+            'rank').values_list('id', flat=True)), order)
+        self.assertEqual(list(self.ladder.ranking_set.filter(
+            inactivity_demoted_at=self.now).values_list('id', flat=True)),
+            [self.ids[2]])
+
+
+class QueueTests(TestCase):
+
+    def setUp(self):
+        self.ladder, self.players = make_ladder(2)
+        self.other, self.others = make_ladder(2)
+
+    def test_confirming_queues_one_job(self):
+        a, b = self.players
+        game = play(self.ladder, a, b, 0)
+        game.save()
+        self.assertEqual(game.gamejob_set.count(), 1)
+        self.assertEqual(jobs.work(), 1)
+        game.refresh_from_db()
+        self.assertEqual(game.status, 4)
+        self.assertEqual(game.gamejob_set.get().status, jobs.DONE)
+        self.assertEqual(jobs.work(), 0)
+
+    def test_one_running_job_per_ladder(self):
+        a, b = self.players
+        first, second = play(self.ladder, a, b, 0), play(self.ladder, b, a, 1)
+        third = play(self.other, self.others[0], self.others[1], 2)
+        now = timezone.now()
+        job = jobs.claim_job(now)
+        self.assertEqual((job.game_id, job.status, job.attempts),
+                         (first.id, jobs.RUNNING, 1))
+        self.assertEqual(jobs.claim_job(now).game_id, third.id)
+        self.assertIsNone(jobs.claim_job(now))
+
+        # a worker that died is replaced after RUNNING_TIMEOUT
+        later = now + jobs.RUNNING_TIMEOUT + datetime.timedelta(seconds=1)
+        job = jobs.claim_job(later)
+        self.assertEqual((job.game_id, job.attempts), (first.id, 2))
+        self.assertTrue(jobs.run_job(job))
+        self.assertEqual(jobs.claim_job(later).game_id, second.id)
+
+    def test_retry_then_fail(self):
+        a, b = self.players
+        game = Game.objects.create(ladder=self.ladder, white=a, black=b,
+                                   status=3)
+        now = timezone.now()
+        # the worker logs each failure with its traceback
+        logging.disable(logging.ERROR)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        for attempt in range(1, jobs.MAX_ATTEMPTS + 1):
+            job = jobs.claim_job(now)
+            self.assertEqual(job.attempts, attempt)
+            self.assertFalse(jobs.run_job(job))
+            job.refresh_from_db()
+            self.assertIn('has no result to process', job.last_error)
+            if attempt < jobs.MAX_ATTEMPTS:
+                # backed off
+                self.assertEqual(job.status, jobs.QUEUED)
+                self.assertIsNone(jobs.claim_job(now))
+                now = job.available_at
+        self.assertEqual(job.status, jobs.FAILED)
+        self.assertIsNone(jobs.claim_job(now + datetime.timedelta(days=1)))
+        game.refresh_from_db()
+        self.assertEqual(game.status, 3)
+
+
+class ConcurrentClaimTests(TransactionTestCase):
+
+    def test_workers_never_run_one_ladder_twice(self):
+        ladder, (a, b) = make_ladder(2)
+        play(ladder, a, b, 0)
+        play(ladder, b, a, 0)
+        claimed, holding, release = [], threading.Event(), threading.Event()
+
+        def first():
+            # claims and holds its transaction open
+            try:
+                with transaction.atomic():
+                    claimed.append(jobs.claim_job())
+                    holding.set()
+                    release.wait(5)
+            finally:
+                connection.close()
+
+        def second():
+            try:
+                claimed.append(jobs.claim_job())
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=first)]
+        threads[0].start()
+        holding.wait(5)
+        threads.append(threading.Thread(target=second))
+        threads[1].start()
+        # the second worker waits for the first claim to commit
+        threads[1].join(0.5)
+        self.assertTrue(threads[1].is_alive())
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(claimed), 2)
+        self.assertIsNotNone(claimed[0])
+        self.assertIsNone(claimed[1])
+
+
+@override_settings(CLUB_GAME_QUEUE=False)
+class RatingHistoryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ladder, (cls.a, cls.b) = make_ladder(2)
+        start = datetime.datetime(2016, 3, 7, 9, tzinfo=timezone.utc)
+        with explicit_game_datetimes():
+            # two games a day on four days
+            for i in range(8):
+                play(cls.ladder, cls.a, cls.b, i % 3,
+                     datetime=start + datetime.timedelta(hours=i * 12 + i % 2))
+        cls.url = reverse('ladder-ratings', args=[cls.ladder.id])
+
+    def history(self, url=None, **params):
+        response = self.client.get(url or self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return dict((player['id'], player['ratings'])
+                    for player in response.json()['players'])
+
+    def test_full_history(self):
+        history = self.history()
+        self.assertEqual(sorted(history), [self.a.id, self.b.id])
+        self.assertEqual(len(history[self.a.id]), 8)
+        for player in (self.a, self.b):
+            self.assertEqual(
+                history[player.id][-1][1],
+                float(self.ladder.ranking_set.get(player=player).rating))
+
+    def test_downsampling(self):
+        full = self.history()[self.a.id]
+        self.assertEqual(self.history(bucket='day')[self.a.id], full[1::2])
+        self.assertEqual(self.history(bucket='week')[self.a.id], full[-1:])
+        self.assertEqual(self.history(points=3)[self.a.id],
+                         [full[2], full[4], full[7]])
+        self.assertEqual(self.history(bucket='day', points=2)[self.a.id],
+                         [full[3], full[7]])
+        player = self.history(reverse('player-ratings', args=[
+            self.ladder.id, self.b.id]), points=1)
+        self.assertEqual(list(player), [self.b.id])
+        for params in ({'bucket': 'year'}, {'points': '0'},
+                       {'since': 'yesterday'}):
+            self.assertEqual(self.client.get(self.url, params).status_code,
+                             400)
+
+    def test_etag(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(
+            self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # another view of the same history has its own tag
+        self.assertEqual(self.client.get(
+            self.url, {'points': 2}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        play(self.ladder, self.b, self.a, 0)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+LOCAL_CACHE = {'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CLUB_GAME_QUEUE=False, CACHES=LOCAL_CACHE,
+                   STATICFILES_STORAGE=STATIC_STORAGE)
+class LadderCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.ladder, self.players = make_ladder(3)
+
+    def version(self):
+        return Ladder.objects.get(id=self.ladder.id).version
+
+    def page(self, name, *args):
+        return self.client.get(reverse(name, args=args)).content.decode(
+            'utf-8')
+
+    def test_detail_page(self):
+        a, b, c = self.players
+        with self.assertNumQueries(2):
+            page = self.page('ladder-detail', self.ladder.id)
+        # the cached fragment needs no standings query
+        with self.assertNumQueries(1):
+            self.assertEqual(self.page('ladder-detail', self.ladder.id), page)
+
+        # changes that leave the version alone are not seen
+        User.objects.filter(id=c.user_id).update(username='renamed')
+        self.assertEqual(self.page('ladder-detail', self.ladder.id), page)
+        bump_version(self.ladder.id)
+        page = self.page('ladder-detail', self.ladder.id)
+        self.assertIn('renamed', page)
+
+        # processing a game bumps it
+        play(self.ladder, c, a, 0)
+        page = self.page('ladder-detail', self.ladder.id)
+        self.assertIn('#1 renamed', page)
+
+    def test_game_list(self):
+        a, b, c = self.players
+        self.assertNotIn('/games/', self.page('ladder-games', self.ladder.id))
+        game = play(self.ladder, a, b, 2)
+        self.assertIn(reverse('game-detail', args=[game.id]),
+                      self.page('ladder-games', self.ladder.id))
+
+    def test_ladder_list(self):
+        self.assertIn('>Test<', self.page('ladder-list'))
+        ladder = Ladder.objects.get(id=self.ladder.id)
+        ladder.name = 'Renamed'
+        LadderAdmin(Ladder, admin.site).save_model(None, ladder, None, True)
+        self.assertIn('>Renamed<', self.page('ladder-list'))
+
+    def test_stale_save_keeps_version(self):
+        stale = Ladder.objects.get(id=self.ladder.id)
+        bump_version(self.ladder.id)
+        bump_version(self.ladder.id)
+        version = self.version()
+        stale.name = 'Renamed'
+        stale.save()
+        self.assertEqual(self.version(), version)
+        LadderAdmin(Ladder, admin.site).save_model(None, stale, None, True)
+        ladder = Ladder.objects.get(id=self.ladder.id)
+        self.assertEqual((ladder.name, ladder.version),
+                         ('Renamed', version + 1))
+
+
+@override_settings(CACHES=NO_CACHE, STATICFILES_STORAGE=STATIC_STORAGE)
+class KeysetPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ladder, (a, b) = make_ladder(2)
+        noon = datetime.datetime(2016, 3, 1, 12, tzinfo=timezone.utc)
+        with explicit_game_datetimes():
+            # three games share a datetime: ids break the tie
+            for hours in (0, 1, 1, 1, 2, 3, 4):
+                Game.objects.create(
+                    ladder=cls.ladder, white=a, black=b, result=0, status=4,
+                    datetime=noon + datetime.timedelta(hours=hours))
+        cls.newest_first = list(cls.ladder.game_set.order_by(
+            '-datetime', '-id'))
+
+    def walk(self, newest_first):
+        """Every page forwards, then every page back from the last one"""
+        def page(**cursor):
+            return keyset_page(self.ladder.game_set.all(), 2, newest_first,
+                               **cursor)
+        pages = [page()]
+        while pages[-1].next_cursor:
+            pages.append(page(after=decode_cursor(pages[-1].next_cursor)))
+        back = [pages[-1]]
+        while back[-1].prev_cursor:
+            back.append(page(before=decode_cursor(back[-1].prev_cursor)))
+        return ([page.object_list for page in pages],
+                [page.object_list for page in reversed(back)])
+
+    def test_pages_cover_ties_once(self):
+        forwards, backwards = self.walk(newest_first=True)
+        games = self.newest_first
+        self.assertEqual(forwards, [games[0:2], games[2:4], games[4:6],
+                                    games[6:]])
+        self.assertEqual(backwards, forwards)
+
+    def test_oldest_first(self):
+        forwards, backwards = self.walk(newest_first=False)
+        games = self.newest_first[::-1]
+        self.assertEqual(forwards, [games[0:2], games[2:4], games[4:6],
+                                    games[6:]])
+        self.assertEqual(backwards, forwards)
+
+    def test_views(self):
+        url = reverse('ladder-games', args=[self.ladder.id])
+        # links from before keyset pagination show the first page
+        response = self.client.get(url + '?page=3')
+        self.assertEqual(list(response.context['page'].object_list),
+                         self.newest_first)
+        cursor = encode_cursor(self.newest_first[3])
+        response = self.client.get(url + '?after=' + cursor)
+        self.assertEqual(list(response.context['page'].object_list),
+                         self.newest_first[4:])
+        response = self.client.get(url + '?before=' + cursor)
+        self.assertEqual(list(response.context['page'].object_list),
+                         self.newest_first[:3])
+
+    def test_forged_cursors(self):
+        url = reverse('ladder-games', args=[self.ladder.id])
+        for cursor in ('x', '1.2.3', '1', '%d.1' % 10 ** 20,
+                       '-%d.1' % 10 ** 20, '%d.1' % 10 ** 18):
+            for direction in ('after', 'before'):
+                response = self.client.get(url, {direction: cursor})
+                self.assertEqual(response.status_code, 404, cursor)
+
+
+@override_settings(CLUB_GAME_QUEUE=False, CACHES=NO_CACHE,
+                   STATICFILES_STORAGE=STATIC_STORAGE)
+class ProfileTests(TestCase):
+
+    def test_sparse_ranks_in_one_query(self):
+        user = User.objects.create(username='member')
+        expected = {}
+        for players in range(1, 4):
+            # the member joins every ladder last and climbs one place
+            ladder, players = make_ladder(players, rank_mode=1)
+            Ranking.objects.create(player=user.player, ladder=ladder)
+            play(ladder, user.player, players[-1], 0)
+            expected[ladder.id] = len(players)
+        self.client.force_login(user)
+        # session, user, player, rankings, games
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('profile'))
+        self.assertEqual(dict((row[0].id, row[1]) for row in
+                              response.context['ratings_rankings_list']),
+                         expected)
+
+
+class PlayerFieldTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.q1 = User.objects.create(username='q1').player
+        cls.ab = User.objects.create(username='Ab').player
+        cls.ab_lower = User.objects.create(username='ab').player
+
+    def test_case_insensitive(self):
+        self.assertEqual(PlayerField().clean('Q1'), self.q1)
+        self.assertEqual(PlayerField().clean(' q1 '), self.q1)
+
+    def test_exact_case_wins(self):
+        self.assertEqual(PlayerField().clean('Ab'), self.ab)
+        self.assertEqual(PlayerField().clean('ab'), self.ab_lower)
+
+    def test_ambiguous(self):
+        with self.assertRaisesMessage(forms.ValidationError,
+                                      'enter the username exactly'):
+            PlayerField().clean('AB')
+
+    def test_unknown_player(self):
+        with self.assertRaisesMessage(forms.ValidationError,
+                                      'There is no player named "nobody".'):
+            PlayerField().clean('nobody')
+
+
+@override_settings(CLUB_GAME_QUEUE=True, CACHES=NO_CACHE,
+                   STATICFILES_STORAGE=STATIC_STORAGE)
+class ReportGameTests(TestCase):
+
+    def setUp(self):
+        self.ladder, self.players = make_ladder(2)
+        self.other, others = make_ladder(1)
+        self.client.force_login(self.players[0].user)
+
+    def report(self, ladder, posted_ladder):
+        """Report a game on the page of `ladder`, posting another ladder"""
+        white, black = self.players
+        return self.client.post(reverse('report-games', args=[ladder.id]), {
+            'white': white.user.username, 'black': black.user.username,
+            'time_control': '15+10', 'result': 0,
+            'datetime': '2016-04-01 12:00', 'ladder': posted_ladder.id})
+
+    def test_report(self):
+        response = self.report(self.ladder, self.other)
+        self.assertEqual(response.status_code, 302)
+        game = Game.objects.get()
+        self.assertEqual((game.ladder, game.status), (self.ladder, 1))
+
+    def test_players_must_join_the_page_ladder(self):
+        # a posted ladder the players have joined does not count
+        response = self.report(self.other, self.ladder)
+        self.assertContains(response, 'has not joined the ladder')
+        self.assertFalse(Game.objects.exists())
+
+    def test_unknown_ladder(self):
+        response = self.client.get(reverse('report-games', args=[0]))
+        self.assertEqual(response.status_code, 404)
+
+
+PGN_GAME = """[Event "Club ladder"]
+[Date "%s"]
+[Time "%s"]
+[White "%s"]
+[Black "%s"]
+[Result "%s"]
+
+1. e4 e5 2. Nf3 %s
+
+"""
+
+
+@override_settings(CLUB_GAME_QUEUE=False)
+class ImportTests(TestCase):
+
+    def setUp(self):
+        self.ladder, self.players = make_ladder(3)
+
+    def test_pgn_datetime(self):
+        utc = timezone.utc
+        self.assertEqual(pgn_datetime({'Date': '2016.02.29',
+                                       'Time': '18:30:05'}),
+                         datetime.datetime(2016, 2, 29, 18, 30, 5, tzinfo=utc))
+        self.assertEqual(pgn_datetime({'Date': '2016.02.29', 'Time': '18:30'}),
+                         datetime.datetime(2016, 2, 29, 18, 30, tzinfo=utc))
+        # an unknown or impossible time is noon
+        for time in ('??:??:??', '25:00:00', ''):
+            self.assertEqual(pgn_datetime({'Date': '2016.02.29',
+                                           'Time': time}),
+                             datetime.datetime(2016, 2, 29, 12, tzinfo=utc))
+        for date in ('2016.??.??', '2016.02', '2016.02.30', '', '0000.01.01'):
+            self.assertIsNone(pgn_datetime({'Date': date}))
+
+    def import_pgn(self, games):
+        names = [player.user.username for player in self.players]
+        text = ''.join(PGN_GAME % (date, time, names[white], names[black],
+                                   result, result)
+                       for date, time, white, black, result in games)
+        with tempfile.NamedTemporaryFile(suffix='.pgn') as pgn:
+            pgn.write(text.encode('utf-8'))
+            pgn.flush()
+            call_command('import_pgn', pgn.name,
+                         '--ladder=%d' % self.ladder.id, stdout=StringIO(),
+                         stderr=StringIO())
+
+    def test_import(self):
+        a, b, c = self.players
+        self.import_pgn([('2016.01.02', '12:00:00', 2, 0, '1-0'),
+                         ('2016.01.01', '12:00:00', 1, 2, '1/2-1/2'),
+                         ('2016.01.03', '12:00:00', 0, 1, '0-1')])
+        games = Game.objects.filter(ladder=self.ladder, status=4)
+        self.assertEqual(games.count(), 3)
+        self.assertEqual(self.ladder.rating_set.count(), 6)
+        # c beat a from below, then b beat a from below
+        self.assertEqual(list(self.ladder.ranking_set.order_by(
+            'rank').values_list('player', flat=True)), [c.id, b.id, a.id])
+        imported = ranking_state(self.ladder)
+        crunch_ratings(self.ladder)
+        self.assertEqual(imported, ranking_state(self.ladder))
+        self.assertEqual([row[2:6] for row in imported],
+                         [(2, 0, 0, 2), (2, 1, 1, 0), (2, 1, 1, 0)])
+
+    def test_bad_headers_skip_the_game_only(self):
+        self.import_pgn([('2016.02.30', '12:00:00', 0, 1, '1-0'),
+                         ('2016.02.28', '25:00:00', 0, 1, '0-1'),
+                         ('2016.02.28', '13:00:00', 0, 0, '1-0'),
+                         ('2016.02.29', '13:00:00', 1, 2, '*')])
+        games = Game.objects.filter(ladder=self.ladder)
+        self.assertEqual(list(games.values_list('datetime', 'result')),
+                         [(datetime.datetime(2016, 2, 28, 12,
+                                             tzinfo=timezone.utc), 1)])
+
+
+@override_settings(CLUB_GAME_QUEUE=False)
+class ExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ladder, (a, b) = make_ladder(2)
+        cls.public = play(cls.ladder, a, b, 0, pgn='1. e4 e5 2. Nf3 1-0')
+        cls.private = play(cls.ladder, b, a, 2, visible=1,
+                           pgn='1. d4 Nf6 2. c4 1/2-1/2')
+
+    def export(self, format):
+        response = self.client.get(reverse('ladder-export',
+                                           args=[self.ladder.id, format]))
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_pgn_leaves_out_private_games(self):
+        pgn = self.export('pgn')
+        self.assertIn('1. e4 e5 2. Nf3', pgn)
+        self.assertNotIn('1. d4 Nf6', pgn)
+        self.assertEqual(pgn.count('[Event '), 1)
+
+    def test_csv_leaves_out_private_games(self):
+        rows = self.export('csv').splitlines()
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(rows[1].startswith('%d,' % self.public.id))
+
+
+def opening_table(ladder):
+    return sorted(OpeningStat.objects.filter(ladder=ladder).values_list(
+        'eco', 'name', 'games', 'white_wins', 'draws', 'black_wins'))
+
+
+@override_settings(CLUB_GAME_QUEUE=False)
+class OpeningStatTests(TestCase):
+
+    def setUp(self):
+        self.ladder, (self.a, self.b) = make_ladder(2)
+        self.games = [play(self.ladder, self.a, self.b, result, eco=eco)
+                      for result, eco in ((0, 'B50'), (2, 'B50'), (1, 'C20'),
+                                          (0, 'B50'), (0, None))]
+
+    def test_processed_games_are_counted_in(self):
+        table = opening_table(self.ladder)
+        self.assertEqual(table, [
+            ('B50', 'Sicilian Defense: Modern Variations', 3, 2, 1, 0),
+            ('C20', "King's Pawn Game", 1, 0, 0, 1)])
+        refresh_opening_stats(self.ladder.id)
+        self.assertEqual(table, opening_table(self.ladder))
+
+    def test_confirm_does_not_aggregate_the_history(self):
+        with CaptureQueriesContext(connection) as queries:
+            play(self.ladder, self.b, self.a, 1, eco='C20')
+        self.assertFalse([query['sql'] for query in queries
+                          if 'GROUP BY' in query['sql']])
+        self.assertEqual(opening_table(self.ladder)[1][2:], (2, 0, 0, 2))
+
+    def test_edits_and_deletions_rebuild(self):
+        self.games[2].eco = 'B50'
+        self.games[2].save()
+        self.assertEqual(opening_table(self.ladder), [
+            ('B50', 'Sicilian Defense: Modern Variations', 4, 2, 1, 1)])
+        self.games[0].delete()
+        self.assertEqual(opening_table(self.ladder)[0][2:], (3, 1, 1, 1))
+
+
+def head_to_head_table(ladder):
+    return sorted(HeadToHead.objects.filter(ladder=ladder).values_list(
+        'player', 'opponent', 'wins', 'draws', 'losses', 'last_played'))
+
+
+@override_settings(CLUB_GAME_QUEUE=False)
+class HeadToHeadTests(TestCase):
+
+    def setUp(self):
+        self.ladder, self.players = make_ladder(3)
+        a, b, c = self.players
+        start = datetime.datetime(2016, 3, 7, 18, tzinfo=timezone.utc)
+        with explicit_game_datetimes():
+            # the last game is reported late
+            self.games = [
+                play(self.ladder, white, black, result,
+                     datetime=start + datetime.timedelta(days=day))
+                for day, white, black, result in (
+                    (0, a, b, 0), (1, b, a, 0), (2, a, b, 2), (3, c, a, 1),
+                    (4, b, c, 0), (1, a, c, 0))]
+
+    def test_processed_games_equal_rebuild(self):
+        table = head_to_head_table(self.ladder)
+        self.assertEqual(len(table), 3)
+        rebuild_head_to_head(self.ladder.id)
+        self.assertEqual(table, head_to_head_table(self.ladder))
+
+    def test_records_from_either_side(self):
+        a, b, c = self.players
+        record, = head_to_head(a.id, b.id)
+        self.assertEqual((record.ladder, record.wins, record.draws,
+                          record.losses), (self.ladder, 1, 1, 1))
+        record, = head_to_head(c.id, a.id, self.ladder.id)
+        self.assertEqual((record.wins, record.draws, record.losses,
+                          record.last_played), (0, 0, 2, self.games[3].datetime))
+        self.assertEqual(head_to_head(a.id, b.id, ladder_id=0), [])
+
+    def test_edits_and_deletions(self):
+        a, b, c = self.players
+        self.games[0].result = 1
+        self.games[0].save()
+        self.games[4].delete()
+        edited = head_to_head_table(self.ladder)
+        rebuild_head_to_head(self.ladder.id)
+        self.assertEqual(edited, head_to_head_table(self.ladder))
+        self.assertEqual(head_to_head(b.id, c.id), [])
+        record, = head_to_head(b.id, a.id)
+        self.assertEqual((record.wins, record.draws, record.losses),
+                         (2, 1, 0))
+
+
+@override_settings(CLUB_GAME_QUEUE=False)
+class CounterTests(TestCase):
+    """Counters kept by count_game match a rebuild from the games"""
+
+    def setUp(self):
+        self.ladder, self.players = make_ladder(3)
+        self.start = datetime.datetime(2016, 3, 7, 18, tzinfo=timezone.utc)
+
+    def play(self, day, white, black, result):
+        with explicit_game_datetimes():
+            return play(self.ladder, white, black, result,
+                        datetime=self.start + datetime.timedelta(days=day))
+
+    def test_counted_games_equal_rebuild(self):
+        a, b, c = self.players
+        for day, white, black, result in ((0, a, b, 0), (1, c, a, 1),
+                                          (2, a, c, 2), (3, b, a, 1),
+                                          (4, a, b, 0), (5, c, b, 0)):
+            self.play(day, white, black, result)
+        counted = ranking_state(self.ladder)
+        self.assertEqual(counted[0][2:], (5, 4, 1, 0, 2, self.start +
+                                          datetime.timedelta(days=4)))
+        self.assertEqual(replay_counters(self.ladder), 0)
+        self.assertEqual(counted, ranking_state(self.ladder))
+
+    def test_late_game(self):
+        a, b, c = self.players
+        self.play(0, a, b, 0)
+        self.play(2, a, b, 0)
+        # reported late, so the ladder is replayed
+        self.play(1, b, a, 0)
+        self.assertEqual(Ranking.objects.get(
+            ladder=self.ladder, player=a).streak, 1)
+        replayed = ranking_state(self.ladder)
+        self.assertEqual(replay_counters(self.ladder), 0)
+        self.assertEqual(replayed, ranking_state(self.ladder))
+
+    def test_rebuild_player_stats(self):
+        a, b, c = self.players
+        self.play(0, a, b, 0)
+        self.play(1, b, c, 2)
+        counted = ranking_state(self.ladder)
+        self.ladder.ranking_set.update(games_played=0, wins=7, streak=0,
+                                       last_played=None)
+        out = StringIO()
+        call_command('rebuild_player_stats', str(self.ladder.id), stdout=out)
+        self.assertIn('3 ranking(s) updated', out.getvalue())
+        self.assertEqual(counted, ranking_state(self.ladder))
+
+
+def game_table(ladder):
+    """Games of a ladder as (white, black, result), players by join order"""
+    order = dict((player_id, i) for i, player_id in enumerate(
+        ladder.ranking_set.order_by('player').values_list(
+            'player_id', flat=True)))
+    return [(order[white], order[black], result) for white, black, result in
+            ladder.game_set.order_by('datetime', 'id').values_list(
+                'white_id', 'black_id', 'result')]
+
+
+@override_settings(CLUB_GAME_QUEUE=False)
+class SyntheticLadderTests(TestCase):
+
+    def test_seeded(self):
+        ladder = generate_ladder(20, 60, seed=3)
+        self.assertEqual(ladder.ranking_set.count(), 20)
+        games = game_table(ladder)
+        self.assertEqual(len(games), 60)
+        self.assertEqual(games, game_table(generate_ladder(20, 60, seed=3)))
+        self.assertNotEqual(games, game_table(generate_ladder(20, 60, seed=4)))
+
+    def test_replayed(self):
+        ladder = generate_ladder(10, 40, seed=1)
+        state = ranking_state(ladder)
+        history = rating_history(ladder)
+        records = head_to_head_table(ladder)
+        self.assertEqual(len(history), 80)
+        crunch_ratings(ladder)
+        self.assertEqual(state, ranking_state(ladder))
+        self.assertEqual(history, rating_history(ladder))
+        self.assertEqual(records, head_to_head_table(ladder))
+
+
+@override_settings(CLUB_GAME_QUEUE=False, CACHES=NO_CACHE,
+                   STATICFILES_STORAGE=STATIC_STORAGE)
+class BenchmarkTests(TestCase):
+
+    def test_benchmark(self):
+        ladders = Ladder.objects.count()
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command('benchmark', '--sizes=5', '--games-per-player=2',
+                         '--output=%s' % output.name, stderr=StringIO())
+            report = json.load(open(output.name))
+        run, = report['runs']
+        self.assertEqual((run['players'], run['games']), (5, 10))
+        self.assertEqual(sorted(run['steps']), [
+            'full replay', 'generate', 'process confirmed game',
+            'rank shift at bottom', 'rank shift at top',
+            'rank shift bottom to top', 'standings page'])
+        self.assertTrue(all(step['queries'] > 0 for name, step in
+                            run['steps'].items() if name != 'generate'))
+        # rolled back
+        self.assertEqual(Ladder.objects.count(), ladders)
+
+    def test_too_small(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmark', '--sizes=1', stderr=StringIO())
+
+
+@override_settings(CLUB_GAME_QUEUE=False)
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings_override = override_settings(CLUB_METRICS_DIR=self.directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.ladder, self.players = make_ladder(2)
+        self.labels = '{algorithm="fide",ladder="%d"}' % self.ladder.id
+
+    def lines(self):
+        return metrics.exposition().splitlines()
+
+    def test_pipeline(self):
+        a, b = self.players
+        # an upset, so the winner moves up
+        play(self.ladder, b, a, 0)
+        lines = self.lines()
+        self.assertIn('club_games_processed_total%s 1' % self.labels, lines)
+        self.assertIn('club_process_game_seconds_count%s 1' % self.labels,
+                      lines)
+        self.assertIn('club_set_ratings_seconds_count%s 1' % self.labels,
+                      lines)
+        self.assertIn('club_rank_update_seconds_count{algorithm="fide",'
+                      'ladder="%d",operation="insert"} 1' % self.ladder.id,
+                      lines)
+
+        crunch_ratings(self.ladder)
+        lines = self.lines()
+        self.assertIn('club_games_replayed_total%s 1' % self.labels, lines)
+        self.assertIn('club_replay_seconds_count{algorithm="fide",kind="full",'
+                      'ladder="%d"} 1' % self.ladder.id, lines)
+
+    def test_histogram(self):
+        labels = {'ladder': 'buckets-%d' % self.ladder.id}
+        for value in (0.003, 0.004, 100):
+            metrics.PROCESS_GAME.observe(value, **labels)
+        name = 'club_process_game_seconds%%s{ladder="%s"%%s}' % labels[
+            'ladder']
+        lines = self.lines()
+        for suffix, extra, value in (('_bucket', ',le="0.0025"', '0'),
+                                     ('_bucket', ',le="0.005"', '2'),
+                                     ('_bucket', ',le="60.0"', '2'),
+                                     ('_bucket', ',le="+Inf"', '3'),
+                                     ('_count', '', '3')):
+            self.assertIn('%s %s' % (name % (suffix, extra), value), lines)
+        self.assertIn('# TYPE club_process_game_seconds histogram', lines)
+
+    def test_processes_are_summed(self):
+        a, b = self.players
+        play(self.ladder, a, b, 0)
+        with open(os.path.join(self.directory, 'metrics-1-1.json'), 'w') as f:
+            json.dump([['club_games_processed_total',
+                        [['algorithm', 'fide'], ['ladder', str(self.ladder.id)]],
+                        5]], f)
+        # unreadable files are skipped
+        with open(os.path.join(self.directory, 'metrics-2-1.json'), 'w') as f:
+            f.write('[[')
+        self.assertIn('club_games_processed_total%s 6' % self.labels,
+                      self.lines())
+
+    def test_view_is_for_staff(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(self.players[0].user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(User.objects.create(username='staff',
+                                                    is_staff=True))
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'],
+                         'text/plain; version=0.0.4')
+        self.assertContains(response, '# TYPE club_games_processed_total '
+                                      'counter')
+
+
+class QueryPlanTests(TestCase):
+    """Every hot query is served by an index, without a full scan or sort"""
+
+    def test_hot_queries_use_indexes(self):
+        make_ladder(2)
+        failures = ['%s:\n    %s' % (query.name, '\n    '.join(plan))
+                    for query, plan, problems in check_plans() if problems]
+        self.assertFalse(failures, '\n'.join(failures))
+
+
+@override_settings(CLUB_GAME_QUEUE=False, CLUB_REQUEST_TIMING=True,
+                   CLUB_QUERY_BUDGETS_STRICT=False, CACHES=NO_CACHE,
+                   STATICFILES_STORAGE=STATIC_STORAGE)
+class QueryBudgetTests(TestCase):
+    """Every page stays within its CLUB_QUERY_BUDGETS entry"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ladder, players = make_ladder(6)
+        for i, (white, black) in enumerate(((0, 1), (2, 3), (4, 5), (1, 2),
+                                            (3, 4), (0, 2))):
+            play(cls.ladder, players[white], players[black], i % 3,
+                 pgn='1. e4 c5 2. Nf3 d6', eco='B50')
+        cls.user = players[0].user
+        # the visitor's record is looked up on other players' pages
+        cls.other = reverse('player-detail', args=[players[1].id])
+
+    def assert_within_budgets(self):
+        for path in sample_paths() + [self.other]:
+            response = self.client.get(path + '?q=l' if path.endswith(
+                'players.json') else path)
+            # anonymous requests to login-only pages are redirected
+            self.assertIn(response.status_code, (200, 302), path)
+            timing = response.timing
+            budget = settings.CLUB_QUERY_BUDGETS.get(timing['view'])
+            self.assertIsNotNone(budget, timing['view'])
+            self.assertLessEqual(timing['queries'], budget, '%s ran %d '
+                                 'queries, over its budget of %d' % (
+                                     path, timing['queries'], budget))
+
+    def test_anonymous(self):
+        self.assert_within_budgets()
+
+    def test_logged_in(self):
+        self.client.force_login(self.user)
+        self.assert_within_budgets()
+
+
+def rating_history(ladder):
+    """Every Rating row of a ladder with the game it belongs to"""
+    return list(ladder.rating_set.order_by('game', 'player').values_list(
+        'game', 'player', 'rating', 'deviation', 'volatility', 'timestamp'))
+
+
+@override_settings(CLUB_GAME_QUEUE=False)
+class RatingPeriodTests(TestCase):
+
+    def test_incremental_equals_full_replay(self):
+        ladder, players = make_ladder(4, method='glicko2')
+        ladder.algorithm.params = {'period': 'week'}
+        ladder.algorithm.save()
+        a, b, c, d = players
+        monday = datetime.datetime(2016, 3, 7, 18, tzinfo=timezone.utc)
+        with explicit_game_datetimes():
+            # three weeks, a week off, then a game reported late into the
+            # first week
+            for day, white, black, result in ((0, a, b, 0), (2, c, d, 2),
+                                              (3, a, c, 1), (8, b, d, 0),
+                                              (9, a, d, 0), (15, c, b, 1),
+                                              (29, d, a, 2), (4, b, c, 0)):
+                play(ladder, white, black, result,
+                     datetime=monday + datetime.timedelta(days=day))
+        self.assertEqual(ladder.rating_set.filter(
+            deviation__isnull=False).count(), 16)
+        incremental = rating_history(ladder), ranking_state(ladder)
+        crunch_ratings(ladder)
+        self.assertEqual(incremental,
+                         (rating_history(ladder), ranking_state(ladder)))
+
+
+def simulate_round(snapshot, pairing, rng):
+    """Play the boards of a pairing into the snapshot"""
+    score, rating = snapshot.score, snapshot.rating
+    for white, black in pairing.boards:
+        snapshot.colours[white].append(1)
+        snapshot.colours[black].append(-1)
+        snapshot.opponents[white].add(black)
+        snapshot.opponents[black].add(white)
+        expected = 1 / (1 + 10 ** ((rating[black] - rating[white]) / 400.0))
+        roll = rng.random()
+        if roll < 0.2:
+            score[white] += 0.5
+            score[black] += 0.5
+        elif roll < 0.2 + 0.8 * expected:
+            score[white] += 1
+        else:
+            score[black] += 1
+    if pairing.bye is not None:
+        snapshot.byes.add(pairing.bye)
+        score[pairing.bye] += 1
+    players = sorted(rating, key=lambda p: (-score[p], -rating[p], p))
+    return snapshot._replace(players=players,
+                             next_round=snapshot.next_round + 1)
+
+
+class SwissPairingTests(SimpleTestCase):
+
+    def start(self, players, seed=0):
+        rng = random.Random(seed)
+        rating = dict((p, rng.gauss(1500, 250)) for p in range(players))
+        return Snapshot(sorted(rating, key=lambda p: -rating[p]), rating,
+                        dict.fromkeys(rating, 0),
+                        dict((p, []) for p in rating),
+                        dict((p, set()) for p in rating), set(), 1, 0), rng
+
+    def test_first_round_top_half_against_bottom_half(self):
+        snapshot, rng = self.start(8)
+        boards = pair_round(snapshot).boards
+        top = snapshot.players
+        self.assertEqual([set(board) for board in boards],
+                         [set((top[i], top[i + 4])) for i in range(4)])
+        # the top seed alternates colours down the boards
+        self.assertEqual([board[0] in top[:4] for board in boards],
+                         [True, False, True, False])
+
+    def test_large_field(self):
+        snapshot, rng = self.start(501)
+        for round in range(9):
+            started = time.time()
+            pairing = pair_round(snapshot)
+            self.assertLess(time.time() - started, 1)
+
+            paired = [player for board in pairing.boards for player in board]
+            self.assertEqual(len(paired), len(set(paired)))
+            self.assertEqual(set(paired) | set([pairing.bye]),
+                             set(snapshot.players))
+            self.assertNotIn(pairing.bye, snapshot.byes)
+            for white, black in pairing.boards:
+                self.assertNotIn(black, snapshot.opponents[white])
+            snapshot = simulate_round(snapshot, pairing, rng)
+            for history in snapshot.colours.values():
+                self.assertLessEqual(abs(sum(history)), 2)
+
+    def test_too_few_players(self):
+        snapshot, rng = self.start(1)
+        self.assertRaises(PairingError, pair_round, snapshot)
+
+
+@override_settings(CLUB_GAME_QUEUE=False)
+class SwissRoundTests(TestCase):
+
+    def setUp(self):
+        self.tourney, self.players = make_ladder(5, ladder_type=1)
+        self.staff = User.objects.create(username='director', is_staff=True)
+
+    def enter_results(self, round):
+        self.client.force_login(self.staff)
+        for game in Game.objects.filter(ladder=self.tourney, round=round):
+            response = self.client.post(
+                reverse('game-detail', args=[game.id]), {'result': 2})
+            self.assertEqual(response.status_code, 302)
+
+    def test_rounds(self):
+        with self.assertNumQueries(3):
+            tournament_snapshot(self.tourney)
+        round, pairing = create_round(self.tourney)
+        self.assertEqual(round, 1)
+        games = Game.objects.filter(ladder=self.tourney)
+        self.assertEqual(sorted(games.values_list('white', 'black')),
+                         sorted(pairing.boards))
+        self.assertEqual(set(games.values_list('round', 'status', 'result')),
+                         set([(1, 5, None)]))
+        self.assertEqual(list(Bye.objects.values_list('player', 'round')),
+                         [(pairing.bye, 1)])
+
+        # the round is unfinished
+        self.assertRaises(PairingError, create_round, self.tourney)
+
+        self.enter_results(1)
+        self.assertEqual(set(games.values_list('status', 'result')),
+                         set([(4, 2)]))
+        round, second = create_round(self.tourney)
+        self.assertEqual(round, 2)
+        self.assertNotEqual(second.bye, pairing.bye)
+        first = set(frozenset(board) for board in pairing.boards)
+        self.assertFalse(first & set(frozenset(board)
+                                     for board in second.boards))
+        snapshot = tournament_snapshot(self.tourney)
+        self.assertEqual(snapshot.score[pairing.bye], 1)
+        self.assertEqual((snapshot.next_round, snapshot.unfinished), (3, 2))
+
+    def test_player_reports_opponent_confirms(self):
+        round, pairing = create_round(self.tourney)
+        white, black = pairing.boards[0]
+        game = Game.objects.get(ladder=self.tourney, white=white, black=black)
+        url = reverse('game-detail', args=[game.id])
+
+        self.client.force_login(User.objects.get(player=white))
+        self.client.post(url, {'result': 0})
+        game.refresh_from_db()
+        self.assertEqual((game.status, game.result), (1, 0))
+
+        self.client.force_login(User.objects.get(player=black))
+        self.client.post(url, {'response': 0})
+        game.refresh_from_db()
+        self.assertEqual(game.status, 4)
+        self.assertEqual(tournament_snapshot(self.tourney).score[white], 1)
+
+    def test_reporter_cannot_confirm(self):
+        round, pairing = create_round(self.tourney)
+        white, black = pairing.boards[0]
+        game = Game.objects.get(ladder=self.tourney, white=white, black=black)
+        url = reverse('game-detail', args=[game.id])
+
+        self.client.force_login(User.objects.get(player=black))
+        self.client.post(url, {'result': 1})
+        response = self.client.post(url, {'response': 0})
+        self.assertEqual(response.status_code, 403)
+        game.refresh_from_db()
+        self.assertEqual((game.status, game.result), (2, 1))
+
+        self.client.force_login(self.staff)
+        self.client.post(url, {'response': 0})
+        game.refresh_from_db()
+        self.assertEqual(game.status, 4)
+
+    def test_outsiders_cannot_enter_results(self):
+        round, pairing = create_round(self.tourney)
+        game = Game.objects.filter(ladder=self.tourney).first()
+        outsider = User.objects.get(player=pairing.bye)
+        self.client.force_login(outsider)
+        response = self.client.post(reverse('game-detail', args=[game.id]),
+                                    {'result': 0})
+        self.assertEqual(response.status_code, 403)
+        game.refresh_from_db()
+        self.assertEqual((game.status, game.result), (5, None))
+
+    def test_report_form_refuses_tournaments(self):
+        # posting a ladder the players have joined does not help
+        ladder = Ladder.objects.create(name='Ladder', ladder_type=0,
+                                       algorithm=self.tourney.algorithm)
+        white, black = self.players[:2]
+        for player in (white, black):
+            Ranking.objects.create(player=player, ladder=ladder)
+        self.client.force_login(self.staff)
+        response = self.client.post(
+            reverse('report-games', args=[self.tourney.id]), {
+                'white': white.user.username, 'black': black.user.username,
+                'time_control': '15+10', 'result': 0,
+                'datetime': '2016-04-01 12:00', 'ladder': ladder.id})
+        self.assertContains(response, 'entered on the page of the paired')
+        self.assertFalse(Game.objects.exists())
+
+    def test_confirmed_games_need_a_result(self):
+        round, pairing = create_round(self.tourney)
+        game = Game.objects.filter(ladder=self.tourney).first()
+        game.full_clean()
+        game.status = 3
+        self.assertRaises(ValidationError, game.full_clean)
+        self.assertRaises(ValidationError, game.save)
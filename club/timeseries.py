@@ -0,0 +1,52 @@
+"""
+Downsampling of rating histories for charts.
+
+A series is a list of (timestamp, rating) pairs in time order. Every method
+keeps the last point of each bucket, so the final point of a series is always
+the current rating.
+"""
+
+BUCKETS = ('day', 'week')
+
+
+def bucket_key(timestamp, bucket):
+    if bucket == 'day':
+        return timestamp.date()
+    if bucket == 'week':
+        return timestamp.isocalendar()[:2]
+    raise ValueError('Unknown bucket: %r' % (bucket,))
+
+
+def last_per_bucket(series, bucket):
+    """Keep the last point of each calendar day or ISO week"""
+    sampled = []
+    previous = None
+    for point in series:
+        key = bucket_key(point[0], bucket)
+        if sampled and key == previous:
+            sampled[-1] = point
+        else:
+            sampled.append(point)
+        previous = key
+    return sampled
+
+
+def limit_points(series, budget):
+    """
+    Keep at most `budget` points by splitting the series into `budget` runs of
+    consecutive points and keeping the last point of each run.
+    """
+    if budget < 1:
+        raise ValueError('Point budget must be positive')
+    if len(series) <= budget:
+        return list(series)
+    step = float(len(series)) / budget
+    return [series[int(round((i + 1) * step)) - 1] for i in range(budget)]
+
+
+def downsample(series, bucket=None, points=None):
+    if bucket:
+        series = last_per_bucket(series, bucket)
+    if points:
+        series = limit_points(series, points)
+    return series
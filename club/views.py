@@ -1,21 +1,37 @@
 import datetime
+import hashlib
 from django.core.urlresolvers import reverse
-from django.http import HttpResponse
+from django.db import models, transaction
+from django.http import HttpResponse, HttpResponseForbidden, \
+    HttpResponseBadRequest, HttpResponseRedirect, JsonResponse, \
+    StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django.template import RequestContext, loader
-from django.views.generic import DetailView, ListView, TemplateView, FormView
+from django.utils.dateparse import parse_datetime
+from django.utils.decorators import method_decorator
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.http import condition
+from django.views.generic import DetailView, ListView, TemplateView, \
+    FormView, View
 from django.views.generic.edit import CreateView, FormMixin
 from django.contrib.auth.mixins import LoginRequiredMixin
-from club.models import Player, Ranking, Ladder, Game
-from club.forms import PGNForm, GameForm, ConfirmGameForm
+from club.models import Player, Ranking, Ladder, Game, Rating, \
+    OpeningStat, head_to_head, ladder_standings, with_current_ranks
+from club.forms import PGNForm, GameForm, ConfirmGameForm, ResultForm
+from club import export, metrics, openings, swiss, timeseries
+from club.pagination import KeysetPaginationMixin
 from django.db.models import Q
 
 
 class PlayerDetailView(DetailView):
-    model = Player
+    queryset = Player.objects.select_related('user')
 
     def get_context_data(self, **kwargs):
         context = super(PlayerDetailView, self).get_context_data(**kwargs)
-
+        user = self.request.user
+        if user.is_authenticated() and user.player.id != self.object.id:
+            # the visitor's record against this player, on every ladder
+            context['records'] = head_to_head(user.player.id, self.object.id)
         return context
 
 
@@ -24,13 +40,11 @@ class LadderDetailView(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super(LadderDetailView, self).get_context_data(**kwargs)
-        rankings = self.object.ranking_set.order_by('rank')
-        context['ranking_list'] = rankings
-
-        ratings = list((ranking.player, ranking.int_rating)
-                       for ranking in rankings)
-        ratings = sorted(ratings, key=lambda x: x[1],  reverse=True)
-        context['rating_list'] = ratings
+        # only evaluated when the cached standings fragment is stale
+        standings = SimpleLazyObject(lambda: ladder_standings(self.object))
+        context['ranking_list'] = standings
+        context['rating_list'] = SimpleLazyObject(lambda: sorted(
+            standings, key=lambda x: x.rating, reverse=True))
         context['timestamp'] = datetime.datetime.now()
         return context
 
@@ -41,13 +55,11 @@ class TourneyDetailView(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super(TourneyDetailView, self).get_context_data(**kwargs)
-        rankings = self.object.ranking_set.order_by('rank')
-        context['ranking_list'] = rankings
-
-        ratings = list((ranking.player, ranking.int_rating)
-                       for ranking in rankings)
-        ratings = sorted(ratings, key=lambda x: x[1],  reverse=True)
-        context['rating_list'] = ratings
+        # only evaluated when the cached standings fragment is stale
+        standings = SimpleLazyObject(lambda: ladder_standings(self.object))
+        context['ranking_list'] = standings
+        context['rating_list'] = SimpleLazyObject(lambda: sorted(
+            standings, key=lambda x: x.rating, reverse=True))
         context['timestamp'] = datetime.datetime.now()
         return context
 
@@ -72,6 +84,12 @@ class LadderListView(ListView):
         context['closed_ladder_list'] = \
             ladders.exclude(end_date=None).order_by('-start_date')
         context['tourney_list'] = tourneys.order_by('-start_date')
+        # key of the cached list: changes when a ladder is added, removed or
+        # edited
+        state = queryset.aggregate(count=models.Count('id'),
+                                   last=models.Max('id'),
+                                   versions=models.Sum('version'))
+        context['ladders_version'] = '%(count)s.%(last)s.%(versions)s' % state
         return context
 
 
@@ -84,7 +102,7 @@ class TourneyListView(ListView):
         return queryset.filter(ladder_type=1)
 
 
-class LadderGameListView(ListView):
+class LadderGameListView(KeysetPaginationMixin, ListView):
     model = Game
     template_name = 'club/ladder_games.html'
 
@@ -101,14 +119,31 @@ class LadderGameListView(ListView):
         return context
 
 
-class TourneyGameListView(ListView):
+class LadderOpeningsView(ListView):
+    """Opening frequency and score table of a ladder, from OpeningStat"""
+    model = OpeningStat
+    template_name = 'club/ladder_openings.html'
+
+    def get_queryset(self):
+        return OpeningStat.objects.filter(
+            ladder=self.kwargs['pk']).order_by('-games', 'eco')
+
+    def get_context_data(self, **kwargs):
+        context = super(LadderOpeningsView, self).get_context_data(**kwargs)
+        context['ladder'] = get_object_or_404(Ladder, id=self.kwargs['pk'])
+        return context
+
+
+class TourneyGameListView(KeysetPaginationMixin, ListView):
     model = Game
     template_name = 'club/tourney_games.html'
+    # rounds are played in order, so chronological order follows the rounds
+    newest_first = False
 
     def get_queryset(self):
         queryset = super(TourneyGameListView, self).get_queryset()
         ladder_id = self.kwargs['pk']
-        return queryset.filter(ladder=ladder_id).order_by('round')
+        return queryset.filter(ladder=ladder_id)
 
     def get_context_data(self, **kwargs):
         context = super(TourneyGameListView, self).get_context_data(**kwargs)
@@ -117,16 +152,37 @@ class TourneyGameListView(ListView):
         return context
 
 
-class GameListView(LoginRequiredMixin, ListView):
+class TourneyPairView(View):
+    """Pair the next round of a tournament, for staff only"""
+
+    def post(self, request, pk):
+        if not request.user.is_staff:
+            return HttpResponseForbidden()
+        ladder = get_object_or_404(Ladder, id=pk, ladder_type=1)
+        try:
+            swiss.create_round(ladder, force=bool(request.POST.get('force')))
+        except swiss.PairingError as e:
+            return HttpResponseBadRequest(str(e))
+        return HttpResponseRedirect(reverse('tourney-games', args=[ladder.id]))
+
+
+class GameListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Game
     redirect_field_name = '/games/'
     
 
 class GameDetailView(LoginRequiredMixin, FormMixin, DetailView):
-    model = Game
+    queryset = Game.objects.select_related('white__user', 'black__user',
+                                           'ladder')
     redirect_field_name = '/games/'
     form_class = ConfirmGameForm
     success_url = '/games/'
+
+    def get_form_class(self):
+        # paired tournament games take a result, reported games a response
+        if self.object.status == 5:
+            return ResultForm
+        return self.form_class
     
     def get_context_data(self, **kwargs):
         context = super(GameDetailView, self).get_context_data(**kwargs)
@@ -137,6 +193,8 @@ class GameDetailView(LoginRequiredMixin, FormMixin, DetailView):
             context['user_can_edit_pgn'] = True
         else:
             context['user_can_edit_pgn'] = False
+        records = head_to_head(game.white_id, game.black_id, game.ladder_id)
+        context['record'] = records[0] if records else None
         return context
 
     def post(self, request, *args, **kwargs):
@@ -150,15 +208,47 @@ class GameDetailView(LoginRequiredMixin, FormMixin, DetailView):
             return self.form_invalid(form)
 
     def form_valid(self, form):
-        
-        if form.data['response'] == '0':
+        with transaction.atomic():
+            # re-read under lock: a double-submitted response is a no-op
+            self.object = Game.objects.select_for_update().get(
+                id=self.object.id)
+            if self.object.status == 5 and isinstance(form, ResultForm):
+                return self.result_entered(form.cleaned_data['result'])
+            if self.object.status not in (1, 2) or \
+                    not isinstance(form, ConfirmGameForm):
+                return super(GameDetailView, self).form_valid(form)
+            # the reporting player's opponent answers (or staff confirm)
+            opponent = self.object.black_id if self.object.status == 1 \
+                else self.object.white_id
+            if self.request.user.player.id != opponent and \
+                    not self.request.user.is_staff:
+                return HttpResponseForbidden()
+            if form.data['response'] == '0':
+                self.object.status = 3
+            elif form.data['response'] == '1' and self.object.white == self.request.user.player:
+                self.object.status = -1
+            elif form.data['response'] == '1' and self.object.black == self.request.user.player:
+                self.object.status = -2
+            self.object.save()
+        return super(GameDetailView, self).form_valid(form)
+
+    def result_entered(self, result):
+        """
+        Result of a paired game: final when entered by staff, otherwise
+        reported by one player for the other to confirm.
+        """
+        user = self.request.user
+        if user.is_staff:
             self.object.status = 3
-        elif form.data['response'] == '1' and self.object.white == self.request.user.player:
-            self.object.status = -1
-        elif form.data['response'] == '1' and self.object.black == self.request.user.player:
-            self.object.status = -2
+        elif self.object.white_id == user.player.id:
+            self.object.status = 1
+        elif self.object.black_id == user.player.id:
+            self.object.status = 2
+        else:
+            return HttpResponseForbidden()
+        self.object.result = result
         self.object.save()
-        return super(GameDetailView, self).form_valid(form)
+        return HttpResponseRedirect(self.get_success_url())
 
 
 class ToolView(LoginRequiredMixin, TemplateView):
@@ -169,22 +259,17 @@ class ReportGameView(LoginRequiredMixin, CreateView):
     template_name = 'club/report_game.html'
     form_class = GameForm
     success_url = '/ladders/{ladder_id}/games'
-    
-    @property
-    def initial(self):
-        ladder_id = self.kwargs.get('pk', None)
-        if ladder_id:
-            return {'ladder': Ladder.objects.get(id=ladder_id)}
-        else:
-            return {}
+
+    def get_form_kwargs(self):
+        kwargs = super(ReportGameView, self).get_form_kwargs()
+        kwargs['ladder'] = get_object_or_404(Ladder, id=self.kwargs['pk'])
+        return kwargs
 
     def form_valid(self, form):
-        white = Player.objects.get(id=form.data['white'])
-        black = Player.objects.get(id=form.data['black'])
-        ladder_id = self.kwargs.get('pk', None)
-        ladder = Ladder.objects.get(id=ladder_id)
-        form.instance.ladder = ladder
-        
+        white = form.cleaned_data['white']
+        black = form.cleaned_data['black']
+        form.instance.ladder = form.ladder
+
         if self.request.user.is_staff:
             form.instance.status = 3
         elif self.request.user.player == white:
@@ -232,6 +317,11 @@ class PGNView(LoginRequiredMixin, FormView):
     def form_valid(self, form):
         game = Game.objects.get(id=self.kwargs.get('pk'))
         game.pgn = form.data['pgn_string']
+        opening = openings.classify(game.pgn)
+        if opening is not None:
+            game.eco = opening[0]
+        # a processed game's new eco reaches the opening tables via
+        # update_opening_stats
         game.save()
         return super(PGNView, self).form_valid(form)
 
@@ -242,24 +332,158 @@ class ProfileView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super(ProfileView, self).get_context_data(**kwargs)
         player = self.request.user.player
-        rankings = Ranking.objects.filter(player=player)
-        ratings_rankings_list = []
-        for ranking in rankings:
-            ratings_rankings_list.append(
-                (ranking.ladder, ranking.rank,
-                 ranking.player.int_rating(ranking.ladder)))
-
-        context['ratings_rankings_list'] = ratings_rankings_list
-
-        ladder_games = Game.objects.filter(Q(white=player) | Q(black=player))
-        reported = ladder_games.filter(
-            Q(white=player, status=1)|Q(black=player, status=2))
-        awaiting = ladder_games.filter(
-            Q(white=player, status=2)|Q(black=player, status=1))
-        disputed = ladder_games.filter(status__in=[-1, -2])
+        # current ratings and game counters are stored on the rankings, and
+        # sparse ranks are counted in the same query: one query for all
+        # ladders
+        rankings = with_current_ranks(Ranking.objects.filter(
+            player=player).select_related('ladder').order_by('ladder__name'))
+        context['ratings_rankings_list'] = [
+            (ranking.ladder, ranking.current_rank, ranking.int_rating, ranking)
+            for ranking in rankings]
+
+        # one query for every game that still needs attention, split here
+        reported, awaiting, disputed, paired = [], [], [], []
+        games = Game.objects.filter(
+            Q(white=player) | Q(black=player),
+            status__in=[-2, -1, 1, 2, 5]).select_related(
+            'white__user', 'black__user').order_by('-datetime', '-id')
+        for game in games:
+            if game.status == 5:
+                paired.append(game)
+            elif game.status < 0:
+                disputed.append(game)
+            elif (game.white_id == player.id) == (game.status == 1):
+                reported.append(game)
+            else:
+                awaiting.append(game)
         context['awaiting'] = awaiting
         context['reported'] = reported
         context['disputed'] = disputed
+        context['paired'] = paired
 
         return context
 
+
+
+class PlayerAutocompleteView(View):
+    """
+    Players of a ladder whose username starts with ?q= (case-insensitive), as
+    JSON, for the game report form. Served by a prefix index on username.
+    """
+    limit = 20
+
+    def get(self, request, pk):
+        prefix = request.GET.get('q', '')
+        players = Ranking.objects.filter(
+            ladder=pk, player__user__username__istartswith=prefix).order_by(
+            'player__user__username').values_list(
+            'player_id', 'player__user__username')[:self.limit]
+        return JsonResponse({'players': [
+            {'id': player_id, 'username': username}
+            for player_id, username in players]})
+
+
+class LadderExportView(View):
+    """
+    A ladder's processed public games as one PGN file or a CSV table,
+    streamed in chunks so memory use does not grow with the ladder.
+    """
+
+    def get(self, request, pk, format):
+        ladder = get_object_or_404(Ladder, id=pk)
+        generate, content_type = export.FORMATS[format]
+        response = StreamingHttpResponse(generate(ladder),
+                                         content_type=content_type)
+        response['Content-Disposition'] = \
+            'attachment; filename="ladder-%d.%s"' % (ladder.id, format)
+        return response
+
+
+def rating_history_query(ladder_id, player_id=None, since=None, until=None):
+    ratings = Rating.objects.filter(ladder=ladder_id)
+    if player_id is not None:
+        ratings = ratings.filter(player=player_id)
+    if since is not None:
+        ratings = ratings.filter(timestamp__gte=since)
+    if until is not None:
+        ratings = ratings.filter(timestamp__lt=until)
+    return ratings
+
+
+def rating_history_etag(request, pk, player_pk=None):
+    # Replays delete and recreate rows, so the newest id and the row count
+    # change whenever the history does.
+    state = rating_history_query(pk, player_pk).aggregate(
+        last=models.Max('id'), count=models.Count('id'))
+    key = '%s:%s:%s:%s:%s' % (pk, player_pk, state['last'], state['count'],
+                              request.GET.urlencode())
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+class RatingHistoryView(View):
+    """
+    Rating over time as JSON, for one player of a ladder or for every player
+    of it. Optional query parameters: since and until (ISO datetimes), bucket
+    (day or week: last rating of each) and points (at most this many points
+    per player).
+    """
+
+    @method_decorator(condition(etag_func=rating_history_etag))
+    def dispatch(self, *args, **kwargs):
+        return super(RatingHistoryView, self).dispatch(*args, **kwargs)
+
+    def get(self, request, pk, player_pk=None):
+        ladder = get_object_or_404(Ladder, id=pk)
+        try:
+            since, until = [self.parse_time(request.GET.get(name))
+                            for name in ('since', 'until')]
+            bucket = request.GET.get('bucket') or None
+            if bucket is not None and bucket not in timeseries.BUCKETS:
+                raise ValueError('bucket must be one of %s'
+                                 % ', '.join(timeseries.BUCKETS))
+            points = request.GET.get('points')
+            points = int(points) if points else None
+            if points is not None and points < 1:
+                raise ValueError('points must be positive')
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+
+        rows = rating_history_query(ladder.id, player_pk, since, until)
+        rows = rows.order_by('player', 'timestamp', 'id').values_list(
+            'player_id', 'timestamp', 'rating')
+        series = {}
+        for player_id, timestamp, rating in rows.iterator():
+            series.setdefault(player_id, []).append((timestamp, rating))
+
+        names = dict(Ranking.objects.filter(
+            ladder=ladder, player__in=list(series)).values_list(
+            'player_id', 'player__user__username'))
+        players = []
+        for player_id in sorted(series):
+            sampled = timeseries.downsample(series[player_id], bucket, points)
+            players.append({
+                'id': player_id,
+                'username': names.get(player_id),
+                'ratings': [[timestamp.isoformat(), float(rating)]
+                            for timestamp, rating in sampled],
+            })
+        return JsonResponse({'ladder': ladder.id, 'players': players})
+
+    @staticmethod
+    def parse_time(value):
+        if not value:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError('Invalid datetime: %s' % value)
+        return parsed
+
+
+class MetricsView(View):
+    """Rating and ranking pipeline metrics for Prometheus, for staff only"""
+
+    def get(self, request):
+        if not request.user.is_staff:
+            return HttpResponseForbidden()
+        return HttpResponse(metrics.exposition(),
+                            content_type='text/plain; version=0.0.4')
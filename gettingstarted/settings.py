@@ -31,6 +31,55 @@ DEBUG = False
 LOGIN_URL = '/login'
 LOGIN_REDIRECT_URL = '/profile/'
 
+# Confirmed games are rated and ranked by the process_games worker. Set to
+# False to process them inside the confirming request instead.
+CLUB_GAME_QUEUE = True
+
+# Query count, SQL, view and template timings of every request, as a
+# Server-Timing header and club.requests log lines (club.middleware).
+CLUB_REQUEST_TIMING = bool(os.environ.get('REQUEST_TIMING'))
+
+# Most queries a request to each view may run, sessions and auth included.
+# Requests over budget are logged, or raise QueryBudgetExceeded when
+# CLUB_QUERY_BUDGETS_STRICT is set. club.tests.QueryBudgetTests checks one
+# page of each view; the check_query_budgets command does the same against
+# a real database.
+CLUB_QUERY_BUDGETS = {
+    'club.views.LadderListView': 5,
+    'club.views.LadderDetailView': 5,
+    'club.views.TourneyDetailView': 5,
+    'club.views.LadderGameListView': 5,
+    'club.views.TourneyGameListView': 5,
+    'club.views.LadderOpeningsView': 5,
+    'club.views.GameListView': 5,
+    'club.views.GameDetailView': 6,
+    'club.views.PlayerDetailView': 5,
+    'club.views.PlayerListView': 4,
+    'club.views.ProfileView': 5,
+    'club.views.PlayerAutocompleteView': 4,
+    'club.views.RatingHistoryView': 6,
+}
+CLUB_QUERY_BUDGETS_STRICT = False
+
+# Where each process writes its pipeline metrics for /metrics (club.metrics)
+CLUB_METRICS_DIR = os.environ.get('METRICS_DIR',
+                                  os.path.join(BASE_DIR, '.metrics'))
+
+# Level of the club loggers. The per-request club.requests lines are INFO,
+# so set LOG_LEVEL=INFO with REQUEST_TIMING to see them. By default only
+# warnings and errors (queries over budget, failed game jobs) are shown.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'club': {'handlers': ['console'],
+                 'level': os.environ.get('LOG_LEVEL', 'WARNING')},
+    },
+}
+
 # Application definition
 
 INSTALLED_APPS = (
@@ -44,6 +93,7 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'club.middleware.RequestTimingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -86,6 +136,19 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/1.9/topics/cache/
+# Ladder pages cache their fragments keyed on Ladder.version. A file backend
+# is shared by all gunicorn workers on a host.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CACHE_DIR',
+                                   os.path.join(BASE_DIR, '.django_cache')),
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
 
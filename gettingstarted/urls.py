@@ -23,6 +23,16 @@ urlpatterns = [
         name='ladder-detail'),
     url(r'^ladders/(?P<pk>[0-9]+)/games$',
         club.views.LadderGameListView.as_view(), name='ladder-games'),
+    url(r'^ladders/(?P<pk>[0-9]+)/ratings\.json$',
+        club.views.RatingHistoryView.as_view(), name='ladder-ratings'),
+    url(r'^ladders/(?P<pk>[0-9]+)/players/(?P<player_pk>[0-9]+)/ratings\.json$',
+        club.views.RatingHistoryView.as_view(), name='player-ratings'),
+    url(r'^ladders/(?P<pk>[0-9]+)/players\.json$',
+        club.views.PlayerAutocompleteView.as_view(), name='ladder-players'),
+    url(r'^ladders/(?P<pk>[0-9]+)/games\.(?P<format>pgn|csv)$',
+        club.views.LadderExportView.as_view(), name='ladder-export'),
+    url(r'^ladders/(?P<pk>[0-9]+)/openings$',
+        club.views.LadderOpeningsView.as_view(), name='ladder-openings'),
     url(r'^ladders/(?P<pk>[0-9]+)/games/report$',
         club.views.ReportGameView.as_view(), name='report-games'),
     url(r'^tourneys/$', club.views.TourneyListView.as_view(),
@@ -31,6 +41,8 @@ urlpatterns = [
         name='tourney-detail'),
     url(r'^tourneys/(?P<pk>[0-9]+)/games$',
         club.views.TourneyGameListView.as_view(), name='tourney-games'),
+    url(r'^tourneys/(?P<pk>[0-9]+)/pair$',
+        club.views.TourneyPairView.as_view(), name='tourney-pair'),
     url(r'^games/$', club.views.GameListView.as_view(), name='game-list'),
     url(r'^games/(?P<pk>[0-9]+)$', club.views.GameDetailView.as_view(),
         name='game-detail'),
@@ -43,5 +55,6 @@ urlpatterns = [
                                            form_class=UserCreationForm,
                                            success_url='/'), name='register'),
     url(r'^profile/$', club.views.ProfileView.as_view(), name='profile'),
+    url(r'^metrics$', club.views.MetricsView.as_view(), name='metrics'),
     
 ]